@@ -1,16 +1,16 @@
 import logging
 import os
 from collections import defaultdict
-from copy import deepcopy
-from dataclasses import dataclass, field
+from copy import copy
+from dataclasses import dataclass, field, fields, replace
 from typing import Literal, Optional, List, Dict, Any, DefaultDict
 
 import torch
 
 from federated_learning.lib.core.helpers import SuperFactory
-from federated_learning.lib.core.observers import EventManager, DifferentialPrivacy
+from federated_learning.lib.core.observers import EventManager
 from federated_learning.mila.factories import AbstractConfiguration
-from federated_learning.lib.core.observers import AbstractEventHandler
+from federated_learning.lib.core.observers import AbstractEventHandler, DifferentialPrivacy
 
 
 @dataclass
@@ -31,6 +31,7 @@ class Config(AbstractConfiguration):
     threshold: Optional[float] = None
     inference_mode: Optional[str] = None
     cross_validation_folds: int = 5
+    parallel_folds: int = 1
     mc_dropout_iterations: int = 5
     mc_dropout_probability: Optional[float] = None
     probe_layer: Optional[str] = None
@@ -42,12 +43,21 @@ class Config(AbstractConfiguration):
 
     epochs: int = 100
     batch_size: int = 32
+    accumulate_steps: int = 1
+    gradient_checkpointing: bool = False
+    checkpoint_segments: int = 2
 
     use_cuda: bool = True
     enabled_gpus: List[int] = field(default_factory=lambda: [0])
+    compile_network: bool = False
+    cuda_graphs: bool = False
+    mixed_precision: Optional[Literal["float16", "bfloat16"]] = None
+    inference_precision: Optional[Literal["float16", "bfloat16"]] = None
 
     cache_location: str = "/tmp/federated/"
     clear_cache: bool = False
+    cache_batches: bool = False
+    featurization_jobs: int = 1
 
     log_level: Literal["debug", "info", "warn", "error", "critical"] = "info"
     log_format: str = ""
@@ -59,21 +69,39 @@ class Config(AbstractConfiguration):
     target_metric: str = "roc_auc"
     optuna_trials: int = 1000
     optuna_init: Optional[Dict[str, Any]] = None
+    optuna_workers: int = 1
+    save_trial_metrics: bool = True
     subset: Optional[Dict[str, Any]] = None
     visualizer: Optional[Dict[str, Any]] = None
 
     def should_parallelize(self) -> bool:
-        return torch.cuda.is_available() and self.use_cuda and len(self.enabled_gpus) > 1
+        return (
+            torch.cuda.is_available() and self.use_cuda and len(self.enabled_gpus) > 1 and not self.is_distributed()
+        )
+
+    def is_distributed(self) -> bool:
+        """True when launched with ``torchrun`` (one process per GPU)"""
+        return torch.distributed.is_available() and int(os.environ.get("WORLD_SIZE", 1)) > 1
+
+    def get_local_rank(self) -> int:
+        return int(os.environ.get("LOCAL_RANK", 0))
+
+    def is_main_process(self) -> bool:
+        """Only the first distributed process saves checkpoints and logs results"""
+        return not self.is_distributed() or int(os.environ.get("RANK", 0)) == 0
 
     def get_device(self) -> torch.device:
-        device_id = self.enabled_gpus[0] if len(self.enabled_gpus) == 1 else 0
+        if self.is_distributed():
+            device_id = self.get_local_rank()
+        else:
+            device_id = self.enabled_gpus[0] if len(self.enabled_gpus) == 1 else 0
+
         device_name = "cuda:" + str(device_id) if torch.cuda.is_available() and self.use_cuda else "cpu"
 
         return torch.device(device_name)
 
     def __post_init__(self):
-        if not os.path.exists(self.output_path):
-            os.makedirs(self.output_path)
+        os.makedirs(self.output_path, exist_ok=True)
 
         logging.basicConfig(format=self.log_format, level=self.log_level.upper())
         logging.getLogger().setLevel(self.log_level.upper())
@@ -88,7 +116,15 @@ class Config(AbstractConfiguration):
             DifferentialPrivacy.setup(**self.differential_privacy["options"])
 
     def cloned_update(self, **kwargs) -> "Config":
-        options = deepcopy(vars(self))
-        options.update(**kwargs)
+        """
+        Top level dictionaries and lists are copied (one level deep), so in-place updates like
+        `config.splitter["test_split"] = ...` do not leak between clones. Deeper values are shared.
+        """
+        options = {}
+        for option in fields(self):
+            value = getattr(self, option.name)
+            if option.name not in kwargs and isinstance(value, (dict, list)):
+                options[option.name] = copy(value)
 
-        return Config(**options)
\ No newline at end of file
+        options.update(**kwargs)
+        return replace(self, **options)
\ No newline at end of file
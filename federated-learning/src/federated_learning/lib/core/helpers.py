@@ -1,13 +1,18 @@
 import datetime
 import hashlib
 import importlib
+import importlib.util
+import inspect
 import json
 import logging
 import os
+import pickle
 import timeit
+from collections import deque
 from dataclasses import dataclass
-from functools import partial, total_ordering
-from typing import Any, Callable, Dict, List, Optional, T, TextIO, Type, Union
+from functools import lru_cache, partial, total_ordering
+from threading import Lock
+from typing import Any, Callable, Dict, FrozenSet, List, NamedTuple, Optional, T, TextIO, Tuple, Type, Union
 
 import humps
 import numpy as np
@@ -30,18 +35,42 @@ class Timer:
         self.start_time = timeit.default_timer()
 
 
+class ConstructionPlan(NamedTuple):
+    instantiator: Type[Any]
+    is_parameterless: bool
+    parameters: FrozenSet[str]
+    attributes: Dict[str, Any]
+    injectables: FrozenSet[str]
+
+
 class SuperFactory:
+    REFLECTION_PREFIXES = ("", "federated_learning.")
+
+    _descendants_cache: Dict[int, Tuple[int, Dict[str, Type[Any]]]] = {}
+    _descendants_lock = Lock()
+
     @staticmethod
     def find_descendants(parent: Type[T]) -> Dict[str, Type[T]]:
-        descendants = {}
+        """
+        Results are cached per parent class. The number of direct subclasses is used as a cheap
+        staleness check, so the tree is only walked again when new subclasses get registered.
+        """
+        signature = len(parent.__subclasses__())
 
-        for child in parent.__subclasses__():
-            descendants[child.__name__] = child
+        with SuperFactory._descendants_lock:
+            cached = SuperFactory._descendants_cache.get(id(parent))
+            if cached is not None and cached[0] == signature:
+                return cached[1]
 
-            if len(child.__subclasses__()) > 0:
-                descendants.update(SuperFactory.find_descendants(child))
+            descendants = {}
+            queue = deque(parent.__subclasses__())
+            while queue:
+                child = queue.popleft()
+                descendants[child.__name__] = child
+                queue.extend(child.__subclasses__())
 
-        return descendants
+            SuperFactory._descendants_cache[id(parent)] = (signature, descendants)
+            return descendants
 
     @staticmethod
     def create(
@@ -77,10 +106,46 @@ class SuperFactory:
             loaded_parameters = {}
 
         dynamic_parameters = dynamic_parameters.copy()
-        if "type" in dynamic_parameters:
+        plan = SuperFactory._resolve_plan(instantiator, dynamic_parameters.pop("type", None))
+        instantiator = plan.instantiator
+
+        if not dynamic_parameters and (not loaded_parameters or plan.is_parameterless):
+            return instantiator()
+
+        parameters = plan.parameters
+        if len(dynamic_parameters) > 0:
+            attributes = plan.attributes
+
+            for option_name, option_value in dynamic_parameters.items():
+                if option_name not in parameters and "kwargs" not in parameters:
+                    raise ReflectionError(
+                        "Unknown option for [{}] ---> [{}]".format(
+                            instantiator.__name__, option_name
+                        )
+                    )
+
+                if type(option_value) is dict and option_name in plan.injectables:
+                    # if the option is a dictionary, and the argument is not expected to be one
+                    # we consider it an additional object which we instantiate/inject recursively
+                    dynamic_parameters[option_name] = SuperFactory.create(
+                        attributes[option_name], option_value
+                    )
+
+        options = dynamic_parameters
+        for key, value in loaded_parameters.items():
+            if key in parameters:
+                options[key] = value
 
-            dependency_type = dynamic_parameters.pop("type")
+        return instantiator(**options)
 
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _resolve_plan(instantiator: Optional[Type[Any]], dependency_type: Optional[str]) -> ConstructionPlan:
+        """
+        Resolves the class to instantiate and inspects its constructor. The result only depends on the
+        requested abstraction and "type" option, so it is computed once per pair and reused afterwards.
+        """
+        if dependency_type is not None:
             if "." in dependency_type:
                 instantiator = SuperFactory.reflect(dependency_type)
             else:
@@ -104,81 +169,92 @@ class SuperFactory:
 
                 instantiator = subclasses.get(dependency_name)
 
-        if not dynamic_parameters and not loaded_parameters:
-            return instantiator()
-
-        parameters = instantiator.__init__.__code__.co_varnames
-        if len(dynamic_parameters) > 0:
-            attributes = instantiator.__init__.__annotations__
-
-            for option_name, option_value in dynamic_parameters.items():
-                if option_name not in parameters and "kwargs" not in parameters:
-                    raise ReflectionError(
-                        "Unknown option for [{}] ---> [{}]".format(
-                            instantiator.__name__, option_name
-                        )
-                    )
-
-                if option_name not in attributes:
-                    continue  # for 3rd party libraries that don't use type hints...
-
-                if type(option_value) is dict and not (
-                    hasattr(attributes[option_name], "_name")
-                    and attributes[option_name]._name == "Dict"
-                ):
-                    # if the option is a dictionary, and the argument is not expected to be one
-                    # we consider it an additional object which we instantiate/inject recursively
-                    dynamic_parameters[option_name] = SuperFactory.create(
-                        attributes[option_name], option_value
-                    )
+        constructor = getattr(instantiator, "__init__", None)
+        code = getattr(constructor, "__code__", None)
+        parameters = frozenset(code.co_varnames) if code is not None else frozenset()
+        is_parameterless = (
+            code is not None
+            and code.co_argcount + code.co_kwonlyargcount == 1  # only "self"
+            and not code.co_flags & (inspect.CO_VARARGS | inspect.CO_VARKEYWORDS)
+        )
+        attributes = getattr(constructor, "__annotations__", {})
 
-        options = dynamic_parameters
-        for key, value in loaded_parameters.items():
-            if key in parameters:
-                options[key] = value
+        injectables = frozenset(
+            name for name, annotation in attributes.items()
+            if not (hasattr(annotation, "_name") and annotation._name == "Dict")
+        )
 
-        return instantiator(**options)
+        return ConstructionPlan(
+            instantiator=instantiator,
+            is_parameterless=is_parameterless,
+            parameters=parameters,
+            attributes=attributes,
+            injectables=injectables,
+        )
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def reflect(dependency: str) -> Type[Any]:
         logging.debug("Reflecting --- {}".format(dependency))
         logging.debug("------------------------------------------------------------")
 
         module, class_name = dependency.rsplit(".", 1)
-        try:
-            return getattr(importlib.import_module(module), class_name)
-        except:
-            module = "federated_learning." + module
-            return getattr(importlib.import_module(module), class_name)
+        for prefix in SuperFactory.REFLECTION_PREFIXES:
+            try:
+                specification = importlib.util.find_spec(prefix + module)
+            except ModuleNotFoundError:  # a parent package is missing
+                specification = None
 
-class CacheManager:
-    def __init__(self, cache_location: str):
-        self._cache_location = cache_location
+            if specification is None:
+                continue
 
-        if not os.path.exists(self._cache_location):
-            os.makedirs(self._cache_location)
+            try:
+                return getattr(importlib.import_module(prefix + module), class_name)
+            except AttributeError:
+                raise ReflectionError("Dependency not found: {} in {}".format(class_name, prefix + module))
 
-    def _sort(self, dictionary: Dict[str, Any]) -> Dict[str, Any]:
-        for key, value in dictionary.items():
-            if type(value) is dict:
-                dictionary[key] = self._sort(value)
+        raise ReflectionError("Module not found: {}".format(module))
 
-        return dict(sorted(dictionary.items()))
+class CacheManager:
+    LEGACY_MAGIC_NUMBER = b"PK\x03\x04"  # zip container written by older versions through torch.save()
 
-    def key(self, **kwargs) -> str:
-        options = self._sort(kwargs)
-        options = json.dumps(options)
+    def __init__(self, cache_location: str):
+        self._cache_location = cache_location
 
+        os.makedirs(self._cache_location, exist_ok=True)
+
+    @staticmethod
+    def key(**kwargs) -> str:
+        options = json.dumps(kwargs, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.blake2b(options.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _sort_legacy(self, dictionary: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            key: self._sort_legacy(value) if type(value) is dict else value
+            for key, value in sorted(dictionary.items())
+        }
+
+    def legacy_key(self, **kwargs) -> str:
+        """Key format used by older versions. Only computed to migrate existing entries on a cache miss."""
+        options = json.dumps(self._sort_legacy(kwargs))
         return hashlib.md5(options.encode("utf-8")).hexdigest()
 
     def has(self, key: str) -> bool:
         return os.path.isfile("{}/{}".format(self._cache_location, key))
 
     def load(self, key: str) -> Any:
-        return torch.load("{}/{}".format(self._cache_location, key))
+        file_path = "{}/{}".format(self._cache_location, key)
 
-    def save(self, data: Any, key: str) -> Any:
-        return torch.save(data, "{}/{}".format(self._cache_location, key))
+        with open(file_path, "rb") as read_buffer:
+            if read_buffer.read(len(self.LEGACY_MAGIC_NUMBER)) == self.LEGACY_MAGIC_NUMBER:
+                return torch.load(file_path)
+
+            read_buffer.seek(0)
+            return pickle.load(read_buffer)
+
+    def save(self, data: Any, key: str) -> None:
+        with open("{}/{}".format(self._cache_location, key), "wb") as write_buffer:
+            pickle.dump(data, write_buffer, protocol=pickle.HIGHEST_PROTOCOL)
 
     def delete(self, key: str) -> None:
         try:
@@ -194,10 +270,20 @@ class CacheManager:
         clear_cache: bool = False,
     ) -> Any:
 
-        cache_key = self.key(**cache_key)
+        options = cache_key
+        cache_key = self.key(**options)
 
         if clear_cache:
             self.delete(cache_key)
+            self.delete(self.legacy_key(**options))
+
+        if not self.has(cache_key):
+            legacy_key = self.legacy_key(**options)
+            if self.has(legacy_key):
+                os.replace(
+                    "{}/{}".format(self._cache_location, legacy_key),
+                    "{}/{}".format(self._cache_location, cache_key),
+                )
 
         if self.has(cache_key):
             return self.load(cache_key)
@@ -220,29 +306,38 @@ class Namespace:
         return key in self.__dict__
 
     def __repr__(self) -> str:
-        representation = ""
-        for key, value in self.__dict__.items():
-            representation += "{}={}, ".format(key, value)
-
-        return "Namespace[{}]".format(representation[:-2])
+        return "Namespace[{}]".format(
+            ", ".join("{}={}".format(key, value) for key, value in self.__dict__.items())
+        )
 
     @staticmethod
     def reduce(namespaces: List["Namespace"], operation: Callable) -> "Namespace":
+        keys = list(vars(namespaces[0]).keys())
+
+        # stack all namespaces into one contiguous array (namespaces x keys x values), each key is reduced on a view
+        try:
+            stacked = np.asarray([[getattr(namespace, key) for key in keys] for namespace in namespaces])
+        except ValueError:
+            stacked = None
+
+        if stacked is not None and stacked.dtype != object and stacked.ndim == 3:
+            return Namespace(**{key: operation(stacked[:, index]) for index, key in enumerate(keys)})
+
+        # keys with a different number of values (or missing values) are stacked one by one
         options = {}
-        for key in vars(namespaces[0]).keys():
-            options[key] = operation(
-                [getattr(namespace, key) for namespace in namespaces]
-            )
+        for key in keys:
+            values = np.asarray([getattr(namespace, key) for namespace in namespaces])
+            options[key] = operation(values)
 
         return Namespace(**options)
 
     @staticmethod
     def max(namespaces: List["Namespace"]) -> "Namespace":
-        return Namespace.reduce(namespaces, np.maximum.reduce)
+        return Namespace.reduce(namespaces, partial(np.max, axis=0))
 
     @staticmethod
     def min(namespaces: List["Namespace"]) -> "Namespace":
-        return Namespace.reduce(namespaces, np.minimum.reduce)
+        return Namespace.reduce(namespaces, partial(np.min, axis=0))
 
     @staticmethod
     def mean(namespaces: List["Namespace"]) -> "Namespace":
@@ -291,19 +386,20 @@ class ConfidenceInterval:
     def compute(
         values: Union[List[List[float]], np.ndarray], z: float = 1.96
     ) -> List["ConfidenceInterval"]:
-        values = np.array(values).transpose()
+        values = np.asarray(values)
+
+        means = values.mean(axis=0)
+        deviations = z * values.std(axis=0) / np.sqrt(values.shape[0])
 
         return [
-            ConfidenceInterval(
-                mean=np.mean(value),
-                deviation=z * np.std(value) / np.sqrt(len(value)),
-                confidence=z,
-            )
-            for value in values
+            ConfidenceInterval(mean=mean, deviation=deviation, confidence=z)
+            for mean, deviation in zip(means.tolist(), deviations.tolist())
         ]
 
 
 class Loggable:
+    BUFFER_SIZE = 1 << 20  # messages are written to disk in chunks of up to 1 MiB
+
     def __init__(self, file_path: str):
         self._logger = self._create_logger(file_path)
 
@@ -311,11 +407,14 @@ class Loggable:
         if "/" in file_path:
             os.makedirs(file_path.rsplit("/", 1)[0], exist_ok=True)
 
-        return open(file_path, "w")
+        return open(file_path, "w", buffering=self.BUFFER_SIZE)
 
     def log(self, message: str) -> None:
         self._logger.write(message)
 
+    def flush(self) -> None:
+        self._logger.flush()
+
     def close(self) -> None:
         self._logger.close()
 
@@ -335,17 +434,22 @@ class HookProbe:
             else getattr(model, "last_hidden_layer_name", None)
         )
 
-        self._cache = []
+        self._sum = None
+        self._count = 0
         self.hook = None
 
         def get_hidden_layer_output(model, input, output):
             if isinstance(output, torch.Tensor):
-                self._cache.append(output.detach())
+                if self._sum is None:
+                    self._sum = output.detach().clone()
+                else:
+                    self._sum.add_(output.detach())
+
+                self._count += 1
 
-        for name, module in model.named_modules():
-            if name == self.module_name:
-                self.hook = module.register_forward_hook(get_hidden_layer_output)
-                break
+        module = self._get_submodule(model, self.module_name)
+        if module is not None:
+            self.hook = module.register_forward_hook(get_hidden_layer_output)
 
         if self.hook is None and self.module_name is not None:
             raise ValueError("Error when selecting layer to probe:"
@@ -354,5 +458,33 @@ class HookProbe:
                 " This parameter should match one of the network module name"
                 " or can be set to 'last_hidden'.")
 
-    def get_probe(self):
-        return torch.stack(self._cache).mean(dim=0)
+    @staticmethod
+    def _get_submodule(model: torch.nn.Module, module_name: Optional[str]) -> Optional[torch.nn.Module]:
+        """Follows the dotted module path directly instead of scanning all named modules."""
+        if module_name is None:
+            return None
+
+        module = model
+        for name in module_name.split("."):
+            module = getattr(module, name, None)
+            if not isinstance(module, torch.nn.Module):
+                return None
+
+        return module
+
+    def remove(self) -> None:
+        if self.hook is not None:
+            self.hook.remove()
+            self.hook = None
+
+    def get_probe(self) -> torch.Tensor:
+        """
+        Returns the average activation on the CPU and releases the accumulated (device) tensor,
+        so no probe memory stays allocated on the GPU between batches.
+        """
+        probe = (self._sum / self._count).cpu()
+
+        self._sum = None
+        self._count = 0
+
+        return probe
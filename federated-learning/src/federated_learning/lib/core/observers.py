@@ -1,54 +1,135 @@
 import logging
+import os
 from abc import ABCMeta, abstractmethod
-from collections import defaultdict, OrderedDict
-from typing import DefaultDict, List
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, List, Tuple
 
 import torch
-from federated_learning.lib.core.helpers import Namespace
-from torch.nn.modules.batchnorm import _BatchNorm as BatchNormLayer
+
+if TYPE_CHECKING:
+    from torch.nn.modules.batchnorm import _BatchNorm as BatchNormLayer
+
+
+class AbstractPayload:
+    """
+    Event payloads only store the attributes declared in their "__slots__",
+    which keeps attribute access cheap for events dispatched on every batch.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+    def __repr__(self) -> str:
+        return "{}[{}]".format(
+            self.__class__.__name__,
+            ", ".join("{}={}".format(name, getattr(self, name)) for name in self.__slots__ if hasattr(self, name)),
+        )
+
+
+class NetworkCreatedPayload(AbstractPayload):
+    """event: after_network_create"""
+    __slots__ = ("executor", "config")
+
+
+class CheckpointLoadPayload(AbstractPayload):
+    """event: before_checkpoint_load"""
+    __slots__ = ("network", "info")
+
+
+class CheckpointLoadedPayload(AbstractPayload):
+    """event: after_checkpoint_load"""
+    __slots__ = ("executor",)
+
+
+class CheckpointSavePayload(AbstractPayload):
+    """event: before_checkpoint_save"""
+    __slots__ = ("info",)
+
+
+class TrainingPayload(AbstractPayload):
+    """event: before_train_start|after_train_end"""
+    __slots__ = ("trainer", "data_loader")
+
+
+class BeforeCriterionPayload(AbstractPayload):
+    """event: before_criterion"""
+    __slots__ = ("features", "logits", "extras")
+
+
+class AfterCriterionPayload(AbstractPayload):
+    """event: after_criterion"""
+    __slots__ = ("executor", "loss", "features", "logits")
+
+
+class ProgressLogPayload(AbstractPayload):
+    """event: before_train_progress_log"""
+    __slots__ = ("message", "epoch", "iteration", "dataset_size", "trainer")
+
+
+class PredictionPayload(AbstractPayload):
+    """event: after_predict"""
+    __slots__ = ("features", "logits", "logits_var", "hidden_layer")
 
 
 class AbstractEventHandler(metaclass=ABCMeta):
 
     @abstractmethod
-    def run(self, payload: Namespace):
+    def run(self, payload: AbstractPayload):
         raise NotImplementedError
 
 
 class EventManager:
-    _LISTENERS: DefaultDict[str, List[AbstractEventHandler]] = defaultdict(list)
+    # handlers are kept in immutable tuples, rebuilt on registration, so dispatching is a plain lookup
+    _LISTENERS: Dict[str, Tuple[AbstractEventHandler, ...]] = {}
 
     @staticmethod
     def add_event_listener(event_name: str, handler: AbstractEventHandler) -> None:
-        EventManager._LISTENERS[event_name].append(handler)
+        EventManager._LISTENERS[event_name] = EventManager._LISTENERS.get(event_name, ()) + (handler,)
 
     @staticmethod
-    def dispatch_event(event_name: str, payload: Namespace) -> None:
-        for handler in EventManager._LISTENERS[event_name]:
+    def dispatch_event(event_name: str, payload: AbstractPayload) -> None:
+        for handler in EventManager._LISTENERS.get(event_name, ()):
             handler.run(payload=payload)
 
+    @staticmethod
+    def get_dispatcher(event_name: str) -> Callable[[AbstractPayload], None]:
+        """
+        Binds the handlers currently registered for an event. Useful for events dispatched in hot loops,
+        the listener lookup is done once. Handlers registered afterwards are not included.
+        """
+        handlers = EventManager._LISTENERS.get(event_name, ())
+
+        def dispatch(payload: AbstractPayload) -> None:
+            for handler in handlers:
+                handler.run(payload=payload)
+
+        return dispatch
+
     @staticmethod
     def flush() -> None:
-        EventManager._LISTENERS = defaultdict(list)
+        EventManager._LISTENERS = {}
 
 
 class AddSigmoidEventHandler(AbstractEventHandler):
     """event: before_criterion|before_predict"""
 
-    def run(self, payload: Namespace):
+    def run(self, payload: AbstractPayload):
         payload.logits = torch.sigmoid(payload.logits)
 
 class AddReluEventHandler(AbstractEventHandler):
     """event: before_criterion|before_predict"""
 
-    def run(self, payload: Namespace):
+    def run(self, payload: AbstractPayload):
         payload.logits = torch.nn.functional.relu(payload.logits)
 
 
 class AddSoftmaxEventHandler(AbstractEventHandler):
     """event: before_criterion|before_predict"""
 
-    def run(self, payload: Namespace):
+    def run(self, payload: AbstractPayload):
         payload.logits = torch.softmax(payload.logits, dim=-1)
 
 
@@ -58,7 +139,7 @@ class InjectLossWeightsEventHandler(AbstractEventHandler):
     def __init__(self, mappers: List[str]):
         self._mappers = mappers
 
-    def run(self, payload: Namespace):
+    def run(self, payload: BeforeCriterionPayload):
         for mapper in self._mappers:
             payload.extras.append(payload.features.inputs[mapper].reshape(-1, 1))
 
@@ -69,7 +150,7 @@ class DropParametersEventHandler(AbstractEventHandler):
     def __init__(self, keywords: List[str]):
         self._keywords = keywords
 
-    def run(self, payload: Namespace):
+    def run(self, payload: CheckpointLoadPayload):
         for keyword in self._keywords:
             try:
                 del payload.info["model"][keyword]
@@ -80,7 +161,7 @@ class DropParametersEventHandler(AbstractEventHandler):
 class DropBatchNormLayersEventHandler(AbstractEventHandler):
     """event: various"""
 
-    def run(self, payload: Namespace) -> None:
+    def run(self, payload: AbstractPayload) -> None:
         from opacus.utils.module_modification import nullify_batchnorm_modules
         nullify_batchnorm_modules(payload.executor.network)
 
@@ -88,48 +169,62 @@ class DropBatchNormLayersEventHandler(AbstractEventHandler):
 class ReplaceBatchNormLayersEventHandler(AbstractEventHandler):
     """event: various"""
 
-    def converter(self, module: BatchNormLayer) -> torch.nn.Module:
+    def converter(self, module: "BatchNormLayer") -> torch.nn.Module:
         return torch.nn.GroupNorm(module.num_features, module.num_features, affine=True)
 
-    def run(self, payload: Namespace) -> None:
+    def run(self, payload: AbstractPayload) -> None:
         from opacus.utils.module_modification import replace_all_modules
+        from torch.nn.modules.batchnorm import _BatchNorm as BatchNormLayer
+
         replace_all_modules(payload.executor.network, BatchNormLayer, self.converter)
 
 
 class AddFedproxRegularizationEventHandler(AbstractEventHandler):
     """event: after_criterion"""
 
+    # the global weights are shared by all handlers (ie: across trials), keyed by checkpoint file version and device
+    _WEIGHTS_CACHE: Dict[Tuple[str, int, int, str], OrderedDict] = {}
+
     def __init__(self, mu: float):
         self.mu = mu
         self.weights = None
+        self._names = None
 
     def get_weights(self, config) -> OrderedDict:
         if self.weights is None:
-            info = torch.load(config.checkpoint_path, map_location=config.get_device())
+            file_stats = os.stat(config.checkpoint_path)
+            cache_key = (config.checkpoint_path, file_stats.st_mtime_ns, file_stats.st_size, str(config.get_device()))
+
+            if cache_key not in self._WEIGHTS_CACHE:
+                # only the model weights are moved to the device, the optimizer/scheduler states stay on the CPU
+                info = torch.load(config.checkpoint_path, map_location=torch.device("cpu"))
+                device = config.get_device()
+
+                weights = OrderedDict()
+                for key, value in info["model"].items():
+                    name = key.replace(".module.", ".")
+                    weights[name] = value.to(device)
 
-            weights = OrderedDict()
-            for key, value in info["model"].items():
-                name = key.replace(".module.", ".")
-                weights[name] = value
+                AddFedproxRegularizationEventHandler._WEIGHTS_CACHE = {cache_key: weights}
 
-            self.weights = weights
+            self.weights = self._WEIGHTS_CACHE[cache_key]
 
         return self.weights
 
-    def run(self, payload: Namespace) -> None:
+    def run(self, payload: AfterCriterionPayload) -> None:
         if payload.executor.config.checkpoint_path is None:
             logging.info("Skipping FedProx regularization (no checkpoint found). This is normal for the first round.")
             return
 
-        local_weights = payload.executor.network.state_dict()
+        local_weights = payload.executor.get_uncompiled_network().state_dict()
         global_weights = self.get_weights(payload.executor.config)
 
-        regularization = 0.0
-        for name, parameter in local_weights.items():
-            if not name.endswith(".num_batches_tracked"):
-                regularization += ((self.mu / 2) * torch.norm((parameter - global_weights[name])) ** 2)
+        if self._names is None:
+            self._names = [name for name in local_weights.keys() if not name.endswith(".num_batches_tracked")]
 
-        payload.loss += regularization
+        # single reduction over all weights: sum(||local - global||^2) == ||concat(local - global)||^2
+        differences = torch.cat([(local_weights[name] - global_weights[name]).flatten() for name in self._names])
+        payload.loss += (self.mu / 2) * differences.pow(2).sum()
 
 
 class DifferentialPrivacy:
@@ -143,7 +238,7 @@ class DifferentialPrivacy:
             if "alphas" not in self._options:
                 self._options["alphas"] = [1 + i / 10.0 for i in range(1, 100)] + list(range(12, 64))
 
-        def run(self, payload: Namespace) -> None:
+        def run(self, payload: TrainingPayload) -> None:
             from federated_learning.vendor.opacus.custom.privacy_engine import PrivacyEngine
 
             trainer = payload.trainer
@@ -167,7 +262,7 @@ class DifferentialPrivacy:
         def __init__(self, delta: float):
             self._delta = delta
 
-        def run(self, payload: Namespace) -> None:
+        def run(self, payload: ProgressLogPayload) -> None:
             optimizer = payload.trainer.optimizer
 
             try:
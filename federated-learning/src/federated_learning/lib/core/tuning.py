@@ -2,7 +2,7 @@ import json
 import os
 import re
 from glob import glob
-from typing import Callable, Dict, Any
+from typing import Any, Callable, Dict, List, Optional
 
 import optuna
 
@@ -31,6 +31,7 @@ class OptunaTemplateParser(Loggable):
         evaluator: Callable[[Config], float],
         log_path: str,
         delete_checkpoints: bool = True,
+        devices: Optional[List[int]] = None,
     ):
         Loggable.__init__(self, file_path=log_path)
         self.log("trial_number,performance,configuration_path\n")
@@ -41,6 +42,7 @@ class OptunaTemplateParser(Loggable):
 
         self._evaluator = evaluator
         self._should_delete_checkpoints = delete_checkpoints
+        self._devices = devices
 
     def _get_trial_save_path(self, save_path: str, trial_id: int) -> str:
         return "{}{}/".format(save_path, trial_id)
@@ -92,6 +94,10 @@ class OptunaTemplateParser(Loggable):
             save_path=main_output_path, trial_id=trial.number
         )
 
+        if self._devices:
+            # trials are spread over the GPUs given to this parser (one per parallel search worker)
+            settings["enabled_gpus"] = [self._devices[trial.number % len(self._devices)]]
+
         config = Config(**settings)
         self._store_trial_configuration(settings)
 
@@ -1,8 +1,12 @@
 import itertools
 import logging
+import os
+import pickle
+import sqlite3
 from abc import ABCMeta, abstractmethod
-from functools import partial
-from typing import Any, List, Tuple, Callable, Optional, Union
+from collections import OrderedDict
+from functools import lru_cache, partial
+from typing import Any, Dict, List, Tuple, Callable, Optional, Union
 
 import numpy as np
 import torch
@@ -13,6 +17,148 @@ from federated_learning.lib.core.exceptions import FeaturizationError
 from federated_learning.lib.data.resources import DataPoint
 
 
+class FeatureCache:
+    """
+    Featurized entries are kept in a bounded in-memory LRU, shared by the whole process.
+    When a location is set, string keyed entries are also persisted on disk, to be shared between runs
+    and worker processes. Each featurizer configuration gets its own namespace.
+    """
+
+    FILE_NAME = "features.sqlite"
+    MEMORY_SIZE = 65536
+
+    _memory: "OrderedDict[Tuple[str, Any], Any]" = OrderedDict()
+    _local_namespaces = itertools.count()
+
+    def __init__(self, cache_location: Optional[str], namespace: Optional[str] = None):
+        if namespace is None:  # not shared with any other featurizer
+            namespace = "local-{}".format(next(self._local_namespaces))
+
+        self._file_path = os.path.join(cache_location, self.FILE_NAME) if cache_location is not None else None
+        self._namespace = namespace
+        self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self._file_path), exist_ok=True)
+
+            self._connection = sqlite3.connect(self._file_path, timeout=60)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS features "
+                "(namespace TEXT, key TEXT, value BLOB, PRIMARY KEY (namespace, key))"
+            )
+
+        return self._connection
+
+    def _is_persistent(self, key: Any) -> bool:
+        return self._file_path is not None and isinstance(key, str)
+
+    def has(self, key: Any) -> bool:
+        if (self._namespace, key) in self._memory:
+            return True
+
+        if not self._is_persistent(key):
+            return False
+
+        entry = self._connect().execute(
+            "SELECT 1 FROM features WHERE namespace = ? AND key = ?", (self._namespace, key)
+        ).fetchone()
+
+        return entry is not None
+
+    def get(self, key: Any) -> Optional[Any]:
+        memory_key = (self._namespace, key)
+        if memory_key in self._memory:
+            self._memory.move_to_end(memory_key)
+            return self._memory[memory_key]
+
+        if not self._is_persistent(key):
+            return None
+
+        entry = self._connect().execute(
+            "SELECT value FROM features WHERE namespace = ? AND key = ?", (self._namespace, key)
+        ).fetchone()
+
+        if entry is None:
+            return None
+
+        value = pickle.loads(entry[0])
+        self._remember(memory_key, value)
+
+        return value
+
+    def _remember(self, memory_key: Tuple[str, Any], value: Any) -> None:
+        self._memory[memory_key] = value
+        if len(self._memory) > self.MEMORY_SIZE:
+            self._memory.popitem(last=False)
+
+    def set(self, key: Any, value: Any) -> None:
+        self._remember((self._namespace, key), value)
+
+        if self._is_persistent(key):
+            with self._connect() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO features VALUES (?, ?, ?)",
+                    (self._namespace, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)),
+                )
+
+    def set_many(self, entries: Dict[Any, Any]) -> None:
+        """Same as "set", persisted in a single transaction"""
+        for key, value in entries.items():
+            self._remember((self._namespace, key), value)
+
+        persistent_entries = [
+            (self._namespace, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+            for key, value in entries.items() if self._is_persistent(key)
+        ]
+
+        if persistent_entries:
+            with self._connect() as connection:
+                connection.executemany("INSERT OR REPLACE INTO features VALUES (?, ?, ?)", persistent_entries)
+
+    def clear(self) -> None:
+        for memory_key in [memory_key for memory_key in self._memory if memory_key[0] == self._namespace]:
+            del self._memory[memory_key]
+
+        if self._file_path is not None:
+            with self._connect() as connection:
+                connection.execute("DELETE FROM features WHERE namespace = ?", (self._namespace,))
+
+
+@lru_cache(maxsize=65536)
+def canonicalize_smiles(smiles: str) -> str:
+    mol = Chem.MolFromSmiles(smiles)
+    return Chem.MolToSmiles(mol) if mol is not None else smiles
+
+
+def build_character_table(vocabulary: List[str]) -> Optional[np.ndarray]:
+    """
+    Maps ASCII codes to their position in the vocabulary (-1 for unknown characters).
+    Returns None if the vocabulary is not made of single ASCII characters.
+    """
+    if any(len(token) != 1 or ord(token) > 127 for token in vocabulary):
+        return None
+
+    table = np.full(128, -1, dtype=np.int64)
+    table[[ord(token) for token in vocabulary]] = np.arange(len(vocabulary))
+
+    return table
+
+
+def lookup_characters(table: np.ndarray, data: str) -> np.ndarray:
+    try:
+        indices = table[np.frombuffer(data.encode("ascii"), dtype=np.uint8)]
+    except UnicodeEncodeError:
+        raise FeaturizationError("Could not featurize entry: [{}]".format(data))
+
+    if (indices < 0).any():
+        raise FeaturizationError("Could not featurize entry: [{}]".format(data))
+
+    return indices
+
+
 class AbstractFeaturizer(metaclass=ABCMeta):
     def __init__(
         self,
@@ -27,18 +173,39 @@ class AbstractFeaturizer(metaclass=ABCMeta):
         self._should_cache = should_cache
         self._rewrite = rewrite
 
-        self.__cache = {}
+        self.__cache = FeatureCache(cache_location=None)
 
     @abstractmethod
     def _process(self, data: Any) -> Any:
         raise NotImplementedError
 
-    def __process(self, data: Any) -> Any:
+    def _get_cache_key(self, data: Any) -> Any:
+        return data
+
+    def set_feature_cache(self, feature_cache: FeatureCache) -> None:
+        """Shares (and persists) cached features. Only used when "should_cache" is enabled."""
+        self.__cache = feature_cache
+
+    def _is_cached(self, data: Any) -> bool:
+        return self._should_cache and self.__cache.has(self._get_cache_key(data))
+
+    def prepare(self, data: List[DataPoint]) -> None:
+        """
+        Called with a chunk of samples, before they are featurized one by one.
+        Featurizers can compute resources in batch here.
+        """
+        pass
+
+    def _featurize(self, data: Any) -> Any:
         if self._should_cache:
-            if data not in self.__cache:
-                self.__cache[data] = self._process(data)
+            key = self._get_cache_key(data)
+
+            features = self.__cache.get(key)
+            if features is None:
+                features = self._process(data)
+                self.__cache.set(key, features)
 
-            return self.__cache[data]
+            return features
         else:
             return self._process(data)
 
@@ -46,12 +213,13 @@ class AbstractFeaturizer(metaclass=ABCMeta):
         if len(self._inputs) != len(self._outputs):
             raise FeaturizationError("Inputs and mappings must have the same length.")
 
-        for index in range(len(self._inputs)):
-            raw_data = data.inputs[self._inputs[index]]
-            if self._rewrite:
-                data.inputs.pop(self._inputs[index])
+        for input_name, output_name in zip(self._inputs, self._outputs):
+            if self._rewrite and input_name != output_name:
+                raw_data = data.inputs.pop(input_name)
+            else:  # rewritten in place when the names match
+                raw_data = data.inputs[input_name]
 
-            data.inputs[self._outputs[index]] = self.__process(raw_data)
+            data.inputs[output_name] = self._featurize(raw_data)
 
 
 class TensorFeaturizer(AbstractFeaturizer):
@@ -70,7 +238,7 @@ class TensorFeaturizer(AbstractFeaturizer):
         super().__init__(inputs, outputs, should_cache, rewrite)
 
     def _process(self, data) -> torch.FloatTensor:
-        return torch.FloatTensor(data)
+        return torch.from_numpy(np.asarray(data, dtype=np.float32))
 
 class TensorTabularFeaturizer(TensorFeaturizer):
     """Tabular featurizer from a list of inputs.
@@ -87,14 +255,15 @@ class TensorTabularFeaturizer(TensorFeaturizer):
         super().__init__(['tabular_tmp'], outputs, should_cache, rewrite=True)
 
     def run(self, data: DataPoint) -> None:
-        raw_data = []
-        for index in range(len(self.group_inputs)):
-            raw_data.append(data.inputs[self.group_inputs[index]])
-            if self._rewrite:
-                data.inputs.pop(self.group_inputs[index])
+        if len(self._inputs) != len(self._outputs):
+            raise FeaturizationError("Inputs and mappings must have the same length.")
+
+        read = data.inputs.pop if self._rewrite else data.inputs.__getitem__
+        raw_data = np.fromiter(
+            (read(name) for name in self.group_inputs), dtype=np.float32, count=len(self.group_inputs)
+        )
 
-        data.inputs['tabular_tmp'] = raw_data
-        super().run(data)
+        data.inputs[self._outputs[0]] = self._featurize(raw_data)
 
 
 class AbstractTorchGeometricFeaturizer(AbstractFeaturizer):
@@ -102,49 +271,49 @@ class AbstractTorchGeometricFeaturizer(AbstractFeaturizer):
     Featurizers preparing data for torch geometric should extend this class
     """
 
-    def _process(self, data: str) -> TorchGeometricData:
+    def _get_cache_key(self, data: str) -> str:
+        return canonicalize_smiles(data)
+
+    def _parse(self, data: str) -> Chem.Mol:
         mol = Chem.MolFromSmiles(data)
         if mol is None:
             raise FeaturizationError("Could not featurize entry: [{}]".format(data))
 
-        atom_features = self._get_vertex_features(mol)
-        atom_features = torch.FloatTensor(atom_features).view(-1, len(atom_features[0]))
+        return mol
 
+    def _process(self, data: str) -> TorchGeometricData:
+        return self._process_mol(self._parse(data), smiles=data)
+
+    def _process_mol(self, mol: Chem.Mol, smiles: str) -> TorchGeometricData:
+        atom_features = self._get_vertex_features(mol)
         edge_indices, edge_attributes = self._get_edge_features(mol)
-        edge_indices = torch.tensor(edge_indices)
-        edge_indices = edge_indices.t().to(torch.long).view(2, -1)
-        edge_attributes = torch.FloatTensor(edge_attributes)
-
-        if edge_indices.numel() > 0:  # Sort indices
-            permutation = (
-                edge_indices[0] * atom_features.size(0) + edge_indices[1]
-            ).argsort()
-            edge_indices, edge_attributes = (
-                edge_indices[:, permutation],
-                edge_attributes[permutation],
-            )
 
         return TorchGeometricData(
-            x=atom_features,
-            edge_index=edge_indices,
-            edge_attr=edge_attributes,
-            smiles=data,
+            x=torch.from_numpy(atom_features),
+            edge_index=torch.from_numpy(edge_indices),
+            edge_attr=torch.from_numpy(edge_attributes),
+            smiles=smiles,
         )
 
-    def _get_vertex_features(self, mol: Chem.Mol) -> List[List[float]]:
-        return [self._featurize_atom(atom) for atom in mol.GetAtoms()]
+    def _get_vertex_features(self, mol: Chem.Mol) -> np.ndarray:
+        atom_features = np.array([self._featurize_atom(atom) for atom in mol.GetAtoms()], dtype=np.float32)
+        return atom_features.reshape(mol.GetNumAtoms(), -1)
 
-    def _get_edge_features(
-        self, mol: Chem.Mol
-    ) -> Tuple[List[List[int]], List[List[float]]]:
-        edge_indices, edge_attributes = [], []
+    def _get_edge_features(self, mol: Chem.Mol) -> Tuple[np.ndarray, np.ndarray]:
+        """Bonds are added in both directions. Edges are sorted by source, then target atom index."""
+        begin_indices, end_indices, bond_features = [], [], []
         for bond in mol.GetBonds():
-            i = bond.GetBeginAtomIdx()
-            j = bond.GetEndAtomIdx()
+            begin_indices.append(bond.GetBeginAtomIdx())
+            end_indices.append(bond.GetEndAtomIdx())
+            bond_features.append(self._featurize_bond(bond))
+
+        sources = np.array(begin_indices + end_indices, dtype=np.int64)
+        targets = np.array(end_indices + begin_indices, dtype=np.int64)
+        bond_features = np.array(bond_features, dtype=np.float32)
 
-            edge_indices += [[i, j], [j, i]]
-            bond_features = self._featurize_bond(bond)
-            edge_attributes += [bond_features, bond_features]
+        permutation = np.lexsort((targets, sources))
+        edge_indices = np.stack((sources, targets))[:, permutation]
+        edge_attributes = np.concatenate((bond_features, bond_features))[permutation]
 
         return edge_indices, edge_attributes
 
@@ -162,9 +331,15 @@ class AbstractDescriptorComputer(metaclass=ABCMeta):
     def run(self, mol: Chem.Mol) -> List[float]:
         raise NotImplementedError
 
+    def run_many(self, mols: List[Chem.Mol]) -> List[List[float]]:
+        return [self.run(mol) for mol in mols]
+
 
 class RdkitDescriptorComputer(AbstractDescriptorComputer):
-    def _get_descriptor_calculators(self) -> List[Callable]:
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _get_descriptor_calculators() -> Tuple[Callable, ...]:
+        # built once per process, "run" is called for every molecule
         from rdkit.Chem import (
             Descriptors,
             Lipinski,
@@ -175,7 +350,7 @@ class RdkitDescriptorComputer(AbstractDescriptorComputer):
             QED,
         )
 
-        return [
+        return (
             Descriptors.MolWt,
             Descriptors.NumRadicalElectrons,
             Descriptors.NumValenceElectrons,
@@ -193,7 +368,7 @@ class RdkitDescriptorComputer(AbstractDescriptorComputer):
             Lipinski.NumAromaticRings,
             Crippen.MolLogP,
             QED.qed,
-        ]
+        )
 
     def run(self, mol: Chem.Mol) -> List[Union[int, float]]:
         return [featurizer(mol) for featurizer in self._get_descriptor_calculators()]
@@ -209,6 +384,10 @@ class MordredDescriptorComputer(AbstractDescriptorComputer):
         descriptors = self._calculator(mol)
         return list(descriptors.fill_missing(0))
 
+    def run_many(self, mols: List[Chem.Mol]) -> List[List[Union[int, float]]]:
+        # a single calculation context for all molecules. Runs in-process, parallelism is handled by the streamer.
+        return [list(descriptors.fill_missing(0)) for descriptors in self._calculator.map(mols, nproc=1, quiet=True)]
+
 
 class GraphFeaturizer(AbstractTorchGeometricFeaturizer):
     """
@@ -248,29 +427,52 @@ class GraphFeaturizer(AbstractTorchGeometricFeaturizer):
         self._allowed_atom_types = allowed_atom_types
         self._descriptor_calculator = descriptor_calculator
 
+        self._atom_featurizers = self._list_atom_featurizers()
+        self._bond_featurizers = self._list_bond_featurizers()
+
+        self._prepared = {}
+
+    def prepare(self, data: List[DataPoint]) -> None:
+        """Parses the molecules of the chunk and computes their descriptors in a single batch"""
+        self._prepared = {}  # if the batch fails, the molecules are processed one by one
+
+        mols = {}
+        for entry in data:
+            for name in self._inputs:
+                smiles = entry.inputs.get(name)
+                if isinstance(smiles, str) and smiles not in mols and not self._is_cached(smiles):
+                    mol = Chem.MolFromSmiles(smiles)
+                    if mol is not None:
+                        mols[smiles] = mol
+
+        descriptors = self._descriptor_calculator.run_many(list(mols.values()))
+        self._prepared = {smiles: (mol, features) for (smiles, mol), features in zip(mols.items(), descriptors)}
+
     def _process(self, data: str) -> TorchGeometricData:
-        mol = Chem.MolFromSmiles(data)
-        data = super()._process(data=data)
+        if data in self._prepared:
+            mol, molecule_features = self._prepared.pop(data)
+        else:
+            mol = self._parse(data)
+            molecule_features = self._descriptor_calculator.run(mol)
 
-        molecule_features = self._descriptor_calculator.run(mol)
-        molecule_features = torch.FloatTensor(molecule_features).view(
-            -1, len(molecule_features)
-        )
+        data = self._process_mol(mol, smiles=data)
+
+        molecule_features = np.asarray(molecule_features, dtype=np.float32)
+        data.molecule_features = torch.from_numpy(molecule_features).view(1, -1)
 
-        data.molecule_features = molecule_features
         return data
 
     def _featurize_atom(self, atom: Chem.Atom) -> List[float]:
         return list(
             itertools.chain.from_iterable(
-                [featurizer(atom) for featurizer in self._list_atom_featurizers()]
+                [featurizer(atom) for featurizer in self._atom_featurizers]
             )
         )
 
     def _featurize_bond(self, bond: Chem.Bond) -> List[float]:
         return list(
             itertools.chain.from_iterable(
-                [featurizer(bond) for featurizer in self._list_bond_featurizers()]
+                [featurizer(bond) for featurizer in self._bond_featurizers]
             )
         )
 
@@ -349,32 +551,45 @@ class CircularFingerprintFeaturizer(AbstractFingerprintFeaturizer):
         fingerprint_size: int = 2048,
         radius: int = 2,
         use_chirality: bool = False,
+        pack_bits: bool = False,
     ):
         super().__init__(inputs, outputs, should_cache, rewrite)
 
         self._fingerprint_size = fingerprint_size
         self._radius = radius
         self._use_chirality = use_chirality
+        self._pack_bits = pack_bits
+
+        from rdkit.Chem import rdFingerprintGenerator
+
+        # generates the same bits as "AllChem.GetMorganFingerprintAsBitVect", but is only set up once
+        self._generator = rdFingerprintGenerator.GetMorganGenerator(
+            radius=radius, fpSize=fingerprint_size, includeChirality=use_chirality
+        )
+
+    def _get_cache_key(self, data: str) -> str:
+        return canonicalize_smiles(data)
 
     def _process(self, data: str) -> torch.FloatTensor:
         mol = Chem.MolFromSmiles(data)
         if mol is None:
             raise FeaturizationError("Could not featurize entry: [{}]".format(data))
 
-        return torch.FloatTensor(self._generate_fingerprint(mol))
+        features = self._generate_fingerprint(mol)
+        if self._pack_bits:
+            # 8 bits per byte, to be expanded on the device (see "BitUnpacker")
+            return torch.from_numpy(np.packbits(features))
+
+        return torch.from_numpy(features.astype(np.float32))
 
     def _generate_fingerprint(self, mol: Chem.Mol) -> np.ndarray:
-        from rdkit.Chem import AllChem
+        if hasattr(self._generator, "GetFingerprintAsNumPy"):  # RDKit >= 2021.03
+            return self._generator.GetFingerprintAsNumPy(mol).astype(np.uint8, copy=False)
 
-        fingerprint = AllChem.GetMorganFingerprintAsBitVect(
-            mol,
-            radius=self._radius,
-            nBits=self._fingerprint_size,
-            useChirality=self._use_chirality,
-        )
+        from rdkit import DataStructs
 
-        features = np.zeros(self._fingerprint_size, dtype=np.uint8)
-        features[fingerprint.GetOnBits()] = 1
+        features = np.empty(self._fingerprint_size, dtype=np.uint8)
+        DataStructs.ConvertToNumpyArray(self._generator.GetFingerprint(mol), features)
 
         return features
 
@@ -394,11 +609,18 @@ class OneHotEncoderFeaturizer(AbstractFeaturizer):
 
         self._classes = classes
 
+        self._class_indices = {name: index for index, name in enumerate(classes)}
+
     def _process(self, data: str) -> torch.FloatTensor:
-        features = np.zeros(len(self._classes))
-        features[self._classes.index(data)] = 1
+        try:
+            index = self._class_indices[data]
+        except KeyError:
+            raise FeaturizationError("Unknown class: [{}]".format(data))
 
-        return torch.FloatTensor(features)
+        # a tensor of its own: a view of a shared matrix would pickle (and cache) the whole matrix with every sample
+        encoding = torch.zeros(len(self._classes))
+        encoding[index] = 1
+        return encoding
 
 
 class TokenFeaturizer(AbstractFeaturizer):
@@ -413,33 +635,50 @@ class TokenFeaturizer(AbstractFeaturizer):
         separator: str = "",
         should_cache: bool = False,
         rewrite: bool = True,
+        compact: bool = False,
     ):
         super().__init__(inputs, outputs, should_cache, rewrite)
 
         self._vocabulary = vocabulary
         self._separator = separator
         self._max_length = max_length
+        self._compact = compact
+
+        self._token_indices = {token: index for index, token in enumerate(vocabulary)}
+        self._character_table = None if separator else build_character_table(vocabulary)
+
+    def _get_indices(self, tokens: Union[str, List[str]], data: str) -> np.ndarray:
+        if self._character_table is not None:
+            return lookup_characters(self._character_table, tokens)
+
+        try:
+            return np.fromiter((self._token_indices[token] for token in tokens), dtype=np.int64, count=len(tokens))
+        except KeyError as e:
+            raise FeaturizationError("Unknown token {} in entry: [{}]".format(e, data))
 
     def _process(self, data: str) -> torch.FloatTensor:
-        tokens = (
-            data.split(self._separator)
-            if self._separator
-            else [character for character in data]
-        )
-        features = np.zeros((self._max_length, len(self._vocabulary)))
-
-        for index, token in enumerate(tokens):
-            if index == self._max_length:
-                logging.warning(
-                    "[CAUTION] Input is out of bounds. Features will be trimmed. --- {}".format(
-                        data
-                    )
+        tokens = data.split(self._separator) if self._separator else data
+
+        if len(tokens) > self._max_length:
+            logging.warning(
+                "[CAUTION] Input is out of bounds. Features will be trimmed. --- {}".format(
+                    data
                 )
-                break
+            )
+            tokens = tokens[:self._max_length]
 
-            features[index][self._vocabulary.index(token)] = 1
+        indices = self._get_indices(tokens, data)
+        if self._compact:
+            # token indices, padded with -1, to be one-hot encoded on the device (see "OneHotExpander")
+            features = np.full(self._max_length, -1, dtype=np.int16)
+            features[:len(indices)] = indices
 
-        return torch.FloatTensor(features)
+            return torch.from_numpy(features)
+
+        features = np.zeros((self._max_length, len(self._vocabulary)), dtype=np.float32)
+        features[np.arange(len(indices)), indices] = 1
+
+        return torch.from_numpy(features)
 
 
 class BagOfWordsFeaturizer(AbstractFeaturizer):
@@ -455,26 +694,36 @@ class BagOfWordsFeaturizer(AbstractFeaturizer):
 
         super().__init__(inputs, outputs, should_cache, rewrite)
 
-        self._vocabulary = self._get_combinations(vocabulary, max_length)
+        self._vocabulary = vocabulary
         self._max_length = max_length
 
-    def _get_combinations(self, vocabulary: List[str], max_length: int) -> List[str]:
-        combinations = []
+        self._character_table = build_character_table(vocabulary)
+        if self._character_table is None:
+            raise FeaturizationError("The bag of words vocabulary can only contain single ASCII characters.")
 
-        for length in range(1, max_length + 1):
-            for variation in itertools.product(vocabulary, repeat=length):
-                combinations.append("".join(variation))
-
-        return combinations
+        # Features are ordered like "itertools.product(vocabulary, repeat=length)" for each length.
+        # The block of n-grams of length L starts after all shorter ones: offset(L) = |V| + |V|^2 + ... + |V|^(L-1)
+        block_sizes = [len(vocabulary) ** length for length in range(1, max_length + 1)]
+        self._offsets = np.cumsum([0] + block_sizes[:-1])
+        self._features_count = int(sum(block_sizes))
 
     def _process(self, data: str) -> torch.FloatTensor:
-        sample = dict.fromkeys(self._vocabulary, 0)
+        tokens = lookup_characters(self._character_table, data)
+
+        # A n-gram is the base-|V| number made of its token indices, its position in the block for its length.
+        # The n-grams of a given length extend the ones a token shorter: index(L) = index(L - 1) * |V| + next token
+        vocabulary_size = len(self._vocabulary)
+        positions = []
 
+        indices = tokens
         for length in range(1, self._max_length + 1):
-            for start_index in range(0, len(data) - length + 1):
-                sample[data[start_index : start_index + length]] += 1
+            if length > 1:
+                indices = indices[:-1] * vocabulary_size + tokens[length - 1:]
+
+            positions.append(indices + self._offsets[length - 1])
 
-        return torch.FloatTensor(list(sample.values()))
+        features = np.bincount(np.concatenate(positions), minlength=self._features_count)
+        return torch.from_numpy(features.astype(np.float32))
 
 
 class FASTAFeaturizer(BagOfWordsFeaturizer):
@@ -1,6 +1,7 @@
 from abc import abstractmethod
-from typing import Iterator, List, Union, Any
+from typing import Iterator, List, Tuple, Union, Any
 
+import numpy as np
 import pandas as pd
 from torch.utils.data import Dataset as TorchDataset
 
@@ -28,6 +29,10 @@ class AbstractLoader(TorchDataset):
         for id_ in self.list_ids():
             yield self[id_]
 
+    def get_column(self, name: str, is_input: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Optional fast path. Returns the ids and the values of an input (or output) column, as parallel arrays"""
+        raise NotImplementedError
+
 
 class CsvLoader(AbstractLoader):
     """Load data from csv files.
@@ -60,6 +65,9 @@ class CsvLoader(AbstractLoader):
     def list_ids(self) -> List[Union[int, str]]:
         return list(range(len(self)))
 
+    def get_column(self, name: str, is_input: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        return np.arange(len(self)), self._dataset[name].to_numpy()
+
     def get_labels(self) -> List[str]:
         return self._target_columns
 
@@ -104,15 +112,32 @@ class ListLoader(AbstractLoader):
     def __init__(self, data: List[DataPoint], indices: List[str]):
         self._dataset = data
         self._indices = indices
+        self._positions = None
 
     def __len__(self):
         return len(self._dataset)
 
     def __getitem__(self, id_: str) -> DataPoint:
-        return self._dataset[self._indices.index(id_)]
+        # built on first access, loaders restored from older caches don't have it yet
+        if getattr(self, "_positions", None) is None:
+            self._positions = {index: position for position, index in enumerate(self._indices)}
+
+        return self._dataset[self._positions[id_]]
+
+    def __iter__(self) -> Iterator[DataPoint]:
+        return iter(self._dataset)
 
     def list_ids(self) -> List[Union[int, str]]:
         return self._indices
 
+    def get_column(self, name: str, is_input: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        if is_input:
+            values = [entry.inputs[name] for entry in self._dataset]
+        else:
+            output_index = self.get_labels().index(name)
+            values = [entry.outputs[output_index] for entry in self._dataset]
+
+        return np.array(self._indices), np.array(values)
+
     def get_labels(self) -> List[str]:
         return self._dataset[0].labels
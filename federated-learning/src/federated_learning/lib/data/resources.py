@@ -1,9 +1,11 @@
-from collections import defaultdict
 from dataclasses import dataclass
-from typing import Any, Dict, Union, List, Optional, Iterable
+from queue import Full, Queue
+from threading import Event, Thread
+from typing import Any, Dict, Union, List, Optional, Iterable, Iterator
 
 import numpy as np
 import torch
+from torch.utils.data.distributed import DistributedSampler
 from torch_geometric.data.dataloader import Collater as TorchGeometricCollater
 
 
@@ -30,35 +32,46 @@ class LoadedContent:
     samples: int
     batches: int
 
+    def set_epoch(self, epoch: int) -> None:
+        """Distributed shards are reshuffled every epoch"""
+        sampler = getattr(self.dataset, "sampler", None)
+        if isinstance(sampler, DistributedSampler):
+            sampler.set_epoch(epoch)
+
 
 class Collater:
     def __init__(self, device: torch.device):
         self._device = device
         self._collater = TorchGeometricCollater(follow_batch=[])
 
-    def _unpack(self, batch: List[DataPoint]) -> Batch:
-        ids = []
-        inputs = defaultdict(list)
-        outputs = []
+        # copies from pinned memory are asynchronous, the host can prepare the next batch meanwhile
+        self._non_blocking = device.type == "cuda"
 
-        for entry in batch:
-            ids.append(entry.id_)
+    def _unpack(self, batch: List[DataPoint]) -> Batch:
+        # regrouped column by column, all entries share the same input keys
+        ids = [entry.id_ for entry in batch]
+        inputs = {key: [entry.inputs[key] for entry in batch] for key in batch[0].inputs}
+        outputs = [entry.outputs for entry in batch]
 
-            for key, value in entry.inputs.items():
-                inputs[key].append(value)
+        if isinstance(outputs[0], torch.Tensor):
+            outputs = torch.stack(outputs).float()
+        else:
+            # a single conversion to float32, without the intermediate float64 array
+            outputs = torch.from_numpy(np.asarray(outputs, dtype=np.float32))
 
-            outputs.append(entry.outputs)
+        return Batch(ids=ids, labels=batch[0].labels, inputs=inputs, outputs=outputs)
 
-        outputs = np.array(outputs)
-        outputs = torch.FloatTensor(outputs)
+    def _to_device(self, values: Any) -> Any:
+        if self._non_blocking and isinstance(values, torch.Tensor):
+            values = values.pin_memory()
 
-        return Batch(ids=ids, labels=batch[0].labels, inputs=inputs, outputs=outputs)
+        return values.to(self._device, non_blocking=self._non_blocking)
 
     def _set_device(self, batch: Batch) -> None:
-        batch.outputs = batch.outputs.to(self._device)
+        batch.outputs = self._to_device(batch.outputs)
         for key, values in batch.inputs.items():
             try:
-                batch.inputs[key] = values.to(self._device)
+                batch.inputs[key] = self._to_device(values)
             except (AttributeError, ValueError):
                 pass
 
@@ -69,3 +82,139 @@ class Collater:
 
         self._set_device(batch)
         return batch
+
+
+class DevicePrefetcher:
+    """
+    Iterates a data loader one batch ahead. The next batch is collated and copied to the GPU on a side stream,
+    so the transfer overlaps with the computations on the current batch.
+    """
+
+    def __init__(self, data_loader: torch.utils.data.DataLoader, device: torch.device):
+        self._data_loader = data_loader
+        self._device = device
+
+    @property
+    def sampler(self) -> torch.utils.data.Sampler:
+        return self._data_loader.sampler
+
+    def __len__(self) -> int:
+        return len(self._data_loader)
+
+    def _record_stream(self, values: Any, stream: torch.cuda.Stream) -> Any:
+        # memory allocated on the side stream must not be reused while the main stream still needs it
+        if isinstance(values, torch.Tensor):
+            values.record_stream(stream)
+        elif hasattr(values, "apply"):  # graph batches
+            values.apply(lambda tensor: self._record_stream(tensor, stream))
+
+        return values
+
+    def __iter__(self) -> Iterator[Batch]:
+        copy_stream = torch.cuda.Stream(device=self._device)
+        current_stream = torch.cuda.current_stream(device=self._device)
+
+        batches = iter(self._data_loader)
+        with torch.cuda.stream(copy_stream):
+            next_batch = next(batches, None)
+
+        while next_batch is not None:
+            current_stream.wait_stream(copy_stream)
+            batch = next_batch
+
+            batch.outputs = self._record_stream(batch.outputs, current_stream)
+            for key, values in batch.inputs.items():
+                batch.inputs[key] = self._record_stream(values, current_stream)
+
+            with torch.cuda.stream(copy_stream):
+                next_batch = next(batches, None)
+
+            yield batch
+
+
+class CachedBatches:
+    """
+    Keeps the batches of a loader (collated, on their device) once they were all iterated.
+    Later passes, ie: evaluating the next checkpoint on the same test data, don't load, collate or copy them again.
+    Only meant for loaders which are not shuffled.
+    """
+
+    def __init__(self, batches: Iterable[Batch]):
+        self._batches = batches
+        self._cache = None
+
+    @property
+    def sampler(self) -> Optional[torch.utils.data.Sampler]:
+        return getattr(self._batches, "sampler", None)
+
+    def __len__(self) -> int:
+        return len(self._batches)
+
+    def __iter__(self) -> Iterator[Batch]:
+        if self._cache is not None:
+            yield from self._cache
+            return
+
+        batches = []
+        for batch in self._batches:
+            batches.append(batch)
+            yield batch
+
+        self._cache = batches
+
+
+class BackgroundPrefetcher:
+    """
+    Iterates batches in a background thread, up to "size" batches ahead. Loading, collating and copying the next
+    batches then overlaps with long computations on the current one (ie: explaining a prediction).
+    """
+
+    _END = object()
+
+    def __init__(self, batches: Iterable[Batch], size: int = 4):
+        self._batches = batches
+        self._size = size
+
+    def __len__(self) -> int:
+        return len(self._batches)
+
+    @staticmethod
+    def _put(queue: Queue, item: Any, stopped: Event) -> bool:
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+
+        return False
+
+    def _produce(self, queue: Queue, stopped: Event, errors: List[Exception]) -> None:
+        try:
+            for batch in self._batches:
+                if not self._put(queue, batch, stopped):
+                    return
+        except Exception as e:
+            errors.append(e)
+
+        self._put(queue, self._END, stopped)
+
+    def __iter__(self) -> Iterator[Batch]:
+        queue = Queue(maxsize=self._size)
+        stopped = Event()
+        errors = []
+
+        producer = Thread(target=self._produce, args=(queue, stopped, errors), daemon=True)
+        producer.start()
+
+        try:
+            batch = queue.get()
+            while batch is not self._END:
+                yield batch
+                batch = queue.get()
+        finally:
+            stopped.set()  # the consumer stopped early (or failed), the producer should not block on a full queue
+            producer.join()
+
+        if errors:
+            raise errors[0]
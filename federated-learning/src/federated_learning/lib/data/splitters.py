@@ -1,9 +1,12 @@
+import itertools
 import logging
 import math
 from random import Random
 from abc import ABCMeta, abstractmethod
-from collections import Counter, defaultdict
-from typing import Dict, List, Union, Tuple
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Union, Tuple
+
+import joblib
 import numpy as np
 from numpy.random import RandomState
 
@@ -12,9 +15,30 @@ from rdkit import Chem
 from tqdm import tqdm
 
 from federated_learning.lib.core.exceptions import SplitError
+from federated_learning.lib.data.featurizers import FeatureCache
 from federated_learning.lib.data.loaders import AbstractLoader
 
 
+def _extract_scaffolds(smiles: Iterable[str], cache: FeatureCache, jobs: int = 1) -> Dict[str, str]:
+    """Maps each distinct SMILES to its Murcko scaffold. Duplicates, and cached entries, are only processed once."""
+    from rdkit.Chem.Scaffolds.MurckoScaffold import MurckoScaffoldSmiles
+
+    scaffolds = {}
+    for entry in dict.fromkeys(smiles):
+        scaffolds[entry] = cache.get(entry)
+
+    missing_smiles = [entry for entry, scaffold in scaffolds.items() if scaffold is None]
+    computed_scaffolds = joblib.Parallel(n_jobs=jobs, backend="loky", batch_size=256)(
+        joblib.delayed(MurckoScaffoldSmiles)(entry) for entry in tqdm(missing_smiles)
+    )
+
+    computed_scaffolds = dict(zip(missing_smiles, computed_scaffolds))
+    cache.set_many(computed_scaffolds)
+    scaffolds.update(computed_scaffolds)
+
+    return scaffolds
+
+
 class AbstractSplitter(metaclass=ABCMeta):
     """Splitters take a loader as input and return lists of entry IDs"""
 
@@ -24,6 +48,22 @@ class AbstractSplitter(metaclass=ABCMeta):
         if round(sum(self.splits.values()), 2) != 1:
             SplitError("Split ratios do not add up to 1!")
 
+    def _get_boundaries(self, dataset_size: int) -> Iterator[Tuple[str, int, int]]:
+        """
+        Start and end positions of each split. Ratios are accumulated without rounding, and when they add up to 1,
+        the entries left over by rounding down the positions go to the last split.
+        """
+        start_index = 0
+        total_ratio = 0
+        for position, (split_name, split_ratio) in enumerate(self.splits.items(), start=1):
+            total_ratio += split_ratio
+            end_index = min(math.floor(dataset_size * total_ratio), dataset_size)
+            if position == len(self.splits) and round(total_ratio, 4) >= 1:
+                end_index = dataset_size
+
+            yield split_name, start_index, end_index
+            start_index = end_index
+
     @abstractmethod
     def apply(self, data_loader: AbstractLoader) -> Dict[str, List[Union[int, str]]]:
         raise NotImplementedError
@@ -60,19 +100,23 @@ class RandomSplitter(AbstractSplitter):
         super().__init__(splits=splits)
         self.random = Random(seed)
 
-    def apply(self, data_loader: AbstractLoader) -> Dict[str, List[Union[int, str]]]:
-        splits = {}
-        ids = set(data_loader.list_ids())
+    def _split_positions(self, dataset_size: int) -> Dict[str, List[int]]:
+        """Shuffles the entry positions once, and slices them according to the split ratios"""
+        positions = list(range(dataset_size))
+        self.random.shuffle(positions)
 
-        ratio_left = 1
-        for split_name, split_ratio in self.splits.items():
-            sample_size = int(split_ratio / ratio_left * len(ids))
-            splits[split_name] = self.random.sample(population=ids, k=sample_size)
+        return {
+            split_name: positions[start_index:end_index]
+            for split_name, start_index, end_index in self._get_boundaries(dataset_size)
+        }
 
-            ids = ids.difference(set(splits[split_name]))
-            ratio_left -= split_ratio
+    def apply(self, data_loader: AbstractLoader) -> Dict[str, List[Union[int, str]]]:
+        ids = data_loader.list_ids()
 
-        return splits
+        return {
+            split_name: [ids[position] for position in positions]
+            for split_name, positions in self._split_positions(len(ids)).items()
+        }
 
 
 class CategoricalSplitter(RandomSplitter):
@@ -94,52 +138,73 @@ class CategoricalSplitter(RandomSplitter):
                     f"client_{i}": client_distribution[i]
                 })
     def _load_inputs(self, data_loader: AbstractLoader) -> Dict[Union[int, str], float]:
+        # the category is only used for splitting, it is removed from the inputs in the same pass
         return {
-            entry.id_: entry.inputs[self._cat_name] for entry in iter(data_loader)
+            entry.id_: entry.inputs.pop(self._cat_name) for entry in iter(data_loader)
         }
 
     def apply(self, data_loader: AbstractLoader) -> Dict[str, List[Union[int, str]]]:
         leftover_data = self._load_inputs(data_loader)
         _ids = np.array(list(leftover_data.keys()))
         cat_data = np.array(list(leftover_data.values()))
-        cat_names = np.unique(cat_data)
+
+        # Compute random split (the positions match the "_ids" order)
+        random_splits = self._split_positions(len(_ids))
+        mask = np.ones(len(_ids), dtype=bool)
 
         if self.id_fold_mila is not None:
-            # Compute random split
-            splits = super().apply(data_loader)
             # Keep only test fold split
-            splits = {f"fold_{self.id_fold_mila}": splits[f"fold_{self.id_fold_mila}"]}
+            test_positions = random_splits[f"fold_{self.id_fold_mila}"]
+            splits = {f"fold_{self.id_fold_mila}": _ids[test_positions].tolist()}
             splits.update({k: [] for k in self.client_splits.keys()})
             remaining_split = self.client_splits
             # Remove already used ids
-            mask = np.invert(np.isin(_ids, splits[f"fold_{self.id_fold_mila}"]))
+            mask[test_positions] = False
             cat_data = cat_data[mask]
             _ids = _ids[mask]
             ratio_left = 1
         # Only used for multi step training
         else:
-            # Compute random split
-            splits = super().apply(data_loader)
             # Keep only test fold split
-            splits = {k: splits[self.test_split] if k==self.test_split else [] for k in self.splits.keys()}
+            test_positions = random_splits[self.test_split]
+            splits = {k: _ids[test_positions].tolist() if k==self.test_split else [] for k in self.splits.keys()}
             remaining_split = self.splits.copy()
             # Remove already used ids
-            mask = np.invert(np.isin(_ids, splits[self.test_split]))
+            mask[test_positions] = False
             cat_data = cat_data[mask]
             _ids = _ids[mask]
             ratio_left = 1 - remaining_split.pop(self.test_split)
             self.random.seed(self.seed)
 
+        # positions of the remaining entries, grouped by category (a single pass instead of a scan per draw)
+        positions = defaultdict(list)
+        for position, category in enumerate(cat_data.tolist()):
+            positions[category].append(position)
+
+        cat_names = list(positions.keys())
+        remaining_count = len(cat_data)
+
         for split_name, split_ratio in remaining_split.items():
-            sample_size = int(split_ratio / ratio_left * len(cat_data[np.isin(cat_data, cat_names)]))
-            while len(splits[split_name]) < sample_size:
-                chosen_cat = self.random.sample(population=list(cat_names), k=1)[0]
-                splits[split_name] += _ids[cat_data == chosen_cat].tolist()
-                cat_names = cat_names[cat_names != chosen_cat]
+            sample_size = int(split_ratio / ratio_left * remaining_count)
+
+            # positions are collected first, the ids are gathered with a single indexing at the end
+            split_positions = []
+            split_size = len(splits[split_name])
+            while split_size < sample_size:
+                # the chosen category is replaced by the last one, instead of shifting the whole list
+                chosen_index = self.random.randrange(len(cat_names))
+                chosen_cat = cat_names[chosen_index]
+                cat_names[chosen_index] = cat_names[-1]
+                cat_names.pop()
+
+                chosen_positions = positions.pop(chosen_cat)
+                split_positions.extend(chosen_positions)
+                split_size += len(chosen_positions)
+                remaining_count -= len(chosen_positions)
+
+            splits[split_name] += _ids[split_positions].tolist()
             ratio_left -= split_ratio
 
-        [data.inputs.pop(self._cat_name) for data in data_loader._dataset]
-
         return splits
 
 
@@ -169,130 +234,128 @@ class StratifiedSplitter(AbstractSplitter):
         self._is_target_input = is_target_input
         self.rewrite = rewrite
 
-    def _load_outputs(
-        self, data_loader: AbstractLoader
-    ) -> Dict[Union[int, str], float]:
-        output_index = data_loader.get_labels().index(self._target_name)
-        results = {}
+    def _load_outputs(self, data_loader: AbstractLoader) -> Tuple[np.ndarray, np.ndarray]:
+        try:
+            return data_loader.get_column(self._target_name)
+        except NotImplementedError:
+            output_index = data_loader.get_labels().index(self._target_name)
+            entries = list(data_loader)
 
-        for entry in iter(data_loader):
-            results[entry.id_] = entry.outputs[output_index]
+            ids = [entry.id_ for entry in entries]
 
-        return results
+            return np.array(ids), np.array([entry.outputs[output_index] for entry in entries])
 
-    def _load_inputs(self, data_loader: AbstractLoader) -> Dict[Union[int, str], float]:
-        return {
-            entry.id_: entry.inputs[self._target_name] for entry in iter(data_loader)
-        }
+    def _load_inputs(self, data_loader: AbstractLoader) -> Tuple[np.ndarray, np.ndarray]:
+        try:
+            return data_loader.get_column(self._target_name, is_input=True)
+        except NotImplementedError:
+            entries = list(data_loader)
 
-    def _binify(self, data: Dict[Union[int, str], float]) -> Dict[Union[int, str], int]:
-        entries = list(data.values())
-        bins = pd.qcut(
-            entries, self._bins_count, labels=False, duplicates="drop"
-        ).tolist()
+            ids = [entry.id_ for entry in entries]
 
-        return dict(zip(list(data.keys()), bins))
+            return np.array(ids), np.array([entry.inputs[self._target_name] for entry in entries])
 
-    def apply(self, data_loader: AbstractLoader) -> Dict[str, List[Union[int, str]]]:
-        from sklearn.model_selection import train_test_split
+    def _binify(self, values: np.ndarray) -> np.ndarray:
+        return pd.qcut(values, self._bins_count, labels=False, duplicates="drop")
 
-        leftover_data = (
+    def _stratified_order(self, values: np.ndarray) -> np.ndarray:
+        """
+        Shuffles the positions so that every class is spread evenly: entries are sorted by their (random) rank
+        within their class, relative to the class size. Any contiguous slice then holds each class in proportion.
+        """
+        permutation = RandomState(self._seed).permutation(len(values))
+        _, labels = np.unique(values[permutation], return_inverse=True)
+        counts = np.bincount(labels)
+
+        # rank of each entry within its class
+        ranks = np.empty(len(values))
+        class_starts = np.repeat(np.cumsum(counts) - counts, counts)
+        ranks[np.argsort(labels, kind="stable")] = np.arange(len(values)) - class_starts
+
+        return permutation[np.argsort((ranks + 0.5) / counts[labels], kind="stable")]
+
+    def apply(self, data_loader: AbstractLoader) -> Dict[str, List[Union[int, str]]]:
+        # ids and targets are kept as parallel arrays, splits are computed on positions
+        ids, values = (
             self._load_inputs(data_loader)
             if self._is_target_input
             else self._load_outputs(data_loader)
         )
         if self._bins_count > 0:
-            leftover_data = self._binify(leftover_data)
-
-        splits = {}
-        ratio_left = 1
+            values = self._binify(values)
 
-        for split_name, split_ratio in self.splits.items():
-            current_ratio = round(split_ratio / ratio_left, 4)
-
-            if current_ratio < 1:
-                current_split_ids, leftover_ids = train_test_split(
-                    list(leftover_data.keys()),
-                    train_size=current_ratio,
-                    random_state=RandomState(self._seed),
-                    stratify=list(leftover_data.values()),
-                )
-            else:
-                current_split_ids = list(leftover_data.keys())
-                leftover_ids = []
-
-            splits[split_name] = current_split_ids
-            leftover_data = {id_: leftover_data[id_] for id_ in leftover_ids}
-
-            ratio_left -= split_ratio
+        positions = self._stratified_order(values)
+        splits = {
+            split_name: ids[positions[start_index:end_index]].tolist()
+            for split_name, start_index, end_index in self._get_boundaries(len(positions))
+        }
 
         if self.rewrite:
-            [data.inputs.pop(self._target_name) for data in data_loader._dataset]
+            for entry in data_loader:
+                del entry.inputs[self._target_name]
 
         return splits
 
 
 class ScaffoldBalancerSplitter(AbstractSplitter):
-    def __init__(self, splits: Dict[str, float], seed: int, *args, **kwargs):
+    def __init__(
+        self, splits: Dict[str, float], seed: int, jobs: int = 1, cache_location: Optional[str] = None, *args, **kwargs
+    ):
         super().__init__(splits=splits)
         self._seed = seed
+        self._jobs = jobs
+        self._scaffold_cache = FeatureCache(cache_location, namespace="murcko_scaffold")
 
     def _load_groups(self, data_loader: AbstractLoader) -> Dict[Union[int, str], str]:
-        from rdkit.Chem.Scaffolds.MurckoScaffold import MurckoScaffoldSmiles
-
         logging.info("[SPLITTER] Extracting Scaffolds...")
-        return {
-            entry.id_: MurckoScaffoldSmiles(entry.inputs["smiles"])
-            for entry in tqdm(data_loader)
-        }
+        scaffolds = _extract_scaffolds(
+            (entry.inputs["smiles"] for entry in data_loader), cache=self._scaffold_cache, jobs=self._jobs
+        )
+
+        return {entry.id_: scaffolds[entry.inputs["smiles"]] for entry in data_loader}
 
     def apply(self, data_loader: AbstractLoader) -> Dict[str, List[Union[int, str]]]:
         from sklearn.model_selection import train_test_split
 
-        leftover_data = self._load_groups(data_loader)
+        groups = self._load_groups(data_loader)
+
+        # ids and groups are kept as parallel arrays, splits are computed on positions
+        ids = np.array(list(groups.keys()))
+        groups = np.array(list(groups.values()))
+
         splits = {}
         ratio_left = 1
+        leftover_positions = np.arange(len(ids))
 
         for split_name, split_ratio in self.splits.items():
             current_ratio = round(split_ratio / ratio_left, 4)
 
             if current_ratio < 1:
-                counts = Counter(leftover_data.values())
-                lone_scaffolds = [
-                    scaffold
-                    for scaffold, occurrences in counts.items()
-                    if occurrences == 1
-                ]
-
-                additional_ids = [
-                    id_
-                    for id_, scaffold in leftover_data.items()
-                    if scaffold in lone_scaffolds
-                ]
-
-                leftover_ratio = len(leftover_data) * (1 - current_ratio)
-                remaining_samples = len(leftover_data) - len(additional_ids)
-                adjusted_ratio = 1 - leftover_ratio / remaining_samples
-
-                leftover_data = {
-                    id_: leftover_data[id_]
-                    for id_ in set(leftover_data) - set(additional_ids)
-                }
-                current_split_ids, leftover_ids = train_test_split(
-                    list(leftover_data.keys()),
+                # groups with a single entry can't be stratified, they are added to the current split
+                _, group_indices, group_sizes = np.unique(
+                    groups[leftover_positions], return_inverse=True, return_counts=True
+                )
+                is_lone = group_sizes[group_indices] == 1
+
+                additional_positions = leftover_positions[is_lone]
+                remaining_positions = leftover_positions[~is_lone]
+
+                leftover_ratio = len(leftover_positions) * (1 - current_ratio)
+                adjusted_ratio = 1 - leftover_ratio / len(remaining_positions)
+
+                current_positions, leftover_positions = train_test_split(
+                    remaining_positions,
                     train_size=adjusted_ratio,
                     random_state=RandomState(self._seed),
-                    stratify=list(leftover_data.values()),
+                    stratify=groups[remaining_positions],
                 )
 
-                current_split_ids.extend(additional_ids)
+                current_positions = np.concatenate([current_positions, additional_positions])
             else:
-                current_split_ids = list(leftover_data.keys())
-                leftover_ids = []
-
-            splits[split_name] = current_split_ids
-            leftover_data = {id_: leftover_data[id_] for id_ in leftover_ids}
+                current_positions = leftover_positions
+                leftover_positions = leftover_positions[:0]
 
+            splits[split_name] = ids[current_positions].tolist()
             ratio_left -= split_ratio
 
         total_samples_count = len(data_loader)
@@ -306,54 +369,64 @@ class ScaffoldBalancerSplitter(AbstractSplitter):
 
 
 class ScaffoldDividerSplitter(AbstractSplitter):
-    def __init__(self, splits: Dict[str, float], seed: int, *args, **kwargs):
+    def __init__(
+        self, splits: Dict[str, float], seed: int, jobs: int = 1, cache_location: Optional[str] = None, *args, **kwargs
+    ):
         super().__init__(splits=splits)
         self._seed = seed
+        self._jobs = jobs
+        self._scaffold_cache = FeatureCache(cache_location, namespace="murcko_scaffold")
 
     def _load_groups(
         self, data_loader: AbstractLoader
     ) -> Dict[str, List[Union[int, str]]]:
-        from rdkit.Chem.Scaffolds.MurckoScaffold import MurckoScaffoldSmiles
-
         logging.info("[SPLITTER] Extracting Scaffolds...")
+        scaffolds = _extract_scaffolds(
+            (entry.inputs["smiles"] for entry in data_loader), cache=self._scaffold_cache, jobs=self._jobs
+        )
         sorted_scaffolds = defaultdict(list)
 
-        for entry in tqdm(data_loader):
-            scaffold = MurckoScaffoldSmiles(entry.inputs["smiles"])
-            sorted_scaffolds[scaffold].append(entry.id_)
+        for entry in data_loader:
+            sorted_scaffolds[scaffolds[entry.inputs["smiles"]]].append(entry.id_)
 
         return sorted_scaffolds
 
     def apply(self, data_loader: AbstractLoader) -> Dict[str, List[Union[int, str]]]:
-        leftover_data = self._load_groups(data_loader)
+        group_ids = list(self._load_groups(data_loader).values())
+        group_sizes = [len(ids) for ids in group_ids]
         mixer = Random(self._seed)
 
         splits = {}
         ratio_left = 1
+        leftover_groups = list(range(len(group_ids)))
 
         for split_name, split_ratio in self.splits.items():
             current_ratio = round(split_ratio / ratio_left, 4)
 
             if current_ratio < 1:
-                scaffolds = list(leftover_data.keys())
-                mixer.shuffle(scaffolds)
+                candidates = leftover_groups.copy()
+                mixer.shuffle(candidates)
 
-                current_split_ids = []
+                # greedy fill, groups are only assigned here and collected once the split is complete
+                current_groups = []
+                current_size = 0
                 required_entries = int(len(data_loader) * split_ratio)
 
-                for scaffold in scaffolds:
-                    if (
-                        len(current_split_ids) + len(leftover_data[scaffold])
-                        <= required_entries
-                    ):
-                        current_split_ids.extend(leftover_data[scaffold])
-                        leftover_data.pop(scaffold)
+                for group in candidates:
+                    if current_size + group_sizes[group] <= required_entries:
+                        current_groups.append(group)
+                        current_size += group_sizes[group]
+
+                        if current_size == required_entries:
+                            break
+
+                assigned_groups = set(current_groups)
+                leftover_groups = [group for group in leftover_groups if group not in assigned_groups]
             else:
-                current_split_ids = []
-                for ids in leftover_data.values():
-                    current_split_ids.extend(ids)
+                current_groups = leftover_groups
+                leftover_groups = []
 
-            splits[split_name] = current_split_ids
+            splits[split_name] = list(itertools.chain.from_iterable(group_ids[group] for group in current_groups))
             ratio_left -= split_ratio
 
         total_samples_count = len(data_loader)
@@ -367,51 +440,110 @@ class ScaffoldDividerSplitter(AbstractSplitter):
 
 
 class ButinaClusterer:
+    # number of set bits for each byte value
+    BIT_COUNTS = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
     def __init__(
-        self, butina_cutoff: float = 0.5, fingerprint_size: int = 1024, radius: int = 2, *args, **kwargs
+        self,
+        butina_cutoff: float = 0.5,
+        fingerprint_size: int = 1024,
+        radius: int = 2,
+        cache_location: Optional[str] = None,
+        *args, **kwargs
     ):
         self._butina_cutoff = butina_cutoff
         self._fingerprint_size = fingerprint_size
         self._radius = radius
+        self._fingerprint_cache = FeatureCache(
+            cache_location, namespace="morgan_fingerprint_{}_{}".format(radius, fingerprint_size)
+        )
+
+    def _pack_fingerprint(self, smiles: str) -> np.ndarray:
+        from rdkit import DataStructs
+        from rdkit.Chem import AllChem
+
+        bits = np.zeros(self._fingerprint_size, dtype=np.uint8)
+        DataStructs.ConvertToNumpyArray(
+            AllChem.GetMorganFingerprintAsBitVect(Chem.MolFromSmiles(smiles), self._radius, self._fingerprint_size),
+            bits
+        )
+
+        return np.packbits(bits)
 
     def _generate_clusters(
         self, data_loader: AbstractLoader
     ) -> Tuple[List[Union[str, int]], Tuple[Tuple[int, ...]]]:
 
-        from rdkit import DataStructs
-        from rdkit.Chem import AllChem
-        from rdkit.ML.Cluster import Butina
-
         logging.info("[SPLITTER] Generating fingerprints...")
 
         ids = []
         fingerprints = []
+        packed_fingerprints = {}  # duplicated, or cached, SMILES are only processed once
+        computed_fingerprints = {}
         for entry in tqdm(data_loader):
+            smiles = entry.inputs["smiles"]
+            if smiles not in packed_fingerprints:
+                packed_fingerprints[smiles] = self._fingerprint_cache.get(smiles)
+
+                if packed_fingerprints[smiles] is None:
+                    packed_fingerprints[smiles] = computed_fingerprints[smiles] = self._pack_fingerprint(smiles)
+
             ids.append(entry.id_)
-            fingerprints.append(
-                AllChem.GetMorganFingerprintAsBitVect(
-                    Chem.MolFromSmiles(entry.inputs["smiles"]),
-                    self._radius,
-                    self._fingerprint_size,
-                )
-            )
+            fingerprints.append(packed_fingerprints[smiles])
+
+        self._fingerprint_cache.set_many(computed_fingerprints)
 
         samples_count = len(fingerprints)
         logging.info("[SPLITTER] Computing Similarities...")
 
-        similarities = []
+        # Tanimoto similarities, computed on packed bits: |a & b| / (|a| + |b| - |a & b|)
+        # only the neighbours within the cutoff are kept, instead of the full N * (N - 1) / 2 distance matrix
+        fingerprints = np.stack(fingerprints)
+        on_bits = self.BIT_COUNTS[fingerprints].sum(axis=1, dtype=np.int64)
+
+        lower_neighbours = [np.empty(0, dtype=np.int64)]
+        upper_neighbours = [[] for _ in range(samples_count)]
         for i in range(1, samples_count):
-            similarity = DataStructs.BulkTanimotoSimilarity(
-                fingerprints[i], fingerprints[:i]
-            )
-            similarities.extend([1 - j for j in similarity])
+            common = self.BIT_COUNTS[fingerprints[:i] & fingerprints[i]].sum(axis=1, dtype=np.int64)
+            total = on_bits[:i] + on_bits[i] - common
+
+            distances = 1 - np.divide(common, total, out=np.zeros(i), where=total > 0)
+            neighbours = np.flatnonzero(distances <= self._butina_cutoff)
+
+            lower_neighbours.append(neighbours)
+            for neighbour in neighbours.tolist():
+                upper_neighbours[neighbour].append(i)
 
         logging.info("[SPLITTER] Clustering...")
-        clusters = Butina.ClusterData(
-            similarities, samples_count, self._butina_cutoff, isDistData=True
-        )
+        neighbours = [
+            lower.tolist() + upper for lower, upper in zip(lower_neighbours, upper_neighbours)
+        ]
+
+        return ids, self._cluster(neighbours)
+
+    @staticmethod
+    def _cluster(neighbours: List[List[int]]) -> Tuple[Tuple[int, ...], ...]:
+        """
+        Same as "rdkit.ML.Cluster.Butina.ClusterData" (without reordering), from neighbour lists:
+        the samples with the most neighbours become cluster centroids, ties are broken by the highest index.
+        """
+        candidates = sorted(((len(entries), index) for index, entries in enumerate(neighbours)), reverse=True)
+        seen = [False] * len(neighbours)
+        clusters = []
 
-        return ids, clusters
+        for _, index in candidates:
+            if seen[index]:
+                continue
+
+            cluster = [index]
+            for neighbour in neighbours[index]:
+                if not seen[neighbour]:
+                    cluster.append(neighbour)
+                    seen[neighbour] = True
+
+            clusters.append(tuple(cluster))
+
+        return tuple(clusters)
 
 
 class ButinaBalancerSplitter(ScaffoldBalancerSplitter, ButinaClusterer):
@@ -422,6 +554,7 @@ class ButinaBalancerSplitter(ScaffoldBalancerSplitter, ButinaClusterer):
         butina_cutoff: float = 0.5,
         fingerprint_size: int = 1024,
         radius: int = 2,
+        cache_location: Optional[str] = None,
         *args, **kwargs
     ):
         ScaffoldBalancerSplitter.__init__(self, splits=splits, seed=seed)
@@ -430,6 +563,7 @@ class ButinaBalancerSplitter(ScaffoldBalancerSplitter, ButinaClusterer):
             butina_cutoff=butina_cutoff,
             fingerprint_size=fingerprint_size,
             radius=radius,
+            cache_location=cache_location,
         )
 
     def _load_groups(self, data_loader: AbstractLoader) -> Dict[Union[int, str], float]:
@@ -451,6 +585,7 @@ class ButinaDividerSplitter(ScaffoldDividerSplitter, ButinaClusterer):
         butina_cutoff: float = 0.5,
         fingerprint_size: int = 1024,
         radius: int = 2,
+        cache_location: Optional[str] = None,
         *args, **kwargs
     ):
         ScaffoldDividerSplitter.__init__(self, splits=splits, seed=seed)
@@ -459,6 +594,7 @@ class ButinaDividerSplitter(ScaffoldDividerSplitter, ButinaClusterer):
             butina_cutoff=butina_cutoff,
             fingerprint_size=fingerprint_size,
             radius=radius,
+            cache_location=cache_location,
         )
 
     def _load_groups(
@@ -505,11 +641,11 @@ class DescriptorSplitter(StratifiedSplitter):
                 "Unknown descriptor requested: {}".format(self._descriptor)
             )
 
-    def _load_inputs(self, data_loader: AbstractLoader) -> Dict[Union[int, str], float]:
-        entries = {}
-        for entry in data_loader:
-            entries[entry.id_] = self._descriptor_calculator.CalcDescriptors(
-                Chem.MolFromSmiles(entry.inputs[self._target_name])
-            )[0]
+    def _load_inputs(self, data_loader: AbstractLoader) -> Tuple[np.ndarray, np.ndarray]:
+        ids, smiles = super()._load_inputs(data_loader)
+
+        descriptors = {}  # duplicated SMILES are only processed once
+        for entry in set(smiles.tolist()):
+            descriptors[entry] = self._descriptor_calculator.CalcDescriptors(Chem.MolFromSmiles(entry))[0]
 
-        return entries
+        return ids, np.array([descriptors[entry] for entry in smiles.tolist()])
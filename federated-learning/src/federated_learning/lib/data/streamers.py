@@ -1,24 +1,101 @@
+import itertools
 import logging
-import operator
 from abc import ABCMeta, abstractmethod
-from copy import copy
 from enum import Enum
-from functools import reduce
-from typing import List, Dict, Union
+from functools import partial
+from typing import Any, Dict, Iterator, List, Union
 
+import joblib
+import numpy as np
+from joblib.externals.loky import get_reusable_executor
 from torch.utils.data import DataLoader, Subset
+from torch.utils.data.distributed import DistributedSampler
 from tqdm import tqdm
 
 from federated_learning.lib.core.config import Config
 from federated_learning.lib.core.exceptions import FeaturizationError
 from federated_learning.lib.core.helpers import SuperFactory, CacheManager
-from federated_learning.lib.data.featurizers import AbstractFeaturizer
+from federated_learning.lib.data.featurizers import AbstractFeaturizer, FeatureCache
 from federated_learning.lib.data.loaders import AbstractLoader, ListLoader
-from federated_learning.lib.data.resources import DataPoint, Collater, LoadedContent
+from federated_learning.lib.data.resources import CachedBatches, DataPoint, Collater, DevicePrefetcher, LoadedContent
 from federated_learning.lib.data.splitters import AbstractSplitter
 from federated_learning.lib.data.transformers import AbstractTransformer
 
 
+def _create_featurizers(
+    configurations: List[Dict[str, Any]], cache_location: str, clear_cache: bool = False
+) -> List[AbstractFeaturizer]:
+    featurizers = []
+    for configuration in configurations:
+        feature_cache = FeatureCache(cache_location, namespace=CacheManager.key(featurizer=configuration))
+        if clear_cache and configuration.get("should_cache", False):
+            feature_cache.clear()
+
+        featurizer = SuperFactory.create(AbstractFeaturizer, configuration)
+        featurizer.set_feature_cache(feature_cache)
+
+        featurizers.append(featurizer)
+
+    return featurizers
+
+
+# errors caused by a single (invalid) sample, which is then skipped
+_SAMPLE_ERRORS = (
+    FeaturizationError,
+    ValueError,
+    IndexError,
+    AttributeError,
+    TypeError,
+)
+
+
+def _run_featurizer(featurizer: AbstractFeaturizer, sample: DataPoint) -> None:
+    try:
+        featurizer.run(sample)
+    except _SAMPLE_ERRORS as e:
+        raise FeaturizationError(
+            "[WARNING] Could not run featurizer '{}' on '{}' --- {}".format(
+                featurizer.__class__.__name__, sample.id_, e
+            )
+        )
+
+
+def _featurize_samples(
+    featurizers: List[AbstractFeaturizer], samples: List[DataPoint]
+) -> List[Union[DataPoint, FeaturizationError]]:
+    """
+    Each featurizer is applied on the whole chunk before the next one, so it can prepare batched
+    resources first (see "AbstractFeaturizer.prepare"). Samples which fail are replaced by their error.
+    """
+    results = list(samples)
+
+    for featurizer in featurizers:
+        try:
+            featurizer.prepare([sample for sample in results if isinstance(sample, DataPoint)])
+        except _SAMPLE_ERRORS as e:
+            # one invalid sample fails the whole batch, the samples are then featurized (and skipped) one by one
+            logging.debug("Could not prepare featurizer '{}' in batch --- {}".format(featurizer.__class__.__name__, e))
+
+        for index, sample in enumerate(results):
+            if isinstance(sample, DataPoint):
+                try:
+                    _run_featurizer(featurizer, sample)
+                except FeaturizationError as e:
+                    results[index] = e
+
+    return results
+
+
+def _featurize_chunk(
+    configurations: List[Dict[str, Any]], cache_location: str, samples: List[DataPoint]
+) -> List[Union[DataPoint, FeaturizationError]]:
+    """
+    Runs in a worker process. Featurizers are rebuilt from their configuration instead of being pickled,
+    molecules are only parsed inside the worker (RDKit objects can't be sent across processes).
+    """
+    return _featurize_samples(_create_featurizers(configurations, cache_location), samples)
+
+
 class AbstractStreamer(metaclass=ABCMeta):
     def __init__(self):
         self._dataset = self._load_dataset()
@@ -37,14 +114,15 @@ class AbstractStreamer(metaclass=ABCMeta):
 
 
 class GeneralStreamer(AbstractStreamer):
+    FEATURIZATION_CHUNK_SIZE = 256
+
     def __init__(self, config: Config):
         self._config = config
         self._cache_manager = CacheManager(cache_location=self._config.cache_location)
 
-        self._featurizers = [
-            SuperFactory.create(AbstractFeaturizer, featurizer)
-            for featurizer in self._config.featurizers
-        ]
+        self._featurizers = _create_featurizers(
+            self._config.featurizers, self._config.cache_location, clear_cache=self._config.clear_cache
+        )
 
         self._transformers = [
             SuperFactory.create(AbstractTransformer, transformer)
@@ -52,10 +130,13 @@ class GeneralStreamer(AbstractStreamer):
         ]
         self._dataset = self._load_dataset()
         self.splits = self._generate_splits()
+        self._loaders = {}
 
     def _generate_splits(self) -> Dict[str, List[Union[int, str]]]:
         self._config.splitter['test_split'] = self._config.test_split
-        splitter = SuperFactory.create(AbstractSplitter, self._config.splitter)
+        splitter = SuperFactory.create(
+            AbstractSplitter, self._config.splitter, {"cache_location": self._config.cache_location}
+        )
         return splitter.apply(data_loader=self._dataset)
 
     def _load_dataset(self) -> AbstractLoader:
@@ -70,22 +151,31 @@ class GeneralStreamer(AbstractStreamer):
             },
         )
 
-    def _featurize(self, sample: DataPoint):
-        for featurizer in self._featurizers:
-            try:
-                featurizer.run(sample)
-            except (
-                FeaturizationError,
-                ValueError,
-                IndexError,
-                AttributeError,
-                TypeError,
-            ) as e:
-                raise FeaturizationError(
-                    "[WARNING] Could not run featurizer '{}' on '{}' --- {}".format(
-                        featurizer.__class__.__name__, sample.id_, e
-                    )
-                )
+    def _featurize_all(self, loader: AbstractLoader) -> Iterator[Union[DataPoint, FeaturizationError]]:
+        if self._config.featurization_jobs == 1:
+            samples = iter(loader)
+            chunk = list(itertools.islice(samples, self.FEATURIZATION_CHUNK_SIZE))
+
+            while chunk:
+                yield from _featurize_samples(self._featurizers, chunk)
+                chunk = list(itertools.islice(samples, self.FEATURIZATION_CHUNK_SIZE))
+
+            return
+
+        samples = list(loader)
+        jobs = joblib.effective_n_jobs(self._config.featurization_jobs)
+        chunk_size = max(1, -(-len(samples) // (jobs * 4)))  # a few chunks per worker to balance the load
+
+        # results are streamed back in order, as soon as each chunk is ready, so the transformers
+        # and the progress bar run while the workers are still featurizing the next chunks
+        executor = get_reusable_executor(max_workers=jobs)
+        results = executor.map(
+            partial(_featurize_chunk, self._config.featurizers, self._config.cache_location),
+            (samples[start:start + chunk_size] for start in range(0, len(samples), chunk_size)),
+        )
+
+        for chunk in results:
+            yield from chunk
 
     def _apply_transformers(self, sample: DataPoint) -> None:
         for transformer in self._transformers:
@@ -95,6 +185,13 @@ class GeneralStreamer(AbstractStreamer):
         for transformer in reversed(self._transformers):
             transformer.reverse(sample)
 
+    def reverse_transformers_batch(self, outputs: np.ndarray) -> np.ndarray:
+        outputs = np.array(outputs)  # the reversal is done on a copy
+        for transformer in reversed(self._transformers):
+            outputs = transformer.reverse_batch(outputs)
+
+        return outputs
+
     def _prepare_dataset(self) -> ListLoader:
 
         loader = SuperFactory.create(AbstractLoader, self._config.loader)
@@ -104,17 +201,15 @@ class GeneralStreamer(AbstractStreamer):
         ids = []
 
         with tqdm(total=len(loader)) as progress_bar:
-            for sample in loader:
-                try:
-                    self._featurize(sample)
+            for sample in self._featurize_all(loader):
+                if isinstance(sample, FeaturizationError):
+                    logging.warning(sample)
+                else:
                     self._apply_transformers(sample)
 
                     dataset.append(sample)
                     ids.append(sample.id_)
 
-                except FeaturizationError as e:
-                    logging.warning(e)
-
                 progress_bar.update(1)
 
         dataset = ListLoader(dataset, ids)
@@ -126,19 +221,49 @@ class GeneralStreamer(AbstractStreamer):
     def get(
         self, split_name: str, batch_size: int, shuffle: bool, **kwargs
     ) -> LoadedContent:
-        collater = Collater(device=self._config.get_device())
+        """
+        Loaders which are not shuffled always yield the same batches, they are built once and reused
+        (ie: when evaluating every checkpoint or round on the same test fold).
+        """
+        if shuffle:
+            return self._create_loader(split_name, batch_size, shuffle, **kwargs)
+
+        key = (split_name, batch_size) + tuple(
+            (name, tuple(value) if isinstance(value, list) else value) for name, value in sorted(kwargs.items())
+        )
+        if key not in self._loaders:
+            loader = self._create_loader(split_name, batch_size, shuffle, **kwargs)
+            if self._config.cache_batches:
+                loader.dataset = CachedBatches(loader.dataset)
+
+            self._loaders[key] = loader
+
+        return self._loaders[key]
+
+    def _create_loader(
+        self, split_name: str, batch_size: int, shuffle: bool, **kwargs
+    ) -> LoadedContent:
+        device = self._config.get_device()
+        collater = Collater(device=device)
+        subset = self._get_subset(split_name, **kwargs)
+
+        # when training with torchrun, each process sees its own shard of the (shuffled) training data
+        sampler = None
+        if shuffle and self._config.is_distributed():
+            sampler = DistributedSampler(subset, shuffle=True)
 
         data_loader = DataLoader(
-            dataset=self._get_subset(split_name, **kwargs),
+            dataset=subset,
             collate_fn=collater.apply,
             batch_size=batch_size,
-            shuffle=shuffle,
+            shuffle=shuffle and sampler is None,
+            sampler=sampler,
         )
 
         return LoadedContent(
-            dataset=data_loader,
+            dataset=DevicePrefetcher(data_loader, device) if device.type == "cuda" else data_loader,
             batches=len(data_loader),
-            samples=len(data_loader.dataset),
+            samples=len(data_loader.sampler),
         )
 
 
@@ -164,6 +289,10 @@ class CrossValidationStreamer(GeneralStreamer):
         TRAIN = "train"
         TEST = "test"
 
+    def __init__(self, config: Config):
+        self._training_indices = {}
+        super().__init__(config)
+
     def get_fold_name(self, fold: int) -> str:
         return "fold_{}".format(fold)
 
@@ -175,17 +304,24 @@ class CrossValidationStreamer(GeneralStreamer):
         }
 
         splitter = SuperFactory.create(
-            AbstractSplitter, self._config.splitter, {"splits": splits}
+            AbstractSplitter, self._config.splitter, {"splits": splits, "cache_location": self._config.cache_location}
         )
         return splitter.apply(data_loader=self._dataset)
 
+    def _get_training_indices(self, split_name: str) -> List[Union[int, str]]:
+        """All folds except the one used for testing, flattened. The splits don't change, results are reused."""
+        if split_name not in self._training_indices:
+            self._training_indices[split_name] = list(itertools.chain.from_iterable(
+                indices for fold_name, indices in self.splits.items() if fold_name != split_name
+            ))
+
+        return self._training_indices[split_name]
+
     def _get_subset(self, split_name: str, mode: Mode) -> Subset:
         if mode == self.Mode.TEST:
             indices = self.splits[split_name]
         else:
-            indices = copy(self.splits)
-            indices.pop(split_name)
-            indices = reduce(operator.iconcat, indices.values(), [])  # flatten
+            indices = self._get_training_indices(split_name)
 
         return Subset(dataset=self._dataset, indices=indices)
 
@@ -198,9 +334,7 @@ class CVSubsetStreamer(CrossValidationStreamer):
             indices = self.splits[split_name]
             return Subset(dataset=self._dataset, indices=indices)
         else:
-            indices = copy(self.splits)
-            indices.pop(split_name)
-            indices = reduce(operator.iconcat, indices.values(), [])  # flatten
+            indices = self._get_training_indices(split_name)
 
             remaining_entries_count = len(indices)
             start_index = int(
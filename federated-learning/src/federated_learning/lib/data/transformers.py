@@ -1,5 +1,5 @@
 from abc import ABCMeta, abstractmethod
-from typing import List
+from typing import List, Union
 import logging
 from federated_learning.lib.core.exceptions import TransformerError
 import numpy as np
@@ -16,6 +16,30 @@ class AbstractTransformer(metaclass=ABCMeta):
     def reverse(self, data: DataPoint) -> None:
         raise NotImplementedError
 
+    def reverse_batch(self, outputs: np.ndarray) -> np.ndarray:
+        """
+        Reverse the outputs of a whole batch (one row per sample).
+        Transformers without a vectorized implementation reverse the samples one by one.
+        """
+        rows = []
+        for row in outputs:
+            data = DataPoint(outputs=row.tolist())
+            self.reverse(data)
+            rows.append(data.outputs)
+
+        return np.array(rows)
+
+    @staticmethod
+    def _assign(outputs: np.ndarray, columns: Union[int, List[int]], values: np.ndarray) -> np.ndarray:
+        """Write values in some columns, promoting the outputs first if their type cannot hold them."""
+        values = np.asarray(values)
+        if not np.can_cast(values.dtype, outputs.dtype, casting="same_kind"):
+            numeric = values.dtype.kind in "biuf" and outputs.dtype.kind in "biuf"
+            outputs = outputs.astype(np.result_type(outputs, values) if numeric else object)
+
+        outputs[:, columns] = values
+        return outputs
+
 
 class LogNormalizeTransformer(AbstractTransformer):
     def __init__(self, targets: List[int]):
@@ -30,6 +54,9 @@ class LogNormalizeTransformer(AbstractTransformer):
         for target in self._targets:
             data.outputs[target] = np.exp(data.outputs[target])
 
+    def reverse_batch(self, outputs: np.ndarray) -> np.ndarray:
+        return self._assign(outputs, self._targets, np.exp(outputs[:, self._targets]))
+
 
 class MinMaxNormalizeTransformer(AbstractTransformer):
     def __init__(self, target: int, minimum: float, maximum: float):
@@ -47,6 +74,10 @@ class MinMaxNormalizeTransformer(AbstractTransformer):
             data.outputs[self._target] * (self._maximum - self._minimum) + self._minimum
         )
 
+    def reverse_batch(self, outputs: np.ndarray) -> np.ndarray:
+        values = outputs[:, self._target] * (self._maximum - self._minimum) + self._minimum
+        return self._assign(outputs, self._target, values)
+
 
 class FixedNormalizeTransformer(AbstractTransformer):
     def __init__(self, targets: List[int], value: float):
@@ -61,6 +92,9 @@ class FixedNormalizeTransformer(AbstractTransformer):
         for target in self._targets:
             data.outputs[target] = round(data.outputs[target] * self._value, 8)
 
+    def reverse_batch(self, outputs: np.ndarray) -> np.ndarray:
+        return self._assign(outputs, self._targets, np.round(outputs[:, self._targets] * self._value, 8))
+
 
 class StandardizeTransformer(AbstractTransformer):
     def __init__(self, target: int, mean: float, std: float):
@@ -76,6 +110,9 @@ class StandardizeTransformer(AbstractTransformer):
     def reverse(self, data: DataPoint) -> None:
         data.outputs[self._target] = data.outputs[self._target] * self._std + self._mean
 
+    def reverse_batch(self, outputs: np.ndarray) -> np.ndarray:
+        return self._assign(outputs, self._target, outputs[:, self._target] * self._std + self._mean)
+
 
 class CutoffTransformer(AbstractTransformer):
     def __init__(self, target: int, cutoff: float):
@@ -94,6 +131,9 @@ class CutoffTransformer(AbstractTransformer):
     def reverse(self, data: DataPoint) -> None:
         pass
 
+    def reverse_batch(self, outputs: np.ndarray) -> np.ndarray:
+        return outputs
+
 
 class OneHotTransformer(AbstractTransformer):
     def __init__(self, target: int, classes: List[str]):
@@ -112,3 +152,7 @@ class OneHotTransformer(AbstractTransformer):
 
     def reverse(self, data: DataPoint) -> None:
         data.outputs[self._target] = self._classes[data.outputs[self._target]]
+
+    def reverse_batch(self, outputs: np.ndarray) -> np.ndarray:
+        classes = np.array(self._classes, dtype=object)
+        return self._assign(outputs, self._target, classes[outputs[:, self._target].astype(int)])
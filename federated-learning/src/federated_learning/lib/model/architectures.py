@@ -1,3 +1,4 @@
+import inspect
 import logging
 from abc import ABCMeta, abstractmethod
 from typing import NamedTuple
@@ -6,13 +7,21 @@ from typing import Any, Dict, List, Optional
 
 import torch
 import torch_geometric as geometric
-from federated_learning.lib.core.helpers import Namespace, SuperFactory
-from federated_learning.lib.core.observers import EventManager
+from federated_learning.lib.core.helpers import SuperFactory
+from federated_learning.lib.core.observers import CheckpointLoadPayload, EventManager
 from federated_learning.lib.core.exceptions import CheckpointNotFound
-from federated_learning.lib.model.layers import GraphConvolutionWrapper, LinearBlock, TripletMessagePassingLayer
+from federated_learning.lib.model.layers import (
+    BitUnpacker, GraphConvolutionWrapper, LinearBlock, OneHotExpander, TripletMessagePassingLayer
+)
+
+# checkpoints are memory-mapped when supported (PyTorch 2.1+): loading the same file several times
+# (weights, then optimizer state, evaluation of each round...) only reads the pages actually used once
+_LOAD_OPTIONS = {"mmap": True} if "mmap" in inspect.signature(torch.load).parameters else {}
 
 
 class AbstractNetwork(torch.nn.Module, metaclass=ABCMeta):
+    # name of a "Sequential" module which can be gradient checkpointed
+    checkpointed_blocks_name: Optional[str] = None
 
     @abstractmethod
     def get_requirements(self) -> List[str]:
@@ -34,12 +43,21 @@ class AbstractNetwork(torch.nn.Module, metaclass=ABCMeta):
             device = torch.device("cpu")
 
         logging.info("Restoring from Checkpoint: {}".format(checkpoint_path))
-        info = torch.load(checkpoint_path, map_location=device)
+        info = self.read_checkpoint(checkpoint_path, device)
 
-        payload = Namespace(network=self, info=info)
+        payload = CheckpointLoadPayload(network=self, info=info)
         EventManager.dispatch_event(event_name="before_checkpoint_load", payload=payload)
 
-        self.load_state_dict(info["model"])
+        state = info["model"]
+        if any(value.is_quantized for value in state.values()):
+            # checkpoints sent by federated clients can be quantized
+            state = {key: value.dequantize() if value.is_quantized else value for key, value in state.items()}
+
+        self.load_state_dict(state)
+
+    @staticmethod
+    def read_checkpoint(checkpoint_path: str, device: torch.device) -> Dict[str, Any]:
+        return torch.load(checkpoint_path, map_location=device, **_LOAD_OPTIONS)
 
     @staticmethod
     def dropout_layer_switch(m, dropout_prob):
@@ -311,6 +329,8 @@ class SimpleMLPNetwork(AbstractNetwork):
     """ Multi layers perceptron Network.
 
     """
+    checkpointed_blocks_name = "model"
+
     def __init__(
         self,
         in_features: int,
@@ -348,18 +368,34 @@ class SimpleMLPNetwork(AbstractNetwork):
 
 
 class LinearNetwork(AbstractNetwork, LinearBlock):
+    def __init__(
+        self,
+        in_features: int,
+        hidden_features: int,
+        out_features: int,
+        activation: str = "torch.nn.ReLU",
+        packed_inputs: bool = False,
+    ):
+        super().__init__(in_features, hidden_features, out_features, activation)
+        self.unpacker = BitUnpacker(in_features) if packed_inputs else None
+
     def get_requirements(self) -> List[str]:
         return ["features"]
 
     def forward(self, data: Dict[str, Any]) -> torch.Tensor:
         features = data[self.get_requirements()[0]]
+        if self.unpacker is not None:
+            features = self.unpacker(features)
+
         return super().forward(features)
 
 
 class ConvolutionalNetwork(AbstractNetwork):
-    def __init__(self, in_features: int, hidden_features: int, out_features: int):
+    def __init__(self, in_features: int, hidden_features: int, out_features: int, compact_inputs: bool = False):
         super().__init__()
 
+        self.expander = OneHotExpander(in_features) if compact_inputs else None
+
         self.convolutional_block = torch.nn.Sequential(
             torch.nn.Conv1d(in_channels=in_features, out_channels=10, kernel_size=3, stride=1),
             torch.nn.ReLU(),
@@ -374,6 +410,8 @@ class ConvolutionalNetwork(AbstractNetwork):
 
     def forward(self, data: Dict[str, Any]) -> torch.Tensor:
         x = data[self.get_requirements()[0]]
+        if self.expander is not None:
+            x = self.expander(x)
 
         x = self.convolutional_block(x)
         x = torch.flatten(x, start_dim=1)
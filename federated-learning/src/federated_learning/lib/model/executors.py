@@ -1,27 +1,92 @@
 import logging
 import math
+import os
 from abc import ABCMeta
-from copy import copy
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from copy import copy, deepcopy
 from functools import partial
-from glob import glob
-from typing import List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
 import torch
 from federated_learning.lib.core.config import Config
 from federated_learning.lib.core.exceptions import CheckpointNotFound
 from federated_learning.lib.core.helpers import HookProbe, Namespace, SuperFactory, Timer
-from federated_learning.lib.core.observers import EventManager
+from federated_learning.lib.core.observers import (
+    AfterCriterionPayload, BeforeCriterionPayload, CheckpointLoadedPayload, CheckpointSavePayload, EventManager,
+    NetworkCreatedPayload, PredictionPayload, ProgressLogPayload, TrainingPayload
+)
 from federated_learning.lib.data.resources import Batch, LoadedContent
 from federated_learning.lib.model.architectures import AbstractNetwork, EnsembleNetwork
+from federated_learning.lib.model.layers import CheckpointedSequential
 from federated_learning.lib.model.metrics import PredictionProcessor
 from federated_learning.lib.model.trackers import ExponentialAverageMeter
 from torch.nn.modules.loss import _Loss as AbstractCriterion
+from torch.nn.parallel import DistributedDataParallel
 from torch.optim import Optimizer as AbstractOptimizer
 from torch.optim.lr_scheduler import ExponentialLR
 from torch.optim.lr_scheduler import _LRScheduler as AbstractLearningRateScheduler
 from tqdm import tqdm
 
+# inference mode also skips the version counters and view tracking (PyTorch 1.9+)
+_inference_context = getattr(torch, "inference_mode", torch.no_grad)
+
+
+def _copy_to_cpu(value: Any) -> Any:
+    if isinstance(value, torch.Tensor):
+        return value.detach().to("cpu", copy=True)
+
+    if isinstance(value, dict):
+        copied = type(value)((key, _copy_to_cpu(item)) for key, item in value.items())
+        if hasattr(value, "_metadata"):
+            copied._metadata = value._metadata  # module versions, used when loading state dicts
+
+        return copied
+
+    if isinstance(value, (list, tuple)):
+        return type(value)(_copy_to_cpu(item) for item in value)
+
+    return deepcopy(value)
+
+
+class _PositionalNetwork(torch.nn.Module):
+    """Networks expect a dictionary of inputs, CUDA graphed callables only accept positional tensors"""
+
+    def __init__(self, network: torch.nn.Module, names: Tuple[str, ...]):
+        super().__init__()
+        self.network = network
+        self._names = names
+
+    def forward(self, *inputs: torch.Tensor) -> torch.Tensor:
+        return self.network(dict(zip(self._names, inputs)))
+
+
+class _GraphedNetwork:
+    """Replays the CUDA graphs of the network forward and backward passes, for batches shaped like the captured one"""
+
+    def __init__(self, network: torch.nn.Module, sample_inputs: Dict[str, torch.Tensor]):
+        self._names = tuple(sample_inputs.keys())
+        self._signature = self._get_signature(sample_inputs)
+
+        self._graphed_network = torch.cuda.make_graphed_callables(
+            _PositionalNetwork(network, self._names), tuple(sample_inputs[name] for name in self._names)
+        )
+
+    @staticmethod
+    def _get_signature(inputs: Dict[str, Any]) -> Optional[Tuple[Any, ...]]:
+        if not all(isinstance(value, torch.Tensor) for value in inputs.values()):
+            return None
+
+        return tuple((name, value.shape, value.dtype, value.device) for name, value in inputs.items())
+
+    def matches(self, inputs: Dict[str, Any]) -> bool:
+        return self._get_signature(inputs) == self._signature
+
+    def __call__(self, inputs: Dict[str, torch.Tensor]) -> torch.Tensor:
+        return self._graphed_network(*(inputs[name] for name in self._names))
+
 
 class AbstractExecutor(metaclass=ABCMeta):
     def __init__(self, config: Config):
@@ -35,38 +100,134 @@ class AbstractExecutor(metaclass=ABCMeta):
         self.optimizer = None
         self.criterion = None
         self.scheduler = None
+        self.scaler = None
+        self._autocast_dtype = None
 
     def _load_checkpoint(self, train: bool=False) -> None:
         self.network.load_checkpoint(self.config.checkpoint_path, self.config.get_device())
 
         if not self.config.is_finetuning and train:
-            info = torch.load(self.config.checkpoint_path, map_location=self.config.get_device())
+            info = self.network.read_checkpoint(self.config.checkpoint_path, self.config.get_device())
             if self.optimizer and "optimizer" in info:
                 self.optimizer.load_state_dict(info["optimizer"])
 
             if self.scheduler and "scheduler" in info:
                 self.scheduler.load_state_dict(info["scheduler"])
 
+            if self.scaler and "scaler" in info:
+                self.scaler.load_state_dict(info["scaler"])
+
             if "epoch" in info:
                 self._start_epoch = info["epoch"]
 
-        payload = Namespace(executor=self)
+        payload = CheckpointLoadedPayload(executor=self)
         EventManager.dispatch_event(event_name="after_checkpoint_load", payload=payload)
 
     def _setup_network(self) -> None:
         self.network = SuperFactory.create(AbstractNetwork, self.config.model)
 
-        payload = Namespace(executor=self, config=self.config)
+        payload = NetworkCreatedPayload(executor=self, config=self.config)
         EventManager.dispatch_event(event_name="after_network_create", payload=payload)
 
+        if self.config.gradient_checkpointing:
+            self._checkpoint_network()
+
         if self.config.should_parallelize():
             self.network = torch.nn.DataParallel(self.network, device_ids=self.config.enabled_gpus)
 
         self.network.to(self.config.get_device())
 
+    def _checkpoint_network(self) -> None:
+        networks = self.network.models if isinstance(self.network, EnsembleNetwork) else [self.network]
+        for network in networks:
+            blocks = getattr(network, network.checkpointed_blocks_name or "", None)
+            if not isinstance(blocks, torch.nn.Sequential):
+                logging.warning("[EXECUTOR] {} does not support gradient checkpointing.".format(type(network).__name__))
+                continue
+
+            checkpointed_blocks = CheckpointedSequential(
+                OrderedDict(blocks.named_children()), segments=self.config.checkpoint_segments
+            )
+            setattr(network, network.checkpointed_blocks_name, checkpointed_blocks)
+
+    def _distribute_network(self) -> None:
+        """
+        One process per GPU (launched with ``torchrun``), gradients are all-reduced while the backward pass runs.
+        Gradients are views of the all-reduce buckets, which saves a copy of them.
+        """
+        if not self.config.is_distributed():
+            return
+
+        use_cuda = self.config.get_device().type == "cuda"
+        if not torch.distributed.is_initialized():
+            torch.distributed.init_process_group(backend="nccl" if use_cuda else "gloo")
+
+        if use_cuda:
+            torch.cuda.set_device(self.config.get_device())
+            self.network = DistributedDataParallel(
+                self.network, device_ids=[self.config.get_local_rank()], bucket_cap_mb=25, gradient_as_bucket_view=True
+            )
+        else:
+            self.network = DistributedDataParallel(self.network, bucket_cap_mb=25, gradient_as_bucket_view=True)
+
+    def _compile_network(self, mode: str) -> None:
+        if not self.config.compile_network:
+            return
+
+        if not hasattr(torch, "compile"):
+            logging.warning("[EXECUTOR] Network compilation requires PyTorch 2.0 or newer. Running in eager mode.")
+            return
+
+        try:
+            self.network = torch.compile(self.network, mode=mode)
+        except RuntimeError as e:
+            logging.warning("[EXECUTOR] Network compilation failed ({}). Running in eager mode.".format(e))
+
+    def _get_autocast_dtype(self, precision: Optional[str]) -> Optional[torch.dtype]:
+        if precision is None:
+            return None
+
+        if self.config.get_device().type != "cuda":
+            logging.warning("[EXECUTOR] Mixed precision requires a GPU. Running in full precision.")
+            return None
+
+        dtype = getattr(torch, precision)
+        if dtype != torch.float16 and not hasattr(torch, "autocast"):
+            logging.warning(
+                "[EXECUTOR] bfloat16 mixed precision requires PyTorch 1.10 or newer. Running in full precision."
+            )
+            return None
+
+        return dtype
+
+    def _get_autocast_context(self):
+        """The forward pass (and the criterion, when training) run in half precision"""
+        if self._autocast_dtype is None:
+            return nullcontext()
+
+        if hasattr(torch, "autocast"):
+            return torch.autocast(device_type="cuda", dtype=self._autocast_dtype)
+
+        return torch.cuda.amp.autocast()
+
+    def get_uncompiled_network(self) -> torch.nn.Module:
+        """The compiled and distributed wrappers prefix the parameter names, checkpoints store the original network"""
+        network = getattr(self.network, "_orig_mod", self.network)
+        if isinstance(network, DistributedDataParallel):
+            network = network.module
+
+        return network
+
 
 class Trainer(AbstractExecutor):
     def __init__(self, config: Config):
+        if config.accumulate_steps > 1 and config.differential_privacy["enabled"]:
+            # per-sample gradients of the accumulated batches would be clipped together, and the privacy accounting
+            # expects one optimizer step per batch
+            raise ValueError(
+                "Gradient accumulation ('accumulate_steps' > 1) is not supported with differential privacy."
+            )
+
         super().__init__(config)
         self._loss_tracker = ExponentialAverageMeter(smoothing_factor=0.95)
 
@@ -79,6 +240,17 @@ class Trainer(AbstractExecutor):
             error_value=0,
         )
 
+        self._graphed_network = None
+        self._is_graph_captured = False
+
+        self._save_pool = ThreadPoolExecutor(max_workers=1)
+        self._pending_save = None
+
+        # trackers are only updated when logging, to avoid synchronizing with the device on every iteration
+        self._loss_buffer = []
+        self._ground_truth_buffer = []
+        self._logits_buffer = []
+
     def _setup(self, training_examples: int) -> None:
         self.criterion = SuperFactory.create(AbstractCriterion, self.config.criterion).to(self.config.get_device())
 
@@ -90,12 +262,25 @@ class Trainer(AbstractExecutor):
 
         self.scheduler = self._initialize_scheduler(optimizer=self.optimizer, training_examples=training_examples)
 
+        precision = self.config.mixed_precision
+        if precision is not None and self.config.differential_privacy["enabled"]:
+            # the privacy engine rebuilds the gradients from the (loss scaled) per-sample gradients after unscaling
+            logging.warning(
+                "[TRAINER] Mixed precision is not supported with differential privacy. Training in full precision."
+            )
+            precision = None
+
+        self._autocast_dtype = self._get_autocast_dtype(precision)
+        self.scaler = torch.cuda.amp.GradScaler(enabled=self._autocast_dtype == torch.float16)
+
         try:
             self._load_checkpoint(train=True)
         except CheckpointNotFound:
             pass
 
         self.network = self.network.train()
+        self._distribute_network()
+        self._compile_network(mode="default")
         logging.debug(self.network)
 
     def _initialize_scheduler(
@@ -107,7 +292,9 @@ class Trainer(AbstractExecutor):
             self.config.scheduler,
             {
                 "optimizer": optimizer,
-                "steps_per_epoch": math.ceil(training_examples / self.config.batch_size),
+                "steps_per_epoch": math.ceil(
+                    math.ceil(training_examples / self.config.batch_size) / self.config.accumulate_steps
+                ),
             },
         )
 
@@ -115,31 +302,44 @@ class Trainer(AbstractExecutor):
 
         self._setup(training_examples=data_loader.samples)
 
-        initial_payload = Namespace(trainer=self, data_loader=data_loader)
+        initial_payload = TrainingPayload(trainer=self, data_loader=data_loader)
         EventManager.dispatch_event(event_name="before_train_start", payload=initial_payload)
 
+        dispatch_before_criterion = EventManager.get_dispatcher("before_criterion")
+        dispatch_after_criterion = EventManager.get_dispatcher("after_criterion")
+
         for epoch in range(self._start_epoch + 1, self.config.epochs + 1):
+            data_loader.set_epoch(epoch)
 
+            self._zero_grad()
             for iteration, data in enumerate(data_loader.dataset, start=1):
-                self.optimizer.zero_grad()
-                outputs = self.network(data.inputs)
+                should_step = iteration % self.config.accumulate_steps == 0 or iteration == data_loader.batches
 
-                payload = Namespace(features=data, logits=outputs, extras=[])
-                EventManager.dispatch_event(event_name="before_criterion", payload=payload)
-                loss = self.criterion(payload.logits, payload.features.outputs, *payload.extras)
+                with self._get_sync_context(should_sync=should_step):
+                    with self._get_autocast_context():
+                        outputs = self._forward(data.inputs)
 
-                payload = Namespace(executor=self, loss=loss, features=data, logits=outputs)
-                EventManager.dispatch_event(event_name="after_criterion", payload=payload)
-                loss = payload.loss
+                        payload = BeforeCriterionPayload(features=data, logits=outputs, extras=[])
+                        dispatch_before_criterion(payload)
+                        loss = self.criterion(payload.logits, payload.features.outputs, *payload.extras)
 
-                loss.backward()
-                self.optimizer.step()
+                        payload = AfterCriterionPayload(executor=self, loss=loss, features=data, logits=outputs)
+                        dispatch_after_criterion(payload)
+                        loss = payload.loss
 
-                if self.config.is_stepwise_scheduler:
-                    self.scheduler.step()
+                    self.scaler.scale(loss / self.config.accumulate_steps).backward()
+
+                if should_step:
+                    self.scaler.step(self.optimizer)
+                    self.scaler.update()
+                    self._zero_grad()
+
+                    if self.config.is_stepwise_scheduler:
+                        self.scheduler.step()
 
-                self._update_trackers(loss.item(), data.outputs, outputs)
+                self._buffer_outputs(loss, data.outputs, outputs)
                 if iteration % self.config.log_frequency == 0:
+                    self._update_trackers()
                     self.log(epoch, iteration, data_loader.samples)
 
             if not self.config.is_stepwise_scheduler:
@@ -148,38 +348,126 @@ class Trainer(AbstractExecutor):
             self._reset_trackers()
             self.save(epoch)
 
+        self._wait_for_save()
+        if self.config.is_distributed():
+            # only the main process saves checkpoints, the others must not look for them before they are written
+            torch.distributed.barrier()
+
         EventManager.dispatch_event(event_name="after_train_end", payload=initial_payload)
 
-    def _update_trackers(self, loss: float, ground_truth: torch.Tensor, logits: torch.Tensor) -> None:
-        self._loss_tracker.update(loss)
+    def _zero_grad(self) -> None:
+        """Gradients are released instead of zero-filled. The privacy engine patches a zero_grad without options"""
+        if hasattr(self.optimizer, "privacy_engine"):
+            self.optimizer.zero_grad()
+        else:
+            self.optimizer.zero_grad(set_to_none=True)
+
+    def _get_sync_context(self, should_sync: bool):
+        """Accumulated micro-batches skip the gradient all-reduce, which then runs once per optimizer step"""
+        network = getattr(self.network, "_orig_mod", self.network)
+        if not should_sync and isinstance(network, DistributedDataParallel):
+            return network.no_sync()
+
+        return nullcontext()
+
+    def _forward(self, inputs: Dict[str, Any]) -> torch.Tensor:
+        if self.config.cuda_graphs and not self._is_graph_captured:
+            self._is_graph_captured = True
+            self._graphed_network = self._capture_network(inputs)
+
+        if self._graphed_network is not None and self._graphed_network.matches(inputs):
+            return self._graphed_network(inputs)
+
+        return self.network(inputs)
+
+    def _capture_network(self, sample_inputs: Dict[str, Any]) -> Optional[_GraphedNetwork]:
+        """
+        Only the network passes are captured. The criterion, the event handlers and the optimizer step run eagerly,
+        so learning rate schedules and handlers behave as usual.
+        """
+        if not torch.cuda.is_available() or not hasattr(torch.cuda, "make_graphed_callables"):
+            logging.warning("[TRAINER] CUDA graphs require a GPU and PyTorch 1.10 or newer. Running in eager mode.")
+            return None
+
+        if self.config.is_distributed():
+            logging.warning("[TRAINER] CUDA graphs are not supported for distributed training. Running in eager mode.")
+            return None
+
+        if not all(isinstance(value, torch.Tensor) and value.is_cuda for value in sample_inputs.values()):
+            logging.warning("[TRAINER] CUDA graphs require tensor inputs on the GPU. Running in eager mode.")
+            return None
+
+        try:
+            return _GraphedNetwork(self.network, sample_inputs)
+        except (RuntimeError, AssertionError, TypeError) as e:
+            logging.warning("[TRAINER] CUDA graph capture failed ({}). Running in eager mode.".format(e))
+            return None
+
+    def _buffer_outputs(self, loss: torch.Tensor, ground_truth: torch.Tensor, logits: torch.Tensor) -> None:
+        self._loss_buffer.append(loss.detach())
+
+        if self._metric_trackers:
+            self._ground_truth_buffer.append(ground_truth)
+            logits = logits.detach()
+            if self._graphed_network is not None:
+                logits = logits.clone()  # graphed outputs are static buffers, overwritten by the next iteration
+
+            self._logits_buffer.append(logits)
 
-        metrics = self._metric_computer.compute_metrics([ground_truth], [logits])
-        averages = self._metric_computer.compute_statistics(metrics, (np.mean,))
+    def _update_trackers(self) -> None:
+        if not self._loss_buffer:
+            return
 
-        for metric_name, tracker in self._metric_trackers.items():
-            tracker.update(getattr(averages, metric_name)[0])
+        for loss in torch.stack(self._loss_buffer).tolist():
+            self._loss_tracker.update(loss)
+
+        if self._metric_trackers:
+            metrics = vars(self._metric_computer.compute_metrics(self._ground_truth_buffer, self._logits_buffer))
+            for metric_name, tracker in self._metric_trackers.items():
+                tracker.update(float(np.mean(metrics[metric_name])))  # averaged over the targets
+
+        self._clear_buffers()
+
+    def _clear_buffers(self) -> None:
+        self._loss_buffer.clear()
+        self._ground_truth_buffer.clear()
+        self._logits_buffer.clear()
 
     def _reset_trackers(self) -> None:
+        self._clear_buffers()
         self._loss_tracker.reset()
 
         for tracker in self._metric_trackers.values():
             tracker.reset()
 
     def save(self, epoch: int) -> None:
+        if not self.config.is_main_process():
+            return
+
         info = {
             "epoch": epoch,
-            "model": self.network.state_dict(),
+            "model": self.get_uncompiled_network().state_dict(),
             "optimizer": self.optimizer.state_dict(),
             "scheduler": self.scheduler.state_dict(),
         }
 
+        if self.scaler.is_enabled():
+            info["scaler"] = self.scaler.state_dict()
+
         model_path = "{}checkpoint.{}".format(self.config.output_path, epoch)
         logging.info("Saving checkpoint: {}".format(model_path))
 
-        payload = Namespace(info=info)
+        payload = CheckpointSavePayload(info=info)
         EventManager.dispatch_event(event_name="before_checkpoint_save", payload=payload)
 
-        torch.save(info, model_path)
+        # written in the background from a CPU copy, while the next epoch starts. One write at a time.
+        self._wait_for_save()
+        self._pending_save = self._save_pool.submit(torch.save, _copy_to_cpu(info), model_path)
+
+    def _wait_for_save(self) -> None:
+        if self._pending_save is not None:
+            self._pending_save.result()
+            self._pending_save = None
 
     def log(self, epoch: int, iteration: int, dataset_size: int) -> None:
         processed_samples = iteration * self.config.batch_size
@@ -195,7 +483,7 @@ class Trainer(AbstractExecutor):
         for name, tracker in self._metric_trackers.items():
             message += " - {}: {:.4f}".format(name, tracker.get())
 
-        payload = Namespace(
+        payload = ProgressLogPayload(
             message=message,
             epoch=epoch,
             iteration=iteration,
@@ -213,21 +501,38 @@ class Predictor(AbstractExecutor):
 
         self._load_checkpoint()
         self.network = self.network.eval()
+        # not "reduce-overhead": its CUDA graph outputs are overwritten by the next call, run_all keeps every batch
+        self._compile_network(mode="default")
+        self._autocast_dtype = self._get_autocast_dtype(self.config.inference_precision)
+
         self.probe = None
+        if self.config.probe_layer is not None:
+            self.set_hook_probe()
 
     def set_hook_probe(self):
-        if isinstance(self.network, EnsembleNetwork):
+        network = self.get_uncompiled_network()
+        if isinstance(network, EnsembleNetwork):
             raise ValueError("Probing hidden layers is not defined for Ensembles."
                 " Please change 'probe_layer' parameter to 'null' or use a different type of network.")
         else:
-            self.probe = HookProbe(self.network, self.config.probe_layer)
+            if self.probe is not None:
+                self.probe.remove()
+
+            self.probe = HookProbe(network, self.config.probe_layer)
+
+    def load(self, checkpoint_path: str) -> "Predictor":
+        """Swap in the weights of another checkpoint. The (compiled) network and its probe are reused"""
+        self.config.checkpoint_path = checkpoint_path
+        self._load_checkpoint()
 
+        return self
 
-    def run(self, batch: Batch) -> torch.Tensor:
-        with torch.no_grad():
-            if self.config.probe_layer is not None:
-                self.set_hook_probe()
+    def __del__(self):
+        if getattr(self, "probe", None) is not None:
+            self.probe.remove()
 
+    def run(self, batch: Batch) -> PredictionPayload:
+        with _inference_context(), self._get_autocast_context():
             if self.config.inference_mode == "mc_dropout":
                 outputs = self.network.mc_dropout(
                     batch.inputs,
@@ -240,10 +545,17 @@ class Predictor(AbstractExecutor):
             if isinstance(outputs, torch.Tensor):
                 outputs = {"logits": outputs}
 
+            if self._autocast_dtype is not None:
+                # metrics and thresholds are computed in full precision
+                outputs = {
+                    key: value.float() if isinstance(value, torch.Tensor) and value.is_floating_point() else value
+                    for key, value in outputs.items()
+                }
+
             if self.probe is not None:
                 outputs["hidden_layer"] = self.probe.get_probe()
 
-            payload = Namespace(features=batch, **outputs)
+            payload = PredictionPayload(features=batch, **outputs)
             EventManager.dispatch_event("after_predict", payload=payload)
 
             return payload
@@ -275,15 +587,23 @@ class Pipeliner(AbstractExecutor):
     def __init__(self, config: Config):
         self.config = config
 
-        self._trainer = Trainer(self.config)
+        self._trainer = None  # created on demand, evaluation only pipeliners don't need a network and optimizer for it
         self._processor = PredictionProcessor(metrics=self.config.test_metrics, threshold=self.config.threshold)
         self._predictor = None
+        self._checkpoint_paths = None
 
     def initialize_predictor(self) -> "Pipeliner":
-        self._predictor = Predictor(config=self.config)
+        if self._predictor is None:
+            self._predictor = Predictor(config=self.config)
+        else:
+            self._predictor.load(self.config.checkpoint_path)
+
         return self
 
     def train(self, data_loader: LoadedContent) -> None:
+        if self._trainer is None:
+            self._trainer = Trainer(self.config)
+
         self._trainer.run(data_loader=data_loader)
 
     def evaluate(self, data_loader: LoadedContent) -> Namespace:
@@ -295,20 +615,33 @@ class Pipeliner(AbstractExecutor):
 
     def evaluate_all(self, data_loader: LoadedContent) -> List[Namespace]:
         results = []
+        predictor = None
 
+        self._checkpoint_paths = None  # new checkpoints may have been saved since the last listing
         for checkpoint_path in self.find_all_checkpoints():
-            config = copy(self.config)
-            config.checkpoint_path = checkpoint_path
+            if predictor is None:
+                config = copy(self.config)
+                config.checkpoint_path = checkpoint_path
+                predictor = Predictor(config=config)
+            else:
+                predictor.load(checkpoint_path)
 
-            evaluator = Evaluator(config=config)
-            results.append(evaluator.run(data_loader=data_loader))
+            ground_truth, logits = predictor.run_all(data_loader=data_loader)
+            results.append(self._processor.compute_metrics(ground_truth=ground_truth, logits=logits))
 
         return results
 
     def find_all_checkpoints(self) -> List[str]:
-        checkpoint_paths = glob(self.config.output_path + "*")
-        checkpoint_paths = sorted(checkpoint_paths)
-        return sorted(checkpoint_paths, key=len)[:self.config.epochs]
+        if self._checkpoint_paths is None:
+            directory, prefix = os.path.split(self.config.output_path)
+            checkpoint_paths = [
+                os.path.join(directory, entry.name) for entry in os.scandir(directory or ".")
+                if entry.name.startswith(prefix) and not entry.name.startswith(".")
+            ]
+
+            self._checkpoint_paths = sorted(checkpoint_paths, key=lambda path: (len(path), path))[:self.config.epochs]
+
+        return self._checkpoint_paths
 
     def find_best_checkpoint(self, data_loader: LoadedContent) -> "Pipeliner":
         results = self.evaluate_all(data_loader=data_loader)
@@ -357,20 +690,21 @@ class LearningRareFinder(Trainer):
 
         self._setup(training_examples=data_loader.samples)
 
-        payload = Namespace(trainer=self, data_loader=data_loader)
+        payload = TrainingPayload(trainer=self, data_loader=data_loader)
         EventManager.dispatch_event(event_name="before_train_start", payload=payload)
 
         learning_rate_records = []
         loss_records = []
+        dispatch_before_criterion = EventManager.get_dispatcher("before_criterion")
 
         try:
             with tqdm(total=data_loader.batches) as progress_bar:
                 for iteration, data in enumerate(data_loader.dataset, start=1):
-                    self.optimizer.zero_grad()
+                    self._zero_grad()
                     outputs = self.network(data.inputs)
 
-                    payload = Namespace(features=data, logits=outputs, extras=[])
-                    EventManager.dispatch_event(event_name="before_criterion", payload=payload)
+                    payload = BeforeCriterionPayload(features=data, logits=outputs, extras=[])
+                    dispatch_before_criterion(payload)
 
                     loss = self.criterion(payload.logits, payload.features.outputs, *payload.extras)
                     loss.backward()
@@ -3,6 +3,7 @@ from typing import Optional, Dict
 import torch
 import torch_geometric
 from torch.nn.functional import leaky_relu
+from torch.utils.checkpoint import checkpoint_sequential
 from torch_scatter import scatter_mean, scatter_std, scatter
 
 from federated_learning.lib.core.helpers import SuperFactory
@@ -117,6 +118,53 @@ class GraphConvolutionWrapper(torch.nn.Module):
         return x
 
 
+class BitUnpacker(torch.nn.Module):
+    """Expands bit-packed "uint8" features (as produced by "numpy.packbits") to floats"""
+
+    def __init__(self, features: int):
+        super().__init__()
+
+        self._features = features
+        self.register_buffer("_masks", torch.tensor([128, 64, 32, 16, 8, 4, 2, 1], dtype=torch.uint8), persistent=False)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        bits = (x.unsqueeze(-1) & self._masks) != 0
+        return bits.flatten(start_dim=-2)[..., :self._features].float()
+
+
+class OneHotExpander(torch.nn.Module):
+    """Expands token indices (-1 for padding) to one-hot encoded features, shaped as (batch, classes, length)"""
+
+    def __init__(self, classes: int):
+        super().__init__()
+        self._classes = classes
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        features = torch.nn.functional.one_hot(x.long() + 1, self._classes + 1)[..., 1:]
+        return features.transpose(-1, -2).float()
+
+
+class CheckpointedSequential(torch.nn.Sequential):
+    """
+    Only stores the activations at the boundaries of the segments during training, and recomputes the others in the
+    backward pass. Parameter names are the same as the ones of a regular "Sequential", so checkpoints are compatible.
+    """
+
+    def __init__(self, *modules: torch.nn.Module, segments: int = 2):
+        super().__init__(*modules)
+        self.segments = segments
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if not self.training or not torch.is_grad_enabled():
+            return super().forward(x)
+
+        if x.is_floating_point() and not x.requires_grad:
+            # segments are only backpropagated through when their inputs require gradients
+            x = x.detach().requires_grad_()
+
+        return checkpoint_sequential(self, self.segments, x)
+
+
 class LinearBlock(torch.nn.Module):
     def __init__(
         self,
@@ -198,14 +198,17 @@ class PredictionProcessor:
     def detach(cls, tensor: torch.Tensor) -> List[List[float]]:
         return tensor.cpu().detach().tolist()
 
+    @classmethod
+    def to_array(cls, tensor: torch.Tensor) -> np.ndarray:
+        """Same values as ``detach`` (in double precision), without building Python lists"""
+        return tensor.detach().cpu().numpy().astype(np.float64)
+
     @classmethod
     def apply_threshold(cls, logits: torch.Tensor, threshold: float) -> np.ndarray:
         if threshold is None:
-            return np.array(cls.detach(logits))
-
-        predictions = torch.sigmoid(logits)
-        predictions = cls.detach(predictions)
+            return cls.to_array(logits)
 
+        predictions = cls.to_array(torch.sigmoid(logits))
         return np.where(np.less(predictions, threshold), 0, 1)
 
     @classmethod
@@ -322,6 +325,6 @@ class CsvLogger(AbstractMetricLogger):
         logging.info("--------------------------------------------------------------")
 
     def log_content(self, content: Namespace) -> None:
-        for name, values in vars(content).items():
-            values = [str(value) for value in values]
-            print("{},{}".format(name, ",".join(values)))
+        print("\n".join(
+            "{},{}".format(name, ",".join(str(value) for value in values)) for name, values in vars(content).items()
+        ))
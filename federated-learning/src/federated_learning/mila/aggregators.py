@@ -1,14 +1,68 @@
+import inspect
 from collections import OrderedDict
-from typing import List, Dict, Type, Any
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Type, Any, Sequence
 
 import torch
 
 from federated_learning.mila.factories import AbstractAggregator, AbstractConfiguration, AbstractExecutor
 import importlib
-from copy import deepcopy
+from copy import copy
 import numpy as np
 
 
+# clients only send model weights, which recent versions of PyTorch can load without unpickling arbitrary objects
+# (1.13+), and memory-map (2.1+)
+_LOAD_OPTIONS = {
+    option: True for option in ("weights_only", "mmap") if option in inspect.signature(torch.load).parameters
+}
+
+
+def _load_model(checkpoint_path: str) -> OrderedDict:
+    return torch.load(checkpoint_path, map_location=torch.device("cpu"), **_LOAD_OPTIONS)["model"]
+
+
+def _weighted_sum(checkpoint_paths: List[str], weights: Sequence[float]) -> OrderedDict:
+    """
+    Checkpoints are streamed, the next one is loaded in the background while the current one is accumulated.
+    Parameters are accumulated in float32 (float64 for double and integer tensors) and cast back to their type,
+    integer buffers are rounded.
+    """
+    totals = OrderedDict()
+    dtypes = {}
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        upcoming_model = executor.submit(_load_model, checkpoint_paths[0])
+
+        for index, weight in enumerate(weights):
+            model = upcoming_model.result()
+            if index + 1 < len(checkpoint_paths):
+                upcoming_model = executor.submit(_load_model, checkpoint_paths[index + 1])
+
+            _accumulate(totals, dtypes, model, weight)
+            del model
+
+    output = OrderedDict()
+    for key, total in totals.items():
+        output[key] = total.to(dtypes[key]) if dtypes[key].is_floating_point else total.round().to(dtypes[key])
+
+    return output
+
+
+def _accumulate(totals: OrderedDict, dtypes: Dict[str, torch.dtype], model: OrderedDict, weight: float) -> None:
+    for key, value in model.items():
+        if value.is_quantized:
+            value = value.dequantize()
+
+        if key not in totals:
+            is_single_precision = value.is_floating_point() and value.dtype != torch.float64
+            dtypes[key] = value.dtype
+            totals[key] = torch.zeros_like(value, dtype=torch.float32 if is_single_precision else torch.float64)
+
+        totals[key].add_(value.to(totals[key].dtype), alpha=float(weight))
+
+
 class PlainTorchAggregator(AbstractAggregator):
     """Normal aggregator for Federated learning.
 
@@ -22,25 +76,8 @@ class PlainTorchAggregator(AbstractAggregator):
     agg.run()
     """
     def run(self, checkpoint_paths: List[str], save_path: str) -> None:
-        output = None
-
-        for checkpoint_path in checkpoint_paths:
-            state = torch.load(checkpoint_path, map_location=torch.device("cpu"))
-            model: OrderedDict = state["model"]
-
-            if output is None:
-                output = model
-                continue
-
-            for key, value in model.items():
-                output[key] += value
-
         checkpoints_count = len(checkpoint_paths)
-        for key, value in output.items():
-            if value.is_floating_point():
-                output[key] = torch.div(value, checkpoints_count)
-            else:
-                output[key] = torch.floor_divide(value, checkpoints_count)
+        output = _weighted_sum(checkpoint_paths, [1 / checkpoints_count] * checkpoints_count)
 
         output = {"model": output}
         torch.save(output, save_path)
@@ -62,20 +99,12 @@ class WeightedTorchAggregator(AbstractAggregator):
         self._weights = weights
 
     def run(self, checkpoint_paths: List[str], save_path: str) -> None:
-        output = OrderedDict()
-
+        weights = []
         for checkpoint_path in checkpoint_paths:
             owner = checkpoint_path.split("/")[-1].split(".")[0]
-            weight = self._weights[owner]
+            weights.append(self._weights[owner])
 
-            state = torch.load(checkpoint_path, map_location=torch.device("cpu"))
-            model: OrderedDict = state["model"]
-
-            for key, value in model.items():
-                if key not in output:
-                    output[key] = value * weight
-                else:
-                    output[key] += value * weight
+        output = _weighted_sum(checkpoint_paths, weights)
 
         output = {"model": output}
         torch.save(output, save_path)
@@ -135,20 +164,22 @@ class BenchmarkedTorchAggregator(AbstractAggregator):
         self._target_metric = target_metric
         self._minimized_metric = minimized_metric
 
-    def _reflect(self, dependency: str) -> Type[Any]:
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _reflect(dependency: str) -> Type[Any]:
         module, class_name = dependency.rsplit(".", 1)
         try:
-            return getattr(importlib.import_module(module), class_name)
-        except:
-            module = "federated_learning." + module
-            return getattr(importlib.import_module(module), class_name)
+            module = importlib.import_module(module)
+        except ImportError:
+            module = importlib.import_module("federated_learning." + module)
 
-    def run(self, checkpoint_paths: List[str], save_path: str) -> None:
-        output = OrderedDict()
+        return getattr(module, class_name)
 
+    def run(self, checkpoint_paths: List[str], save_path: str) -> None:
         weights = []
         for checkpoint_path in checkpoint_paths:
-            config = deepcopy(self._config)
+            # nested options are only read by the executor, a shallow copy is enough
+            config = copy(self._config)
             config.checkpoint_path = checkpoint_path
 
             executor = self._executor_instantiator(config=config)
@@ -160,15 +191,7 @@ class BenchmarkedTorchAggregator(AbstractAggregator):
         if self._minimized_metric:
             weights = 1 - weights
 
-        for client_id, checkpoint_path in enumerate(checkpoint_paths):
-            state = torch.load(checkpoint_path, map_location=torch.device("cpu"))
-            model: OrderedDict = state["model"]
-
-            for key, value in model.items():
-                if key not in output:
-                    output[key] = value * weights[client_id]
-                else:
-                    output[key] += value * weights[client_id]
+        output = _weighted_sum(checkpoint_paths, weights.tolist())
 
         output = {"model": output}
         torch.save(output, save_path)
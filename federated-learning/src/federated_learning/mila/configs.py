@@ -35,6 +35,8 @@ class ServerConfiguration(NamedTuple):
         ("grpc.ssl_target_name_override", "localhost"),
     ]
 
+    compression: Optional[Literal["gzip", "deflate"]] = None
+
     blacklist: List[str] = []
     whitelist: List[str] = []
     use_whitelist: bool = False
@@ -56,6 +58,8 @@ class ClientConfiguration(NamedTuple):
     seed: int = 42
     heartbeat_frequency: int = 60
     retry_timeout: int = 1
+    quantize_checkpoint: bool = False
+    scratch_path: Optional[str] = None
     model_overwrites: Dict[str, Any] = {"output_path": "data/logs/local/", "epochs": 5}
 
     options: List[Tuple[str, Any]] = [
@@ -64,6 +68,8 @@ class ClientConfiguration(NamedTuple):
         ("grpc.ssl_target_name_override", "localhost"),
     ]
 
+    compression: Optional[Literal["gzip", "deflate"]] = None
+
     use_secure_connection: bool = False
     ssl_private_key: str = "data/certificates/client.key"
     ssl_cert: str = "data/certificates/client.crt"
@@ -83,6 +89,7 @@ class CVConfiguration(AbstractConfiguration):
     cfg_dir: str = ''
     log_level: Literal['CRITICAL', 'FATAL', 'ERROR', 'WARN', 'WARNING', 'INFO', 'DEBUG', 'NOTSET'] = "INFO"
     save_results: bool = False
+    parallel_folds: int = 1
 
     def __post_init__(self):
         if self.cfg_dir != '':
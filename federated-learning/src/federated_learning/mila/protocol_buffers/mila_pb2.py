@@ -23,7 +23,7 @@ DESCRIPTOR = _descriptor.FileDescriptor(
     syntax="proto3",
     serialized_options=None,
     serialized_pb=_b(
-        '\n\nmila.proto\x12\x04mila\x1a\x1bgoogle/protobuf/empty.proto"\x16\n\x06\x43lient\x12\x0c\n\x04name\x18\x01 \x01(\t"\x16\n\x05Token\x12\r\n\x05token\x18\x01 \x01(\t",\n\nCheckpoint\x12\r\n\x05token\x18\x01 \x01(\t\x12\x0f\n\x07\x63ontent\x18\x02 \x01(\x0c">\n\x05Model\x12\x1a\n\x12json_configuration\x18\x01 \x01(\x0c\x12\x19\n\x11latest_checkpoint\x18\x02 \x01(\x0c\x32\x81\x02\n\x04Mila\x12+\n\x0c\x41uthenticate\x12\x0c.mila.Client\x1a\x0b.mila.Token"\x00\x12\x32\n\tHeartbeat\x12\x0b.mila.Token\x1a\x16.google.protobuf.Empty"\x00\x12.\n\x05\x43lose\x12\x0b.mila.Token\x1a\x16.google.protobuf.Empty"\x00\x12*\n\x0cRequestModel\x12\x0b.mila.Token\x1a\x0b.mila.Model"\x00\x12<\n\x0eSendCheckpoint\x12\x10.mila.Checkpoint\x1a\x16.google.protobuf.Empty"\x00\x62\x06proto3'
+        '\n\nmila.proto\x12\x04mila\x1a\x1bgoogle/protobuf/empty.proto"\x16\n\x06Client\x12\x0c\n\x04name\x18\x01 \x01(\t"\x16\n\x05Token\x12\r\n\x05token\x18\x01 \x01(\t",\n\nCheckpoint\x12\r\n\x05token\x18\x01 \x01(\t\x12\x0f\n\x07content\x18\x02 \x01(\x0c">\n\x05Model\x12\x1a\n\x12json_configuration\x18\x01 \x01(\x0c\x12\x19\n\x11latest_checkpoint\x18\x02 \x01(\x0c2\x85\x02\n\x04Mila\x12+\n\x0cAuthenticate\x12\x0c.mila.Client\x1a\x0b.mila.Token"\x00\x122\n\tHeartbeat\x12\x0b.mila.Token\x1a\x16.google.protobuf.Empty"\x00\x12.\n\x05Close\x12\x0b.mila.Token\x1a\x16.google.protobuf.Empty"\x00\x12,\n\x0cRequestModel\x12\x0b.mila.Token\x1a\x0b.mila.Model"\x000\x01\x12>\n\x0eSendCheckpoint\x12\x10.mila.Checkpoint\x1a\x16.google.protobuf.Empty"\x00(\x01b\x06proto3'
     ),
     dependencies=[
         google_dot_protobuf_dot_empty__pb2.DESCRIPTOR,
@@ -280,7 +280,7 @@ _MILA = _descriptor.ServiceDescriptor(
     index=0,
     serialized_options=None,
     serialized_start=208,
-    serialized_end=465,
+    serialized_end=469,
     methods=[
         _descriptor.MethodDescriptor(
             name="Authenticate",
@@ -29,12 +29,12 @@ class MilaStub(object):
             request_serializer=mila__pb2.Token.SerializeToString,
             response_deserializer=google_dot_protobuf_dot_empty__pb2.Empty.FromString,
         )
-        self.RequestModel = channel.unary_unary(
+        self.RequestModel = channel.unary_stream(
             "/mila.Mila/RequestModel",
             request_serializer=mila__pb2.Token.SerializeToString,
             response_deserializer=mila__pb2.Model.FromString,
         )
-        self.SendCheckpoint = channel.unary_unary(
+        self.SendCheckpoint = channel.stream_unary(
             "/mila.Mila/SendCheckpoint",
             request_serializer=mila__pb2.Checkpoint.SerializeToString,
             response_deserializer=google_dot_protobuf_dot_empty__pb2.Empty.FromString,
@@ -68,7 +68,7 @@ class MilaServicer(object):
         context.set_details("Method not implemented!")
         raise NotImplementedError("Method not implemented!")
 
-    def SendCheckpoint(self, request, context):
+    def SendCheckpoint(self, request_iterator, context):
         pass
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details("Method not implemented!")
@@ -92,12 +92,12 @@ def add_MilaServicer_to_server(servicer, server):
             request_deserializer=mila__pb2.Token.FromString,
             response_serializer=google_dot_protobuf_dot_empty__pb2.Empty.SerializeToString,
         ),
-        "RequestModel": grpc.unary_unary_rpc_method_handler(
+        "RequestModel": grpc.unary_stream_rpc_method_handler(
             servicer.RequestModel,
             request_deserializer=mila__pb2.Token.FromString,
             response_serializer=mila__pb2.Model.SerializeToString,
         ),
-        "SendCheckpoint": grpc.unary_unary_rpc_method_handler(
+        "SendCheckpoint": grpc.stream_unary_rpc_method_handler(
             servicer.SendCheckpoint,
             request_deserializer=mila__pb2.Checkpoint.FromString,
             response_serializer=google_dot_protobuf_dot_empty__pb2.Empty.SerializeToString,
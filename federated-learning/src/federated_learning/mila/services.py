@@ -1,19 +1,24 @@
+import hashlib
 import importlib
+import io
+import itertools
 import json
 import logging
 import os
 from pathlib import Path
 import re
 import shutil
+import tempfile
 import uuid
 from concurrent import futures
+from copy import deepcopy
+from queue import Queue
 from dataclasses import dataclass, field
-from glob import glob
-from threading import Thread, Lock
+from threading import Condition, Event, Thread, Lock
 from time import time, sleep
-from typing import Dict, Callable, Any, List, Type, Optional
+from typing import Dict, Callable, Any, List, Type, Optional, Iterable, Iterator, Tuple, NamedTuple
 from multiprocessing import get_context
-from functools import partial
+from functools import partial, lru_cache
 
 import grpc
 from google.protobuf.empty_pb2 import Empty as EmptyResponse
@@ -34,19 +39,64 @@ from federated_learning.mila.factories import AbstractConfiguration, AbstractExe
 from federated_learning.mila.protocol_buffers import mila_pb2, mila_pb2_grpc
 
 
+@lru_cache(maxsize=None)
+def _reflect(object_path: str) -> Callable:
+    module, class_name = object_path.rsplit(".", 1)
+    try:
+        return getattr(importlib.import_module(module), class_name)
+    except:
+        module = "federated_learning." + module
+        return getattr(importlib.import_module(module), class_name)
+
+
 class IOManager:
 
+    CHUNK_SIZE = 1 << 22  # checkpoints are streamed over gRPC in 4MB messages
+
     def _read_file(self, file_path: str) -> bytes:
         with open(file_path, "rb") as read_buffer:
             return read_buffer.read()
 
-    def _reflect(self, object_path: str) -> Callable:
-        module, class_name = object_path.rsplit(".", 1)
+    def _advise(self, file_descriptor: int, advice: str) -> None:
+        if hasattr(os, "posix_fadvise"):  # not available on Windows and macOS
+            os.posix_fadvise(file_descriptor, 0, 0, getattr(os, advice))
+
+    def _read_chunks(self, file_path: str) -> Iterator[bytes]:
+        with open(file_path, "rb", buffering=0) as read_buffer:
+            self._advise(read_buffer.fileno(), "POSIX_FADV_SEQUENTIAL")
+            yield from iter(partial(read_buffer.read, self.CHUNK_SIZE), b"")
+
+    def _split_chunks(self, content: bytes) -> Iterator[bytes]:
+        view = memoryview(content)
+        for offset in range(0, len(view), self.CHUNK_SIZE):
+            yield view[offset:offset + self.CHUNK_SIZE].tobytes()
+
+    def _write_chunks(self, file_path: str, chunks: Iterable[bytes]) -> None:
+        """
+        Checkpoints are written once and read back by a single consumer, so they are synced
+        and dropped from the page cache instead of evicting more useful pages.
+        """
+        file_descriptor = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
         try:
-            return getattr(importlib.import_module(module), class_name)
-        except:
-            module = "federated_learning." + module
-            return getattr(importlib.import_module(module), class_name)
+            for chunk in chunks:
+                view = memoryview(chunk)
+                while view:
+                    view = view[os.write(file_descriptor, view):]
+
+            if hasattr(os, "posix_fadvise"):
+                os.fdatasync(file_descriptor)
+                self._advise(file_descriptor, "POSIX_FADV_DONTNEED")
+        finally:
+            os.close(file_descriptor)
+
+    def _reflect(self, object_path: str) -> Callable:
+        return _reflect(object_path)
+
+    def _get_compression(self) -> grpc.Compression:
+        if self._config.compression is None:
+            return grpc.Compression.NoCompression
+
+        return getattr(grpc.Compression, self._config.compression.capitalize())
 
 
 @dataclass
@@ -59,6 +109,10 @@ class Participant:
     awaiting_response: bool = False
 
     __last_heartbeat: float = field(default_factory=time)
+    file_safe_ip: str = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.file_safe_ip = self.ip_address.replace(".", "_")
 
     def register_heartbeat(self) -> None:
         self.__last_heartbeat = time()
@@ -66,8 +120,9 @@ class Participant:
     def is_alive(self, heartbeat_timeout: float) -> bool:
         return time() - self.__last_heartbeat < heartbeat_timeout
 
-    def __eq__(self, other: "Participant") -> bool:
-        return self.name == other.name and self.ip_address == other.ip_address
+    @property
+    def identity(self) -> Tuple[str, str]:
+        return self.name, self.ip_address
 
     def __str__(self) -> str:
         return "{}|{}".format(self.name, self.ip_address)
@@ -77,15 +132,31 @@ class ServerManager(IOManager):
 
     def __init__(self, config: ServerConfiguration) -> None:
         self._config = config
+        self._cache_lock = Lock()
+        self._blobs_path = "{}/.blobs".format(self._config.save_path)
+
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Start a new federated learning session from scratch (used to reuse the same server across folds).
+        """
         self._registry: Dict[str, Participant] = {}
+        self._tokens: Dict[Tuple[str, str], str] = {}  # participant identity -> token
+        self._updates_count = 0  # clients whose update for the current round was received
+        self._filenames: Dict[str, str] = {}  # token -> checkpoint path for the current round
 
         self._current_round = 1
         self._latest_checkpoint = self._config.start_point
         self._last_registration_time = 0
         self._is_registration_closed = False
 
-        if not os.path.exists(self._config.save_path):
-            os.makedirs(self._config.save_path)
+        # every client receives the same files in a round, they are only read from disk once
+        with self._cache_lock:
+            self._configuration_cache: Optional[bytes] = None
+            self._checkpoint_cache: Optional[Tuple[str, bytes]] = None
+
+        os.makedirs(self._blobs_path, exist_ok=True)
 
     def verify_ip(self, ip_address: str) -> bool:
         if ip_address in self._config.blacklist:
@@ -97,15 +168,16 @@ class ServerManager(IOManager):
         return True
 
     def register_client(self, name: str, ip_address: str) -> str:
+        if (name, ip_address) in self._tokens:
+            return self._tokens[(name, ip_address)]
+
         client = Participant(name=name, ip_address=ip_address)
-        for entry in self._registry.values():
-            if client == entry:
-                return entry.token
 
         if not self.should_wait_for_additional_clients():
             raise ClientAuthenticationError("Authentication failed... Registration is closed.")
 
         self._registry[client.token] = client
+        self._tokens[client.identity] = client.token
         self._last_registration_time = time()
 
         logging.info("[{}] Successfully authenticated (clients={})".format(client, self.get_clients_count()))
@@ -126,27 +198,65 @@ class ServerManager(IOManager):
 
     def close_connection(self, token: str) -> None:
         client = self._registry[token]
+        if self._is_update_received(client):
+            self._updates_count -= 1
 
         self._registry.pop(token)
+        self._tokens.pop(client.identity)
         logging.info("[{}] Disconnected (clients={})".format(client, self.get_clients_count()))
 
-    def save_checkpoint(self, token: str, content: bytes) -> None:
+    def save_checkpoint(self, token: str, chunks: Iterable[bytes]) -> None:
         client = self._registry[token]
         save_path = self.get_client_filename_for_current_round(client)
 
-        with open(save_path, "wb") as write_buffer:
-            write_buffer.write(content)
+        # uploads are stored once per content hash, identical checkpoints are hard links to the same blob
+        digest = hashlib.sha256()
+        temporary_path = "{}/{}.partial".format(self._blobs_path, uuid.uuid4())
+        self._write_chunks(temporary_path, self._hash_chunks(chunks, digest))
 
+        blob_path = "{}/{}".format(self._blobs_path, digest.hexdigest())
+        if os.path.exists(blob_path):
+            os.remove(temporary_path)
+            logging.debug("[{}] Checkpoint is a duplicate of [{}]".format(client, blob_path))
+        else:
+            os.replace(temporary_path, blob_path)
+
+        self._link(blob_path, save_path)
         logging.info("[{}] Checkpoint Received".format(client))
 
+    def _hash_chunks(self, chunks: Iterable[bytes], digest: "hashlib._Hash") -> Iterator[bytes]:
+        for chunk in chunks:
+            digest.update(chunk)
+            yield chunk
+
+    def _link(self, source_path: str, destination_path: str) -> None:
+        if os.path.exists(destination_path):
+            os.remove(destination_path)
+
+        try:
+            os.link(source_path, destination_path)
+        except OSError:  # hard links are not supported everywhere
+            shutil.copyfile(source_path, destination_path)
+
     def get_configuration(self) -> bytes:
-        return self._read_file(self._config.task_configuration_file)
+        with self._cache_lock:
+            if self._configuration_cache is None:
+                self._configuration_cache = self._read_file(self._config.task_configuration_file)
+
+            return self._configuration_cache
 
-    def get_latest_checkpoint(self) -> bytes:
+    def get_latest_checkpoint(self) -> Iterator[bytes]:
         if self._latest_checkpoint is None:
-            return b""
+            return iter(())
+
+        return self._split_chunks(self._load_checkpoint(self._latest_checkpoint))
 
-        return self._read_file(self._latest_checkpoint)
+    def _load_checkpoint(self, checkpoint_path: str) -> bytes:
+        with self._cache_lock:
+            if self._checkpoint_cache is None or self._checkpoint_cache[0] != checkpoint_path:
+                self._checkpoint_cache = (checkpoint_path, b"".join(self._read_chunks(checkpoint_path)))
+
+            return self._checkpoint_cache[1]
 
     def close_registration(self) -> None:
         self._is_registration_closed = True
@@ -178,14 +288,17 @@ class ServerManager(IOManager):
         return True
 
     def set_client_status_to_available(self, token: str) -> None:
-        self._registry[token].awaiting_response = False
+        client = self._registry[token]
+        if client.awaiting_response and client.round == self._current_round:
+            self._updates_count += 1
 
-    def are_all_updates_received(self) -> bool:
-        for client in self._registry.values():
-            if client.awaiting_response or client.round != self._current_round:
-                return False
+        client.awaiting_response = False
 
-        return True
+    def _is_update_received(self, client: Participant) -> bool:
+        return not client.awaiting_response and client.round == self._current_round
+
+    def are_all_updates_received(self) -> bool:
+        return self._updates_count == len(self._registry)
 
     def aggregate(self) -> None:
         logging.info("Start aggregation (round={})".format(self._current_round))
@@ -197,10 +310,13 @@ class ServerManager(IOManager):
         aggregator(**self._config.aggregator_options).run(checkpoint_paths=checkpoint_paths, save_path=save_path)
 
         logging.info("Aggregate model saved: [{}]".format(save_path))
+        self._load_checkpoint(save_path)
         self._latest_checkpoint = save_path
 
     def enable_next_round(self) -> None:
         self._current_round += 1
+        self._updates_count = 0
+        self._filenames = {}
         if self._current_round <= self._config.rounds_count:
             logging.info("Starting round [{}]".format(self._current_round))
 
@@ -214,19 +330,34 @@ class ServerManager(IOManager):
         ]
 
     def get_client_filename_for_current_round(self, client: Participant):
-        return "{}/{}.{}.{}.remote".format(
-            self._config.save_path,
-            client.name,
-            client.ip_address.replace(".", "_"),
-            self._current_round
-        )
+        if client.token not in self._filenames:
+            self._filenames[client.token] = "{}/{}.{}.{}.remote".format(
+                self._config.save_path,
+                client.name,
+                client.file_safe_ip,
+                self._current_round
+            )
+
+        return self._filenames[client.token]
 
 
 class DefaultServicer(ServerManager, mila_pb2_grpc.MilaServicer):
 
+    ROUND_WAIT_TIMEOUT = 60  # seconds a model request is held while the next round is prepared
+
     def __init__(self, config: ServerConfiguration) -> None:
-        super().__init__(config=config)
         self.__lock = Lock()
+        self.__round_started = Condition(self.__lock)
+        super().__init__(config=config)
+
+        # aggregation runs in the background, so the last client of a round is acknowledged right away
+        self._aggregation_pool = futures.ThreadPoolExecutor(max_workers=1)
+
+    def reset(self) -> None:
+        with self.__lock:
+            super().reset()
+            self._is_aggregating = False
+            self._aggregation_error: Optional[str] = None
 
     def _validate_token(self, token: str, context) -> bool:
         if not self.verify_token(token=token, ip_address=self._get_ip(context)):
@@ -262,41 +393,80 @@ class DefaultServicer(ServerManager, mila_pb2_grpc.MilaServicer):
             context.set_code(grpc.StatusCode.OK)
             return EmptyResponse()
 
-    def RequestModel(self, request, context) -> mila_pb2.Model:
+    def RequestModel(self, request, context) -> Iterator[mila_pb2.Model]:
         if self._validate_token(request.token, context):
 
             if self.should_wait_for_additional_clients():
                 context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Waiting for more clients to join.")
 
             self.close_registration()
+
+            # clients asking for the next model early are answered as soon as it is ready, instead of polling
+            with self.__lock:
+                client = self._registry[request.token]
+                self.__round_started.wait_for(
+                    lambda: client.round < self._current_round or self._aggregation_error is not None,
+                    timeout=self.ROUND_WAIT_TIMEOUT,
+                )
+                aggregation_error = self._aggregation_error
+
+            if aggregation_error is not None:
+                context.abort(grpc.StatusCode.INTERNAL, "Aggregation failed: {}".format(aggregation_error))
+
             if not self.are_more_rounds_required():
                 context.abort(grpc.StatusCode.PERMISSION_DENIED, "All rounds have been completed. Closing session.")
 
             if not self.set_client_status_to_awaiting_response(request.token):
                 context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Next round is not available yet.")
 
-            client = self._registry[request.token]
             logging.info("[{}] Sending Model (round={})".format(client, client.round))
 
-            return mila_pb2.Model(
-                json_configuration=self.get_configuration(),
-                latest_checkpoint=self.get_latest_checkpoint()
-            )
+            # the first message carries the configuration, the following ones the rest of the checkpoint
+            chunks = self.get_latest_checkpoint()
+            yield mila_pb2.Model(json_configuration=self.get_configuration(), latest_checkpoint=next(chunks, b""))
+            for chunk in chunks:
+                yield mila_pb2.Model(latest_checkpoint=chunk)
+
+    def SendCheckpoint(self, request_iterator, context) -> EmptyResponse:
+        request = next(request_iterator, None)
+        if request is None:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "No checkpoint received.")
 
-    def SendCheckpoint(self, request, context) -> EmptyResponse:
         if self._validate_token(request.token, context):
+            # chunks are written to disk as they arrive, outside the lock
+            chunks = (message.content for message in itertools.chain([request], request_iterator))
+            self.save_checkpoint(token=request.token, chunks=chunks)
+
             with self.__lock:
-                self.save_checkpoint(token=request.token, content=request.content)
                 self.set_client_status_to_available(request.token)
 
-                if self.are_all_updates_received():
-                    self.aggregate()
-                    self.enable_next_round()
+                if self.are_all_updates_received() and not self._is_aggregating:
+                    self._is_aggregating = True
+                    self._aggregation_pool.submit(self._aggregate_and_advance)
 
             context.set_code(grpc.StatusCode.OK)
             return EmptyResponse()
 
 
+    def _aggregate_and_advance(self) -> None:
+        try:
+            self.aggregate()
+        except Exception as e:
+            logging.exception("Aggregation failed (round={})".format(self._current_round))
+
+            # no further checkpoint will trigger the aggregation again, so the waiting clients are released
+            with self.__lock:
+                self._aggregation_error = str(e)
+                self._is_aggregating = False
+                self.__round_started.notify_all()
+            return
+
+        with self.__lock:
+            self.enable_next_round()
+            self._is_aggregating = False
+            self.__round_started.notify_all()
+
+
 class Server(IOManager):
 
     def __init__(self, config: ServerConfiguration) -> None:
@@ -313,10 +483,16 @@ class Server(IOManager):
             require_client_auth=True
         )
 
-    def run(self, servicer: mila_pb2_grpc.MilaServicer) -> None:
-        workers_count = max(self._config.workers, self._config.minimum_clients)
+    def start(self, servicer: mila_pb2_grpc.MilaServicer) -> None:
+        # each client may hold a (long) streaming or round waiting call and a heartbeat at the same time.
+        # the pool is sized for every client that may register, its threads are only started when needed
+        workers_count = max(self._config.workers, 2 * self._config.maximum_clients)
 
-        self._server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers_count), options=self._config.options)
+        self._server = grpc.server(
+            futures.ThreadPoolExecutor(max_workers=workers_count),
+            options=self._config.options,
+            compression=self._get_compression()
+        )
         mila_pb2_grpc.add_MilaServicer_to_server(servicer, self._server)
 
         if self._config.use_secure_connection:
@@ -327,8 +503,13 @@ class Server(IOManager):
             logging.warning("[CAUTION] Connection is insecure!")
 
         logging.info("Starting server at: [{}]".format(self._config.target))
-
         self._server.start()
+
+    def stop(self) -> None:
+        self._server.stop(grace=None)
+
+    def run(self, servicer: mila_pb2_grpc.MilaServicer) -> None:
+        self.start(servicer=servicer)
         self._server.wait_for_termination()
 
 
@@ -337,9 +518,12 @@ class Client(IOManager):
     def __init__(self, config: ClientConfiguration) -> None:
         self._config = config
         self._token = None
+        self._output_path = None
+        self._channel: Optional[grpc.Channel] = None
+        self._session_ended = Event()
+        self.heartbeat_worker: Optional[Thread] = None
 
-        if not os.path.exists(self._config.save_path):
-            os.makedirs(self._config.save_path)
+        os.makedirs(self._config.save_path, exist_ok=True)
 
         self._validate()
 
@@ -364,25 +548,33 @@ class Client(IOManager):
         if self._config.use_secure_connection:
             credentials = self._get_credentials()
             return grpc.secure_channel(
-                target=self._config.target, credentials=credentials, options=self._config.options
+                target=self._config.target, credentials=credentials, options=self._config.options,
+                compression=self._get_compression()
             )
         else:
             logging.warning("[CAUTION] Connection is insecure!")
-            return grpc.insecure_channel(self._config.target, options=self._config.options)
+            return grpc.insecure_channel(
+                self._config.target, options=self._config.options, compression=self._get_compression()
+            )
 
-    def _store_checkpoint(self, checkpoint: bytes) -> str:
+    def _store_checkpoint(self, chunks: Iterable[bytes]) -> str:
         checkpoint_path = "{}/checkpoint.latest".format(self._config.save_path)
-        with open(checkpoint_path, "wb") as write_buffer:
-            write_buffer.write(checkpoint)
+        self._write_chunks(checkpoint_path, chunks)
 
         return checkpoint_path
 
     def _create_configuration(self, received_configuration: bytes, checkpoint_path: Optional[str]) -> str:
-        configuration = json.loads(received_configuration.decode("utf-8"))
+        configuration = json.loads(received_configuration)  # json accepts utf-8 bytes directly
 
         configuration = {**configuration, **self._config.model_overwrites}  # overwrite values based on settings
         configuration["checkpoint_path"] = checkpoint_path
 
+        if self._config.scratch_path is not None:
+            # training writes to node-local storage, only the resulting checkpoint is copied back
+            self._output_path = configuration["output_path"]
+            os.makedirs(self._config.scratch_path, exist_ok=True)
+            configuration["output_path"] = tempfile.mkdtemp(dir=self._config.scratch_path) + "/"
+
         configuration_path = "{}/config.latest".format(self._config.save_path)
         with open(configuration_path, "w") as write_buffer:
             json.dump(configuration, write_buffer)
@@ -390,8 +582,10 @@ class Client(IOManager):
         return configuration_path
 
     def _retrieve_latest_file(self, folder_path: str) -> str:
-        files = glob("{}/*".format(folder_path))
-        return max(files, key=os.path.getctime)
+        with os.scandir(folder_path) as entries:
+            files = [entry for entry in entries if entry.is_file() and not entry.name.startswith(".")]
+
+        return max(files, key=lambda entry: entry.stat().st_ctime).path
 
     def _train(self, configuration_path: str) -> str:
         config: Type[AbstractConfiguration] = self._reflect(self._config.config_type)
@@ -401,32 +595,51 @@ class Client(IOManager):
         runner = runner(config=config)
         runner.train()
 
-        return self._retrieve_latest_file(config.output_path)
+        checkpoint_path = self._retrieve_latest_file(config.output_path)
+        if self._config.scratch_path is not None:
+            checkpoint_path = self._copy_from_scratch(checkpoint_path, scratch_directory=config.output_path)
+
+        return checkpoint_path
+
+    def _copy_from_scratch(self, checkpoint_path: str, scratch_directory: str) -> str:
+        os.makedirs(self._output_path, exist_ok=True)
+        destination_path = os.path.join(self._output_path, os.path.basename(checkpoint_path))
+
+        shutil.copyfile(checkpoint_path, destination_path)
+        shutil.rmtree(scratch_directory, ignore_errors=True)
+
+        return destination_path
 
     def _invoke(self, method: Callable, *args, **kwargs) -> Any:
-        with self._connect() as channel:
-            while True:
-                try:
-                    stub = mila_pb2_grpc.MilaStub(channel)
-                    kwargs["stub"] = stub
+        # the channel is shared by all calls (and threads), so the connection is only established once
+        if self._channel is None:
+            self._channel = self._connect()
 
-                    return method(*args, **kwargs)
+        kwargs["stub"] = mila_pb2_grpc.MilaStub(self._channel)
+        while True:
+            try:
+                return method(*args, **kwargs)
 
-                except grpc.RpcError as e:
-                    if grpc.StatusCode.RESOURCE_EXHAUSTED == e.code():
-                        sleep(self._config.retry_timeout)
-                        continue
+            except grpc.RpcError as e:
+                if grpc.StatusCode.RESOURCE_EXHAUSTED == e.code():
+                    sleep(self._config.retry_timeout)
+                    continue
 
-                    raise e
+                raise e
 
     def _heartbeat_daemon(self) -> None:
-        while True:
+        while self._token:
+            try:
+                self._invoke(self.heartbeat)
+            except grpc.RpcError:
+                if self._session_ended.is_set():
+                    break  # the session ended while the heartbeat was being sent
 
-            if not self._token:
-                break
+                raise
 
-            self._invoke(self.heartbeat)
-            sleep(self._config.heartbeat_frequency)
+            # woken up as soon as the session ends, so the thread does not outlive it
+            if self._session_ended.wait(self._config.heartbeat_frequency):
+                break
 
     def authenticate(self, stub: mila_pb2_grpc.MilaStub) -> str:
         package = mila_pb2.Client(name=self._config.name)
@@ -450,20 +663,37 @@ class Client(IOManager):
 
     def request_model(self, stub: mila_pb2_grpc.MilaStub) -> str:
         package = mila_pb2.Token(token=self._token)
-        response = stub.RequestModel(package)
+        responses = stub.RequestModel(package)
 
+        response = next(responses)
         checkpoint_path = None
         if response.latest_checkpoint:
-            checkpoint_path = self._store_checkpoint(response.latest_checkpoint)
+            chunks = itertools.chain([response.latest_checkpoint], (chunk.latest_checkpoint for chunk in responses))
+            checkpoint_path = self._store_checkpoint(chunks)
 
         return self._create_configuration(response.json_configuration, checkpoint_path)
 
-    def send_checkpoint(self, checkpoint_path: str, stub: mila_pb2_grpc.MilaStub) -> None:
-        with open(checkpoint_path, "rb") as read_buffer:
-            content = read_buffer.read()
+    def _pack_checkpoint(self, checkpoint_path: str) -> bytes:
+        """
+        Only the model weights are sent, the server has no use for the optimizer and scheduler states.
+        Float tensors can be quantized to int8 (one scale per tensor).
+        """
+        model = torch.load(checkpoint_path, map_location=torch.device("cpu"))["model"]
 
-        package = mila_pb2.Checkpoint(token=self._token, content=content)
-        stub.SendCheckpoint(package)
+        if self._config.quantize_checkpoint:
+            for key, value in model.items():
+                if value.dtype == torch.float32 and value.numel() > 0:
+                    scale = value.abs().max().item() / 127 or 1.0
+                    model[key] = torch.quantize_per_tensor(value, scale=scale, zero_point=0, dtype=torch.qint8)
+
+        buffer = io.BytesIO()
+        torch.save({"model": model}, buffer)
+
+        return buffer.getvalue()
+
+    def send_checkpoint(self, checkpoint_path: str, stub: mila_pb2_grpc.MilaStub) -> None:
+        chunks = self._split_chunks(self._pack_checkpoint(checkpoint_path))
+        stub.SendCheckpoint(mila_pb2.Checkpoint(token=self._token, content=chunk) for chunk in chunks)
 
     def run(self) -> None:
         try:
@@ -472,6 +702,7 @@ class Client(IOManager):
             pass
         try:
             self._token = self._invoke(self.authenticate)
+            self._session_ended.clear()
 
             self.heartbeat_worker = Thread(target=self._heartbeat_daemon)
             self.heartbeat_worker.daemon = True
@@ -495,6 +726,33 @@ class Client(IOManager):
             logging.error("[internal error] {}".format(e))
             self._invoke(self.close)
 
+        finally:
+            # client processes are reused across folds: the heartbeats of this session stop before the channel closes
+            self._token = None
+            self._session_ended.set()
+            if self.heartbeat_worker is not None:
+                self.heartbeat_worker.join()
+                self.heartbeat_worker = None
+
+            if self._channel is not None:
+                self._channel.close()
+                self._channel = None
+
+def _run_client(config: ClientConfiguration) -> None:
+    Client(config=config).run()
+
+
+class FoldSlot(NamedTuple):
+    """
+    A server (with its own port and save path) on which one fold is trained at a time.
+    """
+    index: int
+    config: ServerConfiguration
+    server: Server
+    servicer: DefaultServicer
+    clients: List[ClientConfiguration]
+
+
 class CrossValidation(IOManager):
 
     def __init__(self, config: CVConfiguration):
@@ -505,6 +763,32 @@ class CrossValidation(IOManager):
         self.streamer = self.get_validation_streamer()
         self.mp_context = get_context('spawn')
 
+        slots_count = max(1, min(self._config.parallel_folds, self._config.num_folds))
+
+        # client processes are reused across folds, so the interpreter and torch are only loaded once
+        self._pool = futures.ProcessPoolExecutor(
+            max_workers=len(self._cfg_clients) * slots_count, mp_context=self.mp_context
+        )
+
+        # servers are reset for every fold instead of being restarted
+        self._fold_slots = []
+        for index in range(slots_count):
+            cfg_server = self.get_slot_server_config(index)
+            server, servicer = Server(config=cfg_server), DefaultServicer(config=cfg_server)
+            self._fold_slots.append(FoldSlot(
+                index=index, config=cfg_server, server=server, servicer=servicer,
+                clients=self.get_slot_client_configs(index)
+            ))
+
+        self._slots: "Queue[FoldSlot]" = Queue()  # slots not used by a fold at the moment
+
+        # only the training runs concurrently: every model configuration resets the global observers (and seeds),
+        # which would change the predictions of another fold being evaluated
+        self._evaluation_lock = Lock()
+        self._cleanup_pool = futures.ThreadPoolExecutor(max_workers=len(self._cfg_clients) + 1)
+        for slot in self._fold_slots:
+            self._slots.put(slot)
+
     def init_model_cfg(self):
         _cfg_model = Config.from_json(self._cfg_server.task_configuration_file)
         update = dict()
@@ -529,40 +813,93 @@ class CrossValidation(IOManager):
         parameter which enable us to train on the right dataset part.
         Then we run each experiment seperatly and concatenate the results.
         """
-        result_log = []
-        result = {k:[] for k in self._cfg_model.loader["target_column_names"]}
-        for id_fold in tqdm(range(self._config.num_folds)):
-            self.delete_logs()
-            fold_result = self.launch_and_evaluate(id_fold)
-            result_log.append(fold_result)
-            for i, values in enumerate(vars(fold_result)[self._cfg_model.target_metric]):
-                key = self._cfg_model.loader["target_column_names"][i]
-                result[key].append(abs(values))
-        for k, v in result.items():
-            logging.info(f"[{k}]  mean_cv {np.mean(v)} ± {np.std(v)}")
+        result_log = [None] * self._config.num_folds
+        target_names = self._cfg_model.loader["target_column_names"]
+        metrics = np.empty((self._config.num_folds, len(target_names)))
+
+        for slot in self._fold_slots:
+            slot.server.start(servicer=slot.servicer)
+
+        try:
+            with self._pool, self._cleanup_pool, futures.ThreadPoolExecutor(len(self._fold_slots)) as fold_pool:
+                fold_futures = {
+                    fold_pool.submit(self.launch_and_evaluate, id_fold): id_fold
+                    for id_fold in range(self._config.num_folds)
+                }
+                for future in tqdm(futures.as_completed(fold_futures), total=len(fold_futures)):
+                    id_fold = fold_futures[future]
+                    result_log[id_fold] = future.result()
+                    metrics[id_fold] = np.abs(vars(result_log[id_fold])[self._cfg_model.target_metric])
+        finally:
+            for slot in self._fold_slots:
+                slot.server.stop()
+
+        for k, mean, std in zip(target_names, metrics.mean(axis=0), metrics.std(axis=0)):
+            logging.info(f"[{k}]  mean_cv {mean} ± {std}")
+
+        result = {k: metrics[:, i].tolist() for i, k in enumerate(target_names)}
 
         self.log_result(Namespace.reduce(result_log, ConfidenceInterval.compute))
         self.save_results(result)
         return result
 
 
-    def update_client_config(self, id_fold: int = None):
+    def get_slot_path(self, path: str, index: int) -> str:
+        return path if index == 0 else "{}_{}/".format(path.rstrip("/"), index)
+
+    def get_slot_target(self, target: str, index: int) -> str:
+        if index == 0:
+            return target
+
+        host, port = target.rsplit(":", 1)
+        return "{}:{}".format(host, int(port) + index)
+
+    def get_slot_server_config(self, index: int) -> ServerConfiguration:
+        """
+        The first slot uses the server configuration as is, the next ones listen on the following ports.
+        """
+        if index == 0:
+            return self._cfg_server
+
+        return self._cfg_server._replace(
+            target=self.get_slot_target(self._cfg_server.target, index),
+            save_path=self.get_slot_path(self._cfg_server.save_path, index)
+        )
+
+    def get_slot_client_configs(self, index: int) -> List[ClientConfiguration]:
         """
-        Set an id_fold in each client config. Since the seed is set the folds will be the same
+        Client configurations of a slot, everything that does not depend on the fold is set once here.
         """
         cfg_clients = []
         for cfg_client in self._cfg_clients:
-            cfg_client = cfg_client._asdict()
-            cfg_client["model_overwrites"]["subset"]["id_fold"] = id_fold
-            cfg_client["seed"] = self._config.seed
-            try:
-                cfg_client["model_overwrites"]["cross_validation_folds"] = self._config.num_folds
-                cfg_client["model_overwrites"]["splitter"] = self._cfg_model.splitter
-                cfg_client["model_overwrites"]["splitter"]["id_fold_mila"] = id_fold
-                cfg_client["model_overwrites"]["splitter"]["client_distribution"] = cfg_client["model_overwrites"]["subset"]["distribution"]
-            except:
-                pass
-            cfg_clients.append(ClientConfiguration(**cfg_client))
+            model_overwrites = deepcopy(cfg_client.model_overwrites)
+            model_overwrites["cross_validation_folds"] = self._config.num_folds
+            if "output_path" in model_overwrites:
+                model_overwrites["output_path"] = self.get_slot_path(model_overwrites["output_path"], index)
+
+            cfg_clients.append(cfg_client._replace(
+                seed=self._config.seed,
+                target=self.get_slot_target(cfg_client.target, index),
+                save_path=self.get_slot_path(cfg_client.save_path, index),
+                model_overwrites=model_overwrites
+            ))
+
+        return cfg_clients
+
+    def update_client_config(self, id_fold: int, slot: FoldSlot) -> List[ClientConfiguration]:
+        """
+        Set an id_fold in each client config. Since the seed is set the folds will be the same.
+        Only the dictionaries which change are copied, the rest is shared with the slot configurations.
+        """
+        cfg_clients = []
+        for cfg_client in slot.clients:
+            model_overwrites = {**cfg_client.model_overwrites}
+            model_overwrites["subset"] = {**model_overwrites["subset"], "id_fold": id_fold}
+            model_overwrites["splitter"] = {**self._cfg_model.splitter, "id_fold_mila": id_fold}
+            if "distribution" in model_overwrites["subset"]:
+                model_overwrites["splitter"]["client_distribution"] = model_overwrites["subset"]["distribution"]
+
+            cfg_clients.append(cfg_client._replace(model_overwrites=model_overwrites))
 
         return cfg_clients
 
@@ -572,46 +909,45 @@ class CrossValidation(IOManager):
         Wrap the few function necessary to run and evaluate a training.
         :param: id_fold: id of the fold to run
         """
-        # Update all client config
-        cfg_clients = self.update_client_config(id_fold)
+        slot = self._slots.get()
+        try:
+            self.delete_logs(slot)
 
-        # Launch experiment
-        self.launch_training(cfg_clients)
+            # Update all client config
+            cfg_clients = self.update_client_config(id_fold, slot)
+
+            # Launch experiment
+            self.launch_training(cfg_clients, slot)
+
+            # Evaluate experiment
+            with self._evaluation_lock:
+                results = self.evaluate_all(id_fold, slot.config)
+        finally:
+            self._slots.put(slot)
 
-        # Evaluate experiment
-        results = self.evaluate_all(id_fold)
         return results
 
 
-    def launch_training(self, cfg_clients: List[ClientConfiguration]):
+    def launch_training(self, cfg_clients: List[ClientConfiguration], slot: FoldSlot):
         """
         Launch a server and the right number of workers based on the configuration
         file provided.
         :param: cfg_clients: Config of different client which have been updated
+        :param: slot: Server on which the fold is trained
         """
         torch.manual_seed(self._config.seed)
         np.random.seed(self._config.seed)
-        # Server launch
-        server = Server(config=self._cfg_server)
-        servicer = DefaultServicer(config=self._cfg_server)
-        server_thread = Thread(target=server.run, args=(servicer, ))
-        server_thread.start()
-        sleep(5)
+        # Server reset (the server itself is already listening)
+        slot.servicer.reset()
         # Clients launch
-        clients = [Client(config=config) for config in cfg_clients]
-        client_threads = [self.mp_context.Process(target=client.run) for client in clients]
-        for t in client_threads:
-            t.start()
-        for t in client_threads:
-            t.join()
-
-        server._server.stop(grace=None)
+        client_futures = [self._pool.submit(_run_client, config) for config in cfg_clients]
+        futures.wait(client_futures)
 
-        if sum([t.exitcode for t in client_threads]) != 0:
+        if any(future.exception() is not None for future in client_futures):
             raise Exception("One of the client finish with an error")
 
 
-    def evaluate_all(self, id_fold):
+    def evaluate_all(self, id_fold, cfg_server: ServerConfiguration):
         """
         Evaluate all aggregate of the server and return the best metrics.
         """
@@ -619,8 +955,8 @@ class CrossValidation(IOManager):
         np.random.seed(self._config.seed)
         results = []
 
-        for _round in range(1, self._cfg_server.rounds_count + 1):
-            file_to_evaluate = f"{self._cfg_server.save_path}{_round}.aggregate"
+        for _round in range(1, cfg_server.rounds_count + 1):
+            file_to_evaluate = f"{cfg_server.save_path}{_round}.aggregate"
             cfg_model = self.update_model_config(file_to_evaluate, id_fold)
             data_loader = self.streamer.get(
                     split_name=self.streamer.get_fold_name(id_fold),
@@ -632,7 +968,7 @@ class CrossValidation(IOManager):
 
         if self._config.save_results:
             best_round = Namespace.reduce(results, partial(np.argmax, axis=0)).__getattribute__(self._cfg_model.target_metric)[0]
-            best_file = f"{self._cfg_server.save_path}{best_round}.aggregate"
+            best_file = f"{cfg_server.save_path}{best_round}.aggregate"
             cfg_best_model = self.update_model_config(best_file, id_fold)
             Executor(cfg_best_model).predict()
             shutil.copy(best_file, Path(self._config.output_path) / f"run_{id_fold}")
@@ -663,21 +999,23 @@ class CrossValidation(IOManager):
         update["output_path"] = str(Path(self._config.output_path) / f"run_{id_fold}")
         return self._cfg_model.cloned_update(**update)
 
-    def delete_logs(self):
+    def delete_logs(self, slot: FoldSlot):
         """
-        Delete all client and server logs
+        Delete all client and server logs of a slot
         """
-        for _dir in [c.save_path for c in self._cfg_clients] + [self._cfg_server.save_path]:
+        for _dir in [c.save_path for c in slot.clients] + [slot.config.save_path]:
             if os.path.isdir(_dir):
-                shutil.rmtree(_dir)
+                # renaming is instant, the actual deletion happens in the background while the fold runs
+                trash_dir = "{}.{}.deleted".format(_dir.rstrip("/"), uuid.uuid4())
+                os.rename(_dir, trash_dir)
+                self._cleanup_pool.submit(shutil.rmtree, trash_dir, ignore_errors=True)
 
 
     def save_results(self, result):
         """
         Save final aggregation of result in a pickle file.
         """
-        if not os.path.exists(self._config.output_path):
-            os.makedirs(self._config.output_path)
+        os.makedirs(self._config.output_path, exist_ok=True)
         with open(Path(f"{self._config.output_path}") / 'result_pickle.pkl', "wb") as file:
             pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
         print(f"Results saved at {self._config.output_path}")
@@ -1,11 +1,15 @@
 import logging
 from argparse import ArgumentParser
 from collections import defaultdict
-from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property, partial
 from itertools import chain
 import json
+from multiprocessing import get_context
 from pathlib import Path
-from typing import Callable, Dict, List, Optional, Tuple, Union
+import pickle
+import sqlite3
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import joblib
 import numpy as np
@@ -18,7 +22,7 @@ import torch
 from federated_learning.lib.core.config import Config
 from federated_learning.lib.core.helpers import ConfidenceInterval, Namespace
 from federated_learning.lib.core.tuning import OptunaTemplateParser
-from federated_learning.lib.data.resources import DataPoint
+from federated_learning.lib.data.resources import BackgroundPrefetcher
 from federated_learning.lib.data.streamers import (CVSubsetStreamer, CategoricalCVSubsetStreamer, CategoricalSreamer, CrossValidationStreamer, GeneralStreamer,
                                 SubsetStreamer)
 from federated_learning.lib.model.executors import (LearningRareFinder, Pipeliner, Predictor,
@@ -27,17 +31,55 @@ from federated_learning.lib.model.metrics import CsvLogger, PredictionProcessor
 from federated_learning.mila.factories import AbstractExecutor
 
 
+def _train_fold(config: Config, fold: int, seed: int) -> None:
+    # unpickling skips "__post_init__", rebuilding the config registers the observers (and differential privacy)
+    # and configures logging in the fold process
+    config = config.cloned_update()
+
+    torch.manual_seed(seed)
+    np.random.seed(seed % 2 ** 32)
+
+    streamer = CrossValidationStreamer(config=config)
+    Pipeliner(config=config).train(
+        data_loader=streamer.get(
+            split_name=streamer.get_fold_name(fold),
+            mode=CrossValidationStreamer.Mode.TRAIN,
+            batch_size=config.batch_size,
+            shuffle=True,
+        )
+    )
+
+
+def _run_study_worker(config_path: str, worker: int, seed: int) -> None:
+    torch.manual_seed(seed)
+    np.random.seed(seed % 2 ** 32)
+
+    Executor(config=Config.from_json(config_path), config_path=config_path)._optimize_worker(worker)
+
+
 class Executor(AbstractExecutor):
     def __init__(self, config: Config, config_path: Optional[str] = ""):
         super().__init__(config)
         self._config_path = config_path
 
+    @cached_property
+    def _streamer(self) -> GeneralStreamer:
+        """Loading (and featurizing) the dataset is expensive, jobs running on the same executor share the streamer"""
+        return GeneralStreamer(config=self._config)
+
+    @cached_property
+    def _cv_streamer(self) -> CrossValidationStreamer:
+        return CrossValidationStreamer(config=self._config)
+
     def __log_results(
         self,
         results: Namespace,
         labels: List[str],
         statistics: Tuple[Callable, ...] = (np.min, np.max, np.mean, np.median, np.std),
     ):
+        if not self._config.is_main_process():
+            return
+
         logger = CsvLogger()
 
         logger.log_header(labels)
@@ -57,11 +99,44 @@ class Executor(AbstractExecutor):
                     "[Notice] Cannot compute statistics. Some metrics could not be computed for all targets."
                 )
 
-    def __revert_transformers(self, predictions: np.ndarray, streamer: GeneralStreamer):
-        data = DataPoint(outputs=predictions.tolist())
-        streamer.reverse_transformers(data)
+    def __train_folds(self, streamer: CrossValidationStreamer) -> List[Pipeliner]:
+        """
+        Train a pipeliner per fold. With "parallel_folds" > 1, folds are trained concurrently in separate processes,
+        each using one of the enabled GPUs (round-robin). The trained pipeliners are returned for evaluation.
+        """
+        configs = [
+            self._config.cloned_update(output_path="{}/.{}/".format(self._config.output_path, fold))
+            for fold in range(self._config.cross_validation_folds)
+        ]
+
+        if self._config.parallel_folds <= 1 or self._config.is_distributed():
+            pipeliners = []
+            for fold, config in enumerate(configs):
+                pipeliner = Pipeliner(config=config)
+                pipeliner.train(
+                    data_loader=streamer.get(
+                        split_name=streamer.get_fold_name(fold),
+                        mode=CrossValidationStreamer.Mode.TRAIN,
+                        batch_size=self._config.batch_size,
+                        shuffle=True,
+                    )
+                )
+                pipeliners.append(pipeliner)
+
+            return pipeliners
 
-        return data.outputs
+        gpus = self._config.enabled_gpus
+        if gpus:  # CPU runs keep the configured device
+            configs = [
+                config.cloned_update(enabled_gpus=[gpus[fold % len(gpus)]]) for fold, config in enumerate(configs)
+            ]
+
+        with ProcessPoolExecutor(max_workers=self._config.parallel_folds, mp_context=get_context("spawn")) as executor:
+            folds = range(len(configs))
+            seeds = [torch.initial_seed() + fold for fold in folds]  # folds don't start from identical weights
+            list(executor.map(_train_fold, configs, folds, seeds))
+
+        return [Pipeliner(config=config) for config in configs]
 
     def __run_trial(self, config: Config) -> float:
         try:
@@ -69,7 +144,8 @@ class Executor(AbstractExecutor):
             executor.train()
 
             results = executor.analyze()
-            joblib.dump(results, "{}/.metrics.pkl".format(config.output_path))
+            if self._config.save_trial_metrics:
+                joblib.dump(results, "{}/.metrics.pkl".format(config.output_path), protocol=pickle.HIGHEST_PROTOCOL)
 
             best = getattr(results, self._config.target_metric)
             return float(np.mean(best))
@@ -132,7 +208,7 @@ class Executor(AbstractExecutor):
                     )
                 )
         else:
-            streamer = GeneralStreamer(config=self._config)
+            streamer = self._streamer
             Pipeliner(config=self._config).train(
                 data_loader=streamer.get(
                     split_name=self._config.train_split,
@@ -143,7 +219,7 @@ class Executor(AbstractExecutor):
 
     def eval(self):
         if self._config.subset and "id_fold" in self._config.subset.keys():
-            streamer = CrossValidationStreamer(config=self._config)
+            streamer = self._cv_streamer
             results = (
                 Pipeliner(config=self._config)
                 .initialize_predictor()
@@ -157,7 +233,7 @@ class Executor(AbstractExecutor):
                 )
             )
         else:
-            streamer = GeneralStreamer(config=self._config)
+            streamer = self._streamer
             results = (
                 Pipeliner(config=self._config)
                 .initialize_predictor()
@@ -174,7 +250,7 @@ class Executor(AbstractExecutor):
         return results
 
     def analyze(self):
-        streamer = GeneralStreamer(config=self._config)
+        streamer = self._streamer
         data_loader = streamer.get(
             split_name=self._config.test_split,
             batch_size=self._config.batch_size,
@@ -201,23 +277,10 @@ class Executor(AbstractExecutor):
         aggregate results (compute metric averages and confidence interval)
         """
         assert self._config.splitter['type'] != 'Categorical', "mean_cv is only supported in federated learning setting for categorical splitting"
-        streamer = CrossValidationStreamer(config=self._config)
+        streamer = self._cv_streamer
         all_results = []
 
-        for fold in range(self._config.cross_validation_folds):
-            output_path = "{}/.{}/".format(self._config.output_path, fold)
-            config = self._config.cloned_update(output_path=output_path)
-            pipeliner = Pipeliner(config=config)
-
-            pipeliner.train(
-                data_loader=streamer.get(
-                    split_name=streamer.get_fold_name(fold),
-                    mode=CrossValidationStreamer.Mode.TRAIN,
-                    batch_size=self._config.batch_size,
-                    shuffle=True,
-                )
-            )
-
+        for fold, pipeliner in enumerate(self.__train_folds(streamer)):
             # evaluate all checkpoints for the current fold
             fold_results = pipeliner.evaluate_all(
                 data_loader=streamer.get(
@@ -249,25 +312,12 @@ class Executor(AbstractExecutor):
             run inference on the test data (concatenating the output)
         compute metrics on the predicted values in one go
         """
-        streamer = CrossValidationStreamer(config=self._config)
+        streamer = self._cv_streamer
 
         ground_truth = []
         logits = []
 
-        for fold in range(self._config.cross_validation_folds):
-            output_path = "{}/.{}/".format(self._config.output_path, fold)
-            config = self._config.cloned_update(output_path=output_path)
-            pipeliner = Pipeliner(config=config)
-
-            pipeliner.train(
-                data_loader=streamer.get(
-                    split_name=streamer.get_fold_name(fold),
-                    mode=CrossValidationStreamer.Mode.TRAIN,
-                    batch_size=self._config.batch_size,
-                    shuffle=True,
-                )
-            )
-
+        for fold, pipeliner in enumerate(self.__train_folds(streamer)):
             test_loader = streamer.get(
                 split_name=streamer.get_fold_name(fold),
                 mode=CrossValidationStreamer.Mode.TEST,
@@ -299,23 +349,10 @@ class Executor(AbstractExecutor):
             compute metrics on the predicted values in one go
         return the best checkpoint metrics
         """
-        streamer = CrossValidationStreamer(config=self._config)
+        streamer = self._cv_streamer
         folds = {}
 
-        for fold in range(self._config.cross_validation_folds):
-            output_path = "{}/.{}/".format(self._config.output_path, fold)
-            config = self._config.cloned_update(output_path=output_path)
-            pipeliner = Pipeliner(config=config)
-
-            pipeliner.train(
-                data_loader=streamer.get(
-                    split_name=streamer.get_fold_name(fold),
-                    mode=CrossValidationStreamer.Mode.TRAIN,
-                    batch_size=self._config.batch_size,
-                    shuffle=True,
-                )
-            )
-
+        for fold, pipeliner in enumerate(self.__train_folds(streamer)):
             folds[pipeliner] = streamer.get(
                 split_name=streamer.get_fold_name(fold),
                 mode=CrossValidationStreamer.Mode.TEST,
@@ -333,8 +370,8 @@ class Executor(AbstractExecutor):
             logits = []
 
             for pipeliner, test_loader in folds.items():
-                pipeliner._config.checkpoint_path = "{}/checkpoint.{}".format(
-                    pipeliner._config.output_path, checkpoint_id
+                pipeliner.config.checkpoint_path = "{}/checkpoint.{}".format(
+                    pipeliner.config.output_path, checkpoint_id
                 )
 
                 pipeliner.initialize_predictor()
@@ -354,61 +391,67 @@ class Executor(AbstractExecutor):
         return results
 
     def _collect_predictions(self):
-        streamer = GeneralStreamer(config=self._config)
+        streamer = self._streamer
         data_loader = streamer.get(
             split_name=self._config.test_split,
             batch_size=self._config.batch_size,
             shuffle=False,
         )
         predictor = Predictor(config=self._config)
-        transformer_reverter = partial(self.__revert_transformers, streamer=streamer)
+        store = partial(self.__store, samples=data_loader.samples)
 
         results = defaultdict(list)
         outputs_to_save = defaultdict(list)
+
+        # outputs stay on the device until all batches are predicted, then each is copied back once
+        device_outputs = {}
+        offset = 0
         for batch in data_loader.dataset:
             outputs = predictor.run(batch)
-            logits = outputs.logits
-            variances = getattr(outputs, "logits_var", None)
-            hidden_layer_output = getattr(outputs, "hidden_layer", None)
+            for key in ("logits", "logits_var", "hidden_layer"):
+                values = getattr(outputs, key, None)
+                if values is not None:
+                    store(device_outputs, key, values, offset)
 
-            if hidden_layer_output is not None:
-                outputs_to_save["hidden_layer"].extend(
-                    hidden_layer_output.cpu().numpy()
-                )
-
-            predictions = PredictionProcessor.apply_threshold(
-                logits, self._config.threshold
-            )
-            predictions = np.apply_along_axis(
-                transformer_reverter, axis=1, arr=predictions
-            )
-            results["predictions"].extend(predictions)
             results["id"].extend(batch.ids)
             outputs_to_save["id"].extend(batch.ids)
+            offset += len(batch.ids)
 
-            if variances is not None:
-                results["variances"].extend(variances.cpu().numpy())
+        if "logits" in device_outputs:
+            predictions = PredictionProcessor.apply_threshold(device_outputs["logits"], self._config.threshold)
+            results["predictions"] = streamer.reverse_transformers_batch(predictions)
 
-        results["predictions"] = np.vstack(results["predictions"])
-        if "variances" in results:
-            results["variances"] = np.vstack(results["variances"])
-        if "hidden_layer" in outputs_to_save:
-            outputs_to_save["hidden_layer"] = np.vstack(outputs_to_save["hidden_layer"]).tolist()
+        if "logits_var" in device_outputs:
+            results["variances"] = device_outputs["logits_var"].cpu().numpy()
+
+        if "hidden_layer" in device_outputs:
+            outputs_to_save["hidden_layer"] = device_outputs["hidden_layer"].cpu().numpy().tolist()
 
         return results, outputs_to_save, streamer.labels
 
+    @staticmethod
+    def __store(container: Dict[str, torch.Tensor], key: str, values: torch.Tensor, offset: int, samples: int) -> None:
+        """
+        Outputs are written in tensors allocated once for the whole split (when the first batch is seen).
+        They are gathered on the device the predictions were made on, without synchronizing with it.
+        """
+        if key not in container:
+            container[key] = values.new_empty((samples, *values.shape[1:]))
+
+        container[key][offset:offset + len(values)] = values
+
     def predict(self) -> List[List[float]]:
         results, outputs_to_save, labels = self._collect_predictions()
 
-        columns = ["id"]
-        for i, label in enumerate(labels):
-            results[label] = results["predictions"][:, i]
-            columns.append(label)
-            if "variances" in results:
-                results[f"{label}_logits_var"] = results["variances"][:, i]
-                columns.append(f"{label}_logits_var")
+        # frames are built from the whole arrays, the variance of each label follows its prediction
+        frames = [pd.DataFrame({"id": results["id"]}), pd.DataFrame(results["predictions"], columns=labels)]
+        columns = ["id", *labels]
+        if "variances" in results:
+            variance_labels = [f"{label}_logits_var" for label in labels]
+            frames.append(pd.DataFrame(results["variances"], columns=variance_labels))
+            columns = ["id", *chain.from_iterable(zip(labels, variance_labels))]
 
-        results = pd.DataFrame.from_dict({c: results[c] for c in columns})
+        results = pd.concat(frames, axis=1)[columns]
 
         predictions_dir =  Path(self._config.output_path)
         output_file = predictions_dir / "predictions.csv"
@@ -418,12 +461,60 @@ class Executor(AbstractExecutor):
 
         if len(outputs_to_save) > 1:
             output_file = predictions_dir / "saved_outputs.json"
+            # encoded in one go by the C encoder, json.dump would write each token separately
             with output_file.open("w") as f:
-                json.dump(outputs_to_save, f)
+                f.write(json.dumps(outputs_to_save))
             logging.info(f"Additional outputs saved to {str(output_file)}")
 
         return results
 
+    def __get_study_storage(self) -> Dict[str, Any]:
+        """
+        Parallel searches keep the study in an SQLite database shared by the worker processes
+        (in WAL mode, so concurrent trials don't block each other on writes). Sequential searches stay in memory.
+        """
+        if self._config.optuna_workers <= 1:
+            return {}
+
+        database_path = "{}optuna.db".format(self._config.output_path)
+        with sqlite3.connect(database_path) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+
+        return {
+            "storage": "sqlite:///{}".format(database_path),
+            "study_name": Path(self._config.output_path).name or "study",
+        }
+
+    def __create_template_parser(self, worker: Optional[int] = None) -> OptunaTemplateParser:
+        if worker is None:
+            return OptunaTemplateParser(
+                template_path=self._config_path,
+                evaluator=self.__run_trial,
+                delete_checkpoints=True,
+                log_path="{}summary.csv".format(self._config.output_path),
+            )
+
+        gpus = self._config.enabled_gpus
+        return OptunaTemplateParser(
+            template_path=self._config_path,
+            evaluator=self.__run_trial,
+            delete_checkpoints=True,
+            log_path="{}summary_{}.csv".format(self._config.output_path, worker),
+            devices=[gpus[worker % len(gpus)]] if gpus else None,  # CPU runs keep the configured device
+        )
+
+    def _optimize_worker(self, worker: int) -> None:
+        """
+        Runs a share of the trials of a parallel search. Each worker is a separate process: configurations
+        register their observers globally, trials sharing a process would overwrite each other's.
+        """
+        workers = self._config.optuna_workers
+        trials = self._config.optuna_trials // workers + int(worker < self._config.optuna_trials % workers)
+
+        with self.__create_template_parser(worker=worker) as template_parser:
+            study = optuna.load_study(**self.__get_study_storage())
+            study.optimize(template_parser.objective, n_trials=trials)
+
     def optimize(self) -> optuna.Study:
         if not self._config_path:
             raise AttributeError("Cannot optimize. No configuration path specified.")
@@ -437,12 +528,21 @@ class Executor(AbstractExecutor):
             logging.info("---------------------------- [BEST PARAMS] ----------------------------")
             logging.info(study.best_params)
 
-        with OptunaTemplateParser(
-            template_path=self._config_path,
-            evaluator=self.__run_trial,
-            delete_checkpoints=True,
-            log_path="{}summary.csv".format(self._config.output_path),
-        ) as template_parser:
+        if self._config.optuna_workers > 1:
+            study = optuna.create_study(direction='maximize', load_if_exists=True, **self.__get_study_storage())
+            if self._config.optuna_init:
+                study.enqueue_trial(self._config.optuna_init)
+
+            workers = range(self._config.optuna_workers)
+            seeds = [torch.initial_seed() + worker for worker in workers]
+            with ProcessPoolExecutor(max_workers=len(workers), mp_context=get_context("spawn")) as executor:
+                list(executor.map(_run_study_worker, [self._config_path] * len(workers), workers, seeds))
+
+            study = optuna.load_study(**self.__get_study_storage())
+            log_summary(study)
+            return study
+
+        with self.__create_template_parser() as template_parser:
 
             study = optuna.create_study(direction='maximize')
             if self._config.optuna_init:
@@ -457,7 +557,7 @@ class Executor(AbstractExecutor):
         return study
 
     def find_best_checkpoint(self) -> str:
-        streamer = GeneralStreamer(config=self._config)
+        streamer = self._streamer
         Pipeliner(self._config).find_best_checkpoint(
             data_loader=streamer.get(
                 split_name=self._config.test_split,
@@ -478,7 +578,7 @@ class Executor(AbstractExecutor):
         if not self._config.checkpoint_path:
             self.find_best_checkpoint()
 
-        streamer = GeneralStreamer(config=self._config)
+        streamer = self._streamer
         data_loader = streamer.get(
             split_name=self._config.train_split,
             batch_size=self._config.batch_size,
@@ -494,7 +594,7 @@ class Executor(AbstractExecutor):
         return threshold
 
     def find_learning_rate(self):
-        streamer = GeneralStreamer(config=self._config)
+        streamer = self._streamer
         data_loader = streamer.get(
             split_name=self._config.train_split,
             batch_size=self._config.batch_size,
@@ -507,23 +607,24 @@ class Executor(AbstractExecutor):
     def visualize(self):
         from federated_learning.lib.visualization.models import IntegratedGradientsExplainer
 
-        streamer = GeneralStreamer(config=self._config)
+        streamer = self._streamer
         data_loader = streamer.get(
             split_name=self._config.test_split, batch_size=1, shuffle=False
         )
         network = Pipeliner(config=self._config).get_network()
 
         with IntegratedGradientsExplainer(network, self._config) as visualizer:
-            for sample_id, batch in enumerate(tqdm(data_loader.dataset)):
+            # the next samples are prepared while the attributions of the current one are computed
+            for sample_id, batch in enumerate(tqdm(BackgroundPrefetcher(data_loader.dataset))):
                 for target_id in self._config.visualizer["targets"]:
                     save_path = "sample_{}_target_{}.png".format(sample_id, target_id)
                     visualizer.visualize(batch, target_id, save_path)
 
     def preload(self) -> None:
-        GeneralStreamer(config=self._config)
+        self._streamer
 
     def splits(self) -> Dict[str, List[Union[int, str]]]:
-        streamer = GeneralStreamer(config=self._config)
+        streamer = self._streamer
 
         for split_name, split_values in streamer.splits.items():
             print(split_name)